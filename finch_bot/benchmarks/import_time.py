@@ -0,0 +1,76 @@
+"""Import-time report for the bot module.
+
+Запуск из папки finch_bot::
+
+    python -m benchmarks.import_time --top 15 --budget-ms 500
+
+Импорт ``bot`` выполняется в отдельном интерпретаторе с ``-X importtime``, чтобы
+кэш модулей текущего процесса не влиял на замер. При превышении бюджета скрипт
+завершается с ненулевым кодом, так что его можно запускать в CI.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Модули, которые не должны загружаться при импорте бота (загружаются при первом обращении)
+DEFERRED_MODULES = ("numpy",)
+
+def measure(module: str = "bot") -> List[Tuple[str, int, int]]:
+    """Импортирует модуль в новом интерпретаторе и возвращает (модуль, собственное, суммарное время в мкс)"""
+    env = dict(os.environ, BOT_TOKEN=os.environ.get("BOT_TOKEN", "123456:IMPORTTIME"), PYTHONWARNINGS="ignore")
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, env=env, check=True
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(own), int(cumulative)))
+    return rows
+
+def report(rows: List[Tuple[str, int, int]], top: int) -> Dict[str, object]:
+    """Общее время импорта, самые медленные модули и отложенные модули, попавшие в импорт"""
+    total = max((cumulative for _, _, cumulative in rows), default=0)
+    names = {name for name, _, _ in rows}
+    return {
+        "total_ms": total / 1000,
+        "modules": len(rows),
+        "slowest": [
+            (name, cumulative / 1000)
+            for name, _, cumulative in sorted(rows, key=lambda row: row[2], reverse=True)[:top]
+        ],
+        "deferred_loaded": [module for module in DEFERRED_MODULES if module in names],
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="Время импорта модуля бота")
+    parser.add_argument("--module", default="bot", help="какой модуль импортировать")
+    parser.add_argument("--top", type=int, default=15, help="сколько самых медленных модулей показать")
+    parser.add_argument("--budget-ms", type=float, help="допустимое время импорта, мс")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Печатает отчет и проверяет бюджет времени импорта"""
+    args = parse_args(argv)
+    result = report(measure(args.module), args.top)
+    print(f"import {args.module}: {result['total_ms']:.1f} мс, модулей: {result['modules']}")
+    for name, cumulative in result["slowest"]:
+        print(f"  {cumulative:8.1f} мс  {name}")
+
+    failed = False
+    if result["deferred_loaded"]:
+        print(f"При импорте загружены отложенные модули: {', '.join(result['deferred_loaded'])}")
+        failed = True
+    if args.budget_ms is not None and result["total_ms"] > args.budget_ms:
+        print(f"Превышен бюджет: {result['total_ms']:.1f} мс > {args.budget_ms:.1f} мс")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""Load test of the conversation flows with thousands of synthetic users.
+
+Запуск из папки finch_bot::
+
+    python -m benchmarks.load_test --users 2000 --concurrency 500 --output results.json
+
+Бот собирается через ``bot.build_application()`` (при ``--workers`` > 1 — основной процесс
+из ``sharding.py`` с процессами-обработчиками) и работает против временной БД,
+локальной заглушки MOEX ISS и фейкового Bot API на 127.0.0.1. Заглушки работают в отдельном
+процессе, чтобы их работа не попадала в задержки обработчиков и цикла событий бота.
+Результаты печатаются в JSON, чтобы их можно было сравнивать между коммитами.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Any, DefaultDict, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.stubs import StubServer
+
+REPLY_TIMEOUT = 30.0  # секунд на ответ бота, после которых шаг считается ошибкой
+LAG_INTERVAL = 0.01  # период замера задержки цикла событий, секунд
+
+def configure_environment(workdir: str, base_url: str, keep_rate_limits: bool, workers: int) -> None:
+    """Направляет бота на временную БД и локальные заглушки (до импорта config)"""
+    os.environ.update({
+        "BOT_TOKEN": "123456:BENCHMARK",
+        "BOT_MODE": "polling",
+        "DB_PATH": os.path.join(workdir, "finch.db"),
+        "HISTORY_DB_PATH": os.path.join(workdir, "history.db"),
+        "TELEGRAM_API_URL": f"{base_url}/bot",
+        "MOEX_ISS_URL": f"{base_url}/iss",
+        # Обработчики сохраняют сводку метрик при остановке, основной процесс собирает их после прогона
+        "METRICS_FILE": os.path.join(workdir, "metrics.json") if workers > 1 else "",
+        "AUTO_REBALANCE": "False",
+    })
+    if not keep_rate_limits:
+        # Лимиты Telegram ограничили бы бенчмарк 30 сообщениями в секунду
+        for name in ("TELEGRAM_GLOBAL_RATE", "TELEGRAM_CHAT_RATE", "TELEGRAM_CHAT_BURST", "TELEGRAM_GROUP_RATE"):
+            os.environ[name] = "1000000"
+
+class SyntheticUser:
+    """Пользователь, проходящий /start, /risk_profile и /portfolio и ждущий ответа на каждый шаг"""
+    def __init__(self, chat_id: int, runner: "LoadTest"):
+        self.chat_id = chat_id
+        self.runner = runner
+        self.rng = np.random.default_rng(chat_id)
+        self.user = {"id": chat_id, "is_bot": False, "first_name": f"User{chat_id}"}
+        self.chat = {"id": chat_id, "type": "private", "first_name": f"User{chat_id}"}
+
+    def _command(self, command: str) -> Dict[str, Any]:
+        return {
+            "message": {
+                "message_id": next(self.runner.ids),
+                "date": int(time.time()),
+                "chat": self.chat,
+                "from": self.user,
+                "text": command,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+            }
+        }
+
+    def _callback(self, data: str) -> Dict[str, Any]:
+        return {
+            "callback_query": {
+                "id": str(next(self.runner.ids)),
+                "from": self.user,
+                "chat_instance": str(self.chat_id),
+                "data": data,
+                "message": {
+                    # Каждый вопрос — новое сообщение бота, как в Telegram
+                    "message_id": next(self.runner.ids),
+                    "date": int(time.time()),
+                    "chat": self.chat,
+                    "text": "",
+                },
+            }
+        }
+
+    async def run(self) -> None:
+        """Проходит все диалоги бота"""
+        choice = lambda: str(self.rng.integers(1, 4))
+        await self.runner.step("start", self.chat_id, self._command("/start"))
+        await self.runner.step("horizon", self.chat_id, self._callback(f"horizon_{choice()}"))
+        await self.runner.step("goal", self.chat_id, self._callback(f"goal_{choice()}"))
+        await self.runner.step("risk_profile", self.chat_id, self._command("/risk_profile"), replies=2)
+        for _ in range(4):
+            await self.runner.step("risk_answer", self.chat_id, self._callback(choice()))
+        await self.runner.step("portfolio", self.chat_id, self._command("/portfolio"))
+
+class LoadTest:
+    """Прогоняет синтетических пользователей через бота и собирает результаты"""
+    def __init__(self, application: Any, stubs: StubServer):
+        self.application = application
+        self.stubs = stubs
+        self.ids = itertools.count(1)
+        self.latencies: DefaultDict[str, List[float]] = defaultdict(list)
+        self.updates = 0
+        self.errors = 0
+        self.lags: List[float] = []
+
+    async def step(self, name: str, chat_id: int, payload: Dict[str, Any], replies: int = 1) -> None:
+        """Отправляет обновление боту и ждет ``replies`` ответов в чат"""
+        from telegram import Update
+
+        update = Update.de_json({"update_id": next(self.ids), **payload}, self.application.bot)
+        queue = self.stubs.replies[chat_id]
+        # Время ответа отмечает процесс заглушек, поэтому часы общие для процессов
+        start = time.monotonic()
+        await self.application.update_queue.put(update)
+        self.updates += 1
+        try:
+            for _ in range(replies):
+                _, replied_at = await asyncio.wait_for(queue.get(), REPLY_TIMEOUT)
+            self.latencies[name].append(replied_at - start)
+        except asyncio.TimeoutError:
+            self.errors += 1
+
+    async def monitor_loop_lag(self) -> None:
+        """Замеряет, насколько цикл событий опаздывает с пробуждением (признак блокирующих вызовов)"""
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lags.append(max(0.0, time.perf_counter() - start - LAG_INTERVAL))
+
+    async def run(self, users: int, concurrency: int, first_chat_id: int) -> float:
+        """Запускает пользователей (не больше ``concurrency`` одновременно), возвращает длительность"""
+        slots = asyncio.Semaphore(concurrency)
+
+        async def user_session(chat_id: int) -> None:
+            async with slots:
+                await SyntheticUser(chat_id, self).run()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user_session(first_chat_id + i) for i in range(users)))
+        return time.perf_counter() - start
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 и максимум в миллисекундах"""
+    if not values:
+        return {"count": 0}
+    data = np.asarray(values) * 1000
+    p50, p95, p99 = np.percentile(data, [50, 95, 99])
+    return {"count": int(data.size), "p50_ms": p50, "p95_ms": p95, "p99_ms": p99, "max_ms": float(data.max())}
+
+def worker_metrics(workdir: str, workers: int) -> List[Dict[str, Any]]:
+    """Сводки метрик, сохраненные процессами-обработчиками при остановке"""
+    from utils.helpers import shard_path
+
+    snapshots = []
+    for shard in range(workers):
+        try:
+            with open(shard_path(os.path.join(workdir, "metrics.json"), shard), encoding="utf-8") as snapshot:
+                snapshots.append(json.load(snapshot))
+        except (OSError, ValueError):
+            snapshots.append({})
+    return snapshots
+
+def git_revision() -> Optional[str]:
+    """Текущий коммит, чтобы результаты можно было сопоставить с кодом"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """Поднимает заглушки и бота, прогоняет нагрузку и возвращает результаты"""
+    stubs = StubServer(latency=args.telegram_latency / 1000)
+    port = stubs.start()
+
+    with tempfile.TemporaryDirectory(prefix="finch-bench-") as workdir:
+        configure_environment(workdir, f"http://127.0.0.1:{port}", args.keep_rate_limits, args.workers)
+        # Модули бота читают настройки при импорте, поэтому импортируем их после настройки окружения
+        import bot
+        from database.db_handler import DB
+        from services.data_fetcher import MOEX
+        from sharding import build_front_application
+        from utils.metrics import METRICS
+
+        if args.workers > 1:
+            application = build_front_application(args.workers)
+        else:
+            application = bot.build_application()
+        runner = LoadTest(application, stubs)
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        lag_task = asyncio.create_task(runner.monitor_loop_lag())
+        try:
+            duration = await runner.run(args.users, args.concurrency, args.first_chat_id)
+        finally:
+            lag_task.cancel()
+            await application.stop()
+            await application.post_shutdown(application)
+            await application.shutdown()
+            requests = stubs.stop()
+
+        snapshots = worker_metrics(workdir, args.workers) if args.workers > 1 else [METRICS.snapshot()]
+        all_latencies = [value for values in runner.latencies.values() for value in values]
+        return {
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "parameters": vars(args),
+            "duration_s": duration,
+            "users": args.users,
+            "updates": runner.updates,
+            "errors": runner.errors,
+            "updates_per_sec": runner.updates / duration if duration else 0.0,
+            "latency": percentiles(all_latencies),
+            "latency_by_step": {name: percentiles(values) for name, values in sorted(runner.latencies.items())},
+            # По одной сводке на процесс, обрабатывающий обновления
+            "handler_latency": [
+                {name: value for name, value in snapshot.get("latency", {}).items() if name.startswith("handler.")}
+                for snapshot in snapshots
+            ],
+            "event_loop_lag": percentiles(runner.lags),
+            # При WAL и synchronous=NORMAL fsync выполняется не чаще одного раза на транзакцию
+            "db_commits": sum(snapshot.get("counters", {}).get("db.commits", 0) for snapshot in snapshots)
+            if args.workers > 1 else DB.commits,
+            "telegram_requests": requests["telegram"],
+            "moex_requests": sum(requests["iss"].values()) if args.workers > 1 else MOEX.upstream_requests,
+            # Пик основного процесса; процессы-обработчики учитываются отдельно в RUSAGE_CHILDREN
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="Нагрузочный тест диалогов бота")
+    parser.add_argument("--users", type=int, default=2000, help="число синтетических пользователей")
+    parser.add_argument("--concurrency", type=int, default=500, help="пользователей одновременно")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="задержка фейкового Bot API, мс")
+    parser.add_argument("--first-chat-id", type=int, default=10_000_000, help="chat_id первого пользователя")
+    parser.add_argument("--workers", type=int, default=1, help="процессов-обработчиков (как BOT_WORKERS)")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="не отключать лимиты Telegram")
+    parser.add_argument("--output", help="файл для результатов в JSON (по умолчанию stdout)")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Запускает бенчмарк и выводит результаты"""
+    args = parse_args(argv)
+    results = asyncio.run(benchmark(args))
+    text = json.dumps(results, ensure_ascii=False, indent=2, default=float)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Local stand-ins for the Telegram Bot API and MOEX ISS used by the benchmarks."""
+
+import asyncio
+import json
+import multiprocessing
+import re
+import signal
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, DefaultDict, Dict, Optional
+
+import numpy as np
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+
+# Пользователь-бот, которого возвращает getMe
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Финчик", "username": "finch_bench_bot"}
+
+class FakeTelegram:
+    """Фейковый Bot API: отвечает на запросы бота и запоминает отправленные сообщения.
+
+    О каждом сообщении или правке в очередь ``events`` уходит (chat_id, метод, time.monotonic()),
+    поэтому синтетический пользователь может дождаться ответа бота так же, как настоящий.
+    """
+    def __init__(self, events: "multiprocessing.Queue", latency: float = 0.0):
+        self.latency = latency
+        self.requests: Counter = Counter()
+        self._events = events
+        self._message_ids = 0
+
+    def _message(self, chat_id: int, text: Optional[str]) -> Dict[str, Any]:
+        """Сообщение бота в формате Bot API"""
+        self._message_ids += 1
+        return {
+            "message_id": self._message_ids,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "group"},
+            "from": BOT_USER,
+            "text": text or "",
+        }
+
+    async def handle(self, method: str, params: Dict[str, Any]) -> Any:
+        """Возвращает результат вызова метода Bot API"""
+        self.requests[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method == "getMe":
+            return BOT_USER
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            message = self._message(chat_id, params.get("text"))
+            # CLOCK_MONOTONIC общий для всех процессов, поэтому время сравнимо с временем отправки
+            self._events.put_nowait((chat_id, method, time.monotonic()))
+            return message
+        return True
+
+    def handler(self) -> type:
+        """Обработчик tornado для маршрута ``/bot<токен>/<метод>``"""
+        telegram = self
+
+        class BotApiHandler(tornado.web.RequestHandler):
+            async def post(self, method: str) -> None:
+                params = {}
+                for name, values in self.request.body_arguments.items():
+                    value = values[0].decode()
+                    try:
+                        params[name] = json.loads(value)
+                    except ValueError:
+                        params[name] = value
+                result = await telegram.handle(method, params)
+                self.write({"ok": True, "result": result})
+
+        return BotApiHandler
+
+class StubIss:
+    """Заглушка MOEX ISS: текущие значения индексов и постраничная дневная история.
+
+    История генерируется детерминированно (геометрическое броуновское движение),
+    так что результаты бенчмарка не зависят от рынка и сети.
+    """
+    PAGE_SIZE = 100
+
+    def __init__(self, seed: int = 0):
+        self.requests: Counter = Counter()
+        self._seed = seed
+        self._history: Dict[str, Any] = {}
+
+    def history(self, ticker: str):
+        """Даты (datetime64[D]) и цены закрытия по рабочим дням с 2010 года по сегодня"""
+        if ticker not in self._history:
+            dates = np.arange(np.datetime64("2010-01-01"), np.datetime64("today"), dtype="datetime64[D]")
+            dates = dates[np.is_busday(dates)]
+            rng = np.random.default_rng([self._seed, sum(map(ord, ticker))])
+            returns = rng.normal(0.0003, 0.01, dates.size)
+            self._history[ticker] = (dates, 1000 * np.exp(np.cumsum(returns)))
+        return self._history[ticker]
+
+    def handler(self) -> type:
+        """Обработчик tornado для путей ISS, которые использует бот"""
+        iss = self
+
+        class IssHandler(tornado.web.RequestHandler):
+            def get(self, path: str) -> None:
+                values = re.fullmatch(r"engines/stock/markets/index/indices/(\w+)/values\.json", path)
+                history = re.fullmatch(r"history/engines/stock/markets/index/securities/(\w+)\.json", path)
+                if values:
+                    iss.requests["values"] += 1
+                    _, closes = iss.history(values.group(1))
+                    self.write({"values": {"columns": ["value"], "data": [[float(closes[-1])]]}})
+                elif history:
+                    iss.requests["history"] += 1
+                    dates, closes = iss.history(history.group(1))
+                    start = int(self.get_query_argument("start", "0"))
+                    since = np.searchsorted(dates, np.datetime64(self.get_query_argument("from", "2010-01-01")))
+                    page = slice(since + start, since + start + iss.PAGE_SIZE)
+                    self.write({
+                        "history": {
+                            "columns": ["TRADEDATE", "CLOSE"],
+                            "data": [[str(day), float(close)] for day, close in zip(dates[page], closes[page])],
+                        },
+                        "history.cursor": {
+                            "columns": ["INDEX", "TOTAL", "PAGESIZE"],
+                            "data": [[start, int(dates.size - since), iss.PAGE_SIZE]],
+                        },
+                    })
+                else:
+                    self.send_error(404)
+
+        return IssHandler
+
+def make_app(telegram: FakeTelegram, iss: StubIss) -> tornado.web.Application:
+    """HTTP-приложение, обслуживающее и Bot API, и ISS"""
+    return tornado.web.Application([
+        (r"/bot[^/]+/(\w+)", telegram.handler()),
+        (r"/iss/(.+)", iss.handler()),
+    ])
+
+async def serve_stubs(conn: Any, events: "multiprocessing.Queue", latency: float) -> None:
+    """Обслуживает Bot API и ISS на свободном порту, пока по ``conn`` не придет команда остановки"""
+    sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+    telegram = FakeTelegram(events, latency)
+    iss = StubIss()
+    server = tornado.httpserver.HTTPServer(make_app(telegram, iss))
+    server.add_sockets(sockets)
+    conn.send(sockets[0].getsockname()[1])
+    await asyncio.get_running_loop().run_in_executor(None, conn.recv)
+    server.stop()
+    conn.send({"telegram": dict(telegram.requests), "iss": dict(iss.requests)})
+
+def run_stubs(conn: Any, events: "multiprocessing.Queue", latency: float) -> None:
+    """Точка входа процесса заглушек"""
+    # Ctrl+C получает вся группа процессов; заглушки останавливает бенчмарк
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(serve_stubs(conn, events, latency))
+
+class StubServer:
+    """Заглушки в отдельном процессе: их работа не попадает в задержки и загрузку цикла событий бота.
+
+    Ответы бота приходят из процесса заглушек через очередь и раскладываются по очередям чатов
+    в ``replies``; число запросов к Bot API и ISS возвращает ``stop``.
+    """
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.replies: DefaultDict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
+        context = multiprocessing.get_context("spawn")
+        self._conn, child = context.Pipe()
+        self._events = context.Queue()
+        self._process = context.Process(
+            target=run_stubs, args=(child, self._events, latency), name="stubs", daemon=True
+        )
+        self._reader: Optional[threading.Thread] = None
+
+    def _deliver(self, chat_id: int, method: str, replied_at: float) -> None:
+        """Кладет ответ в очередь чата (в потоке цикла событий)"""
+        self.replies[chat_id].put_nowait((method, replied_at))
+
+    def _dispatch(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Поток: переносит ответы из процесса заглушек в цикл событий бенчмарка"""
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            loop.call_soon_threadsafe(self._deliver, *event)
+
+    def start(self) -> int:
+        """Запускает процесс заглушек и возвращает их порт"""
+        self._process.start()
+        port = self._conn.recv()
+        self._reader = threading.Thread(
+            target=self._dispatch, args=(asyncio.get_running_loop(),), name="stub-replies", daemon=True
+        )
+        self._reader.start()
+        return port
+
+    def stop(self) -> Dict[str, Dict[str, int]]:
+        """Останавливает заглушки и возвращает число запросов: {"telegram": ..., "iss": ...}"""
+        self._conn.send(None)
+        requests = self._conn.recv()
+        self._process.join()
+        self._events.put(None)
+        self._reader.join()
+        return requests
@@ -1,18 +1,48 @@
 """Telegram bot main module for investment portfolio management and risk profile assessment."""
 
+import asyncio
 import logging
 from telegram import Update, BotCommand
-from telegram.ext import Application, CallbackContext
-from config import BOT_TOKEN
+from telegram.ext import Application, CallbackContext, CommandHandler, TypeHandler
+from config import (
+    BOT_TOKEN,
+    BOT_MODE,
+    HISTORY_TICKERS,
+    MARKET_DATA_CHECK_INTERVAL,
+    AUTO_REBALANCE,
+    REBALANCE_TICK_INTERVAL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_URL,
+    WEBHOOK_SECRET_TOKEN,
+    WEBHOOK_MAX_CONNECTIONS,
+    CONCURRENT_UPDATES,
+    TELEGRAM_API_URL,
+    BOT_CONNECTION_POOL_SIZE,
+    BOT_POOL_TIMEOUT,
+    BOT_WORKERS,
+    TELEGRAM_GLOBAL_RATE,
+    METRICS_FILE,
+    METRICS_INTERVAL,
+    VALUATION_INTERVAL,
+    ALERT_CHECK_INTERVAL,
+    validate_config
+)
 from commands.start import start_conversation
 from commands.risk_profile import risk_profile_conversation
 from commands.portfolio import handle_portfolio
+from commands.report import handle_report
+from commands.alert import handle_alert
+from database.db_handler import DB
+from database.quiz_state import QUIZ_STATES
+from services.data_fetcher import MOEX
+from services.dispatcher import PriorityRateLimiter
+from utils.coalescing import COALESCER
+from utils.helpers import setup_logging, shard_path
+from utils.metrics import write_metrics_snapshot
+from utils.update_processor import ChatOrderedUpdateProcessor
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 async def portfolio(update: Update, context: CallbackContext) -> None:
@@ -23,23 +53,161 @@ async def set_commands(application: Application) -> None:
     """Настраивает команды бота, которые отображаются в меню"""
     commands = [
         BotCommand("start", "🚀 Начать работу с ботом"),
-        BotCommand("risk_profile", "📊 Определить профиль риска")
+        BotCommand("risk_profile", "📊 Определить профиль риска"),
+        BotCommand("portfolio", "💼 Сформировать портфель"),
+        BotCommand("report", "📈 Отчет по портфелю"),
+        BotCommand("alert", "🔔 Оповещения о ценах")
     ]
     await application.bot.set_my_commands(commands)
 
-def main() -> None:
-    """Запускает бота и регистрирует команды"""
-    application = (
+async def purge_quiz_states(_: CallbackContext) -> None:
+    """Удаляет брошенные незавершенные тесты на риск-профиль"""
+    removed = await QUIZ_STATES.purge_expired()
+    if removed:
+        logger.info("Удалено устаревших тестов на риск-профиль: %s", removed)
+
+async def revalue_portfolios(context: CallbackContext) -> None:
+    """Задача JobQueue: переоценка всех портфелей на новый торговый день"""
+    from services.valuation import VALUATOR
+
+    await VALUATOR.run(context)
+
+async def rebalance_portfolios(context: CallbackContext) -> None:
+    """Задача JobQueue: проверка портфелей, которым пора на ребалансировку"""
+    from services.rebalancing import REBALANCER
+
+    await REBALANCER.run(context)
+
+async def check_alerts(context: CallbackContext) -> None:
+    """Задача JobQueue: проверка оповещений о ценах по свежим значениям индексов"""
+    from services.alerts import ALERTS
+
+    await ALERTS.run(context)
+
+async def refresh_market_data(_: CallbackContext) -> None:
+    """Задача JobQueue: догрузка истории индексов и перестроение таблицы портфелей"""
+    from services.allocation_table import refresh_market_data as refresh
+
+    await refresh(HISTORY_TICKERS)
+
+async def reload_market_data(_: CallbackContext) -> None:
+    """Задача JobQueue: перечитывание истории, догруженной обработчиком 0, и перестроение таблицы портфелей"""
+    from services.allocation_table import reload_market_data as reload
+
+    await reload()
+
+async def startup(_: Application) -> None:
+    """Открывает БД и строит таблицу портфелей по сохраненной истории (догрузку запускает JobQueue)"""
+    # Расчетные модули (NumPy) и хранилище истории загружаются здесь, а не при импорте бота
+    from database.history_store import HISTORY
+    from services.allocation_table import publish_allocation_table
+
+    await DB.open()
+    await asyncio.to_thread(HISTORY.open)
+    # /portfolio только читает готовую таблицу, поэтому она должна быть построена до первых обновлений
+    await asyncio.to_thread(publish_allocation_table, HISTORY)
+
+async def shutdown(_: Application) -> None:
+    """Освобождает сетевые ресурсы и соединения с БД при остановке бота"""
+    from database.history_store import HISTORY
+
+    await MOEX.close()
+    await DB.close()
+    HISTORY.close()
+
+def build_application(shard: int = 0, shards: int = 1) -> Application:
+    """Создает приложение бота и регистрирует обработчики и фоновые задачи.
+
+    При ``shards`` > 1 приложение работает в процессе-обработчике ``shard``: обновления
+    приходят от основного процесса (см. sharding.py), лимит отправки делится между
+    процессами, а общие для всех пользователей задачи выполняет только обработчик 0.
+    """
+    builder = (
         Application.builder()
         .token(BOT_TOKEN)
-        .build()
+        .base_url(TELEGRAM_API_URL)
+        .connection_pool_size(BOT_CONNECTION_POOL_SIZE)
+        .pool_timeout(BOT_POOL_TIMEOUT)
+        .concurrent_updates(ChatOrderedUpdateProcessor(CONCURRENT_UPDATES))
+        .rate_limiter(PriorityRateLimiter(global_rate=TELEGRAM_GLOBAL_RATE / shards))
+        .post_init(startup)
+        .post_shutdown(shutdown)
     )
+    if shards > 1:
+        builder.updater(None)
+    application = builder.build()
 
+    # Повторы запросов отсекаются до обработчиков команд
+    application.add_handler(TypeHandler(Update, COALESCER.deduplicate), group=-1)
     application.add_handler(start_conversation)
     application.add_handler(risk_profile_conversation)
+    application.add_handler(CommandHandler("portfolio", portfolio))
+    application.add_handler(CommandHandler("report", handle_report))
+    application.add_handler(CommandHandler("alert", handle_alert))
+
+    # Первая догрузка — сразу после запуска; JobQueue дожидается ее при остановке, до закрытия БД.
+    # С MOEX ISS историю загружает только обработчик 0, остальные перечитывают ее из общей БД
+    application.job_queue.run_repeating(
+        reload_market_data if shard else refresh_market_data,
+        interval=MARKET_DATA_CHECK_INTERVAL,
+        first=0
+    )
+    # Первая переоценка — сразу после запуска, иначе до нее каждый /report считается по одному портфелю;
+    # каждый обработчик оценивает только портфели своих чатов
+    application.job_queue.run_repeating(
+        revalue_portfolios,
+        interval=VALUATION_INTERVAL,
+        first=0,
+        data=(shard, shards)
+    )
+    if METRICS_FILE:
+        application.job_queue.run_repeating(
+            write_metrics_snapshot,
+            interval=METRICS_INTERVAL,
+            first=METRICS_INTERVAL,
+            data=shard_path(METRICS_FILE, shard) if shards > 1 else METRICS_FILE
+        )
+    if shard:
+        return application
+    application.job_queue.run_repeating(purge_quiz_states, interval=3600, first=60)
+    application.job_queue.run_repeating(check_alerts, interval=ALERT_CHECK_INTERVAL, first=ALERT_CHECK_INTERVAL)
+    if AUTO_REBALANCE:
+        application.job_queue.run_repeating(
+            rebalance_portfolios,
+            interval=REBALANCE_TICK_INTERVAL,
+            first=REBALANCE_TICK_INTERVAL
+        )
+    return application
+
+def main() -> None:
+    """Запускает бота и регистрирует команды"""
+    # Ошибки настроек выводим все сразу, до подключения к Telegram
+    validate_config()
+    # Настройка логирования: записи уходят в очередь, файл пишет отдельный поток
+    log_listener = setup_logging()
+    if BOT_WORKERS > 1:
+        # Основной процесс только принимает обновления и раздает их процессам-обработчикам
+        from sharding import build_front_application
+
+        application = build_front_application(BOT_WORKERS)
+    else:
+        application = build_application()
 
     # Запускаем бота
-    application.run_polling()
+    try:
+        if BOT_MODE == "webhook":
+            application.run_webhook(
+                listen=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                url_path=WEBHOOK_PATH,
+                webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}" if WEBHOOK_URL else None,
+                secret_token=WEBHOOK_SECRET_TOKEN,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+        else:
+            application.run_polling()
+    finally:
+        log_listener.stop()
 
 if __name__ == "__main__":
     main()
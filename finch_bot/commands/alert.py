@@ -0,0 +1,123 @@
+"""Module for handling the /alert command: price alerts on MOEX indices."""
+
+import re
+from typing import Optional, Tuple
+
+from telegram import Update
+from telegram.ext import CallbackContext
+
+from config import ALERT_MAX_PER_USER, MOEX_INDICES
+from database.db_handler import DB as db, AlertRow
+from services.data_fetcher import MOEX
+from utils.helpers import format_value
+from utils.metrics import METRICS
+
+# Тикер или класс актива, затем уровень («IMOEX > 3500») или порог движения в процентах («IMOEX 5%»)
+LEVEL_PATTERN = re.compile(r"^(\S+)\s*([<>])\s*(\d+(?:[.,]\d+)?)$")
+MOVE_PATTERN = re.compile(r"^(\S+)\s*±?\s*(\d+(?:[.,]\d+)?)\s*%$")
+TICKER_PATTERN = re.compile(r"^[A-Z0-9]{2,12}$")
+
+USAGE = (
+    "🔔 Оповещения о значениях индексов MOEX:\n"
+    "/alert IMOEX > 3500 — когда индекс поднимется до уровня\n"
+    "/alert RGBI < 110 — когда опустится до уровня\n"
+    "/alert Золото 5% — когда изменится на 5% от текущего значения\n"
+    "/alert remove 3 — удалить оповещение №3\n\n"
+    "Вместо тикера можно указать класс актива: " + ", ".join(MOEX_INDICES) + "."
+)
+
+def parse_ticker(name: str) -> Optional[str]:
+    """Возвращает тикер индекса по тикеру или названию класса актива"""
+    for asset, ticker in MOEX_INDICES.items():
+        if name.lower() == asset.lower():
+            return ticker
+    name = name.upper()
+    return name if TICKER_PATTERN.match(name) else None
+
+def parse_alert(text: str) -> Optional[Tuple[str, str, float]]:
+    """Разбирает условие оповещения в (тикер, вид: above/below/move, значение)"""
+    level = LEVEL_PATTERN.match(text)
+    if level:
+        name, sign, value = level.groups()
+        kind = "above" if sign == ">" else "below"
+    else:
+        move = MOVE_PATTERN.match(text)
+        if not move:
+            return None
+        name, value = move.groups()
+        kind = "move"
+    ticker = parse_ticker(name)
+    number = float(value.replace(",", "."))
+    if ticker is None or number <= 0 or (kind == "move" and number >= 100):
+        return None
+    return ticker, kind, number
+
+def describe_alert(row: AlertRow) -> str:
+    """Условие оповещения для списка"""
+    alert_id, _, ticker, above, below, base, percent = row
+    if percent is not None:
+        return f"№{alert_id}: {ticker} ±{percent:g}% от {format_value(base)}"
+    if above is not None:
+        return f"№{alert_id}: {ticker} ≥ {format_value(above)}"
+    return f"№{alert_id}: {ticker} ≤ {format_value(below)}"
+
+async def list_alerts(user_id: int) -> str:
+    """Текст со списком оповещений пользователя и подсказкой"""
+    alerts = await db.get_user_alerts(user_id)
+    if not alerts:
+        return USAGE
+    return "🔔 Твои оповещения:\n" + "\n".join(describe_alert(row) for row in alerts) + "\n\n" + USAGE
+
+async def remove_alert(user_id: int, argument: str) -> str:
+    """Удаляет оповещение пользователя по номеру"""
+    if not argument.lstrip("№").isdigit():
+        return "Укажи номер оповещения, например: /alert remove 3"
+    if await db.delete_user_alert(user_id, int(argument.lstrip("№"))):
+        return "🗑 Оповещение удалено."
+    return "Оповещение с таким номером не найдено."
+
+async def add_alert(user_id: int, text: str) -> str:
+    """Создает оповещение по условию из команды"""
+    parsed = parse_alert(text)
+    if parsed is None:
+        return "Не понял условие оповещения.\n\n" + USAGE
+    if len(await db.get_user_alerts(user_id)) >= ALERT_MAX_PER_USER:
+        return f"Можно создать не больше {ALERT_MAX_PER_USER} оповещений. Удали лишние: /alert remove <номер>"
+
+    ticker, kind, number = parsed
+    # Текущее значение проверяет, что индекс существует, и служит базой для оповещения о движении
+    value = await MOEX.get_index_value(ticker)
+    if value is None:
+        return f"Не удалось получить значение индекса {ticker} с MOEX. Проверь тикер или попробуй позже."
+
+    if kind == "move":
+        alert_id = await db.add_alert(
+            user_id, ticker, value * (1 + number / 100), value * (1 - number / 100), value, number
+        )
+        condition = f"изменится на ±{number:g}%"
+    elif kind == "above":
+        if value >= number:
+            return f"{ticker} уже на уровне {format_value(value)}, выбери уровень выше."
+        alert_id = await db.add_alert(user_id, ticker, number, None)
+        condition = f"поднимется до {format_value(number)}"
+    else:
+        if value <= number:
+            return f"{ticker} уже на уровне {format_value(value)}, выбери уровень ниже."
+        alert_id = await db.add_alert(user_id, ticker, None, number)
+        condition = f"опустится до {format_value(number)}"
+    return f"✅ Оповещение №{alert_id}: сообщу, когда {ticker} {condition} (сейчас {format_value(value)})."
+
+@METRICS.instrument("handler.alert")
+async def handle_alert(update: Update, context: CallbackContext) -> None:
+    """ Обрабатывает команду /alert: список, создание и удаление оповещений о ценах. """
+    user_id: int = update.message.chat_id
+    args = context.args or []
+
+    if not args:
+        text = await list_alerts(user_id)
+    elif args[0].lower() in ("remove", "delete", "удалить"):
+        text = await remove_alert(user_id, args[1] if len(args) > 1 else "")
+    else:
+        text = await add_alert(user_id, " ".join(args))
+
+    await context.bot.send_message(chat_id=user_id, text=text)
@@ -1,89 +1,86 @@
 """Module for handling portfolio generation and management commands."""
 
-from typing import Dict, Optional
-import requests
+import asyncio
+from typing import Optional
+
 from telegram import Update
 from telegram.ext import CallbackContext
-from database.db_handler import DB as db
-from utils.helpers import format_portfolio
 
-# API для получения значений индексов с Московской биржи
-MOEX_INDEX_API = "https://iss.moex.com/iss/engines/stock/markets/index/indices/{}/values.json"
+from config import GOAL_TARGET_RETURN
+from database.db_handler import DB as db
+from services.data_fetcher import MOEX
+from utils.coalescing import COALESCER
+from utils.helpers import format_portfolio, format_years
+from utils.metrics import METRICS
 
-def get_index_value(index: str) -> float:
-    """Получает текущее значение указанного индекса с MOEX API."""
-    response = requests.get(MOEX_INDEX_API.format(index), timeout=10)
-    if response.status_code == 200:
-        data = response.json()
-        try:
-            return float(data['values'][0]['value'])
-        except (KeyError, IndexError, TypeError):
-            return None  # Если данных нет, возвращаем None
-    return None
+async def get_index_value(index: str) -> Optional[float]:
+    """Получает текущее значение указанного индекса с MOEX API (с кэшированием)."""
+    return await MOEX.get_index_value(index)
 
-def handle_portfolio(update: Update, context: CallbackContext) -> None:
+@METRICS.instrument("handler.portfolio")
+async def handle_portfolio(update: Update, context: CallbackContext) -> None:
     """ Обрабатывает команду /portfolio и предлагает пользователю оптимальный портфель. """
     user_id: int = update.message.chat_id
-    
-    # Проверяем, есть ли у пользователя цель и риск-профиль
-    user_goal: Optional[str] = db.get_user_goal(user_id)
-    user_risk_profile: Optional[str] = db.get_risk_profile(user_id)
+
+    # Повторная команда, пока профиль не менялся, получает уже сформированный ответ
+    text = await COALESCER.run(user_id, "portfolio", lambda: build_portfolio_message(user_id))
+    await context.bot.send_message(chat_id=user_id, text=text)
+
+async def build_portfolio_message(user_id: int) -> str:
+    """ Формирует и сохраняет портфель пользователя, возвращает текст ответа. """
+    # Расчетные модули (NumPy) загружаются при первой команде, чтобы импорт бота оставался быстрым
+    from services.allocation_table import current_table
+    from services.monte_carlo import goal_probability
+    from services.portfolio_logic import calculate_expected_return, generate_portfolio
+    from services.valuation import VALUATOR
+
+    # Проверяем, есть ли у пользователя цель и риск-профиль (профиль читается одним запросом или из кэша)
+    profile = await db.get_user_profile(user_id)
+    user_goal: Optional[str] = profile.goal if profile else None
+    user_risk_profile: Optional[str] = profile.risk_profile if profile else None
     
     if not user_goal or not user_risk_profile:
-        context.bot.send_message(
-            chat_id=user_id,
-            text="Чтобы сформировать портфель, необходимо сначала задать цель (/start) и пройти тест на риск-профиль (/risk_profile)."
-        )
-        return
+        return "Чтобы сформировать портфель, необходимо сначала задать цель (/start) и пройти тест на риск-профиль (/risk_profile)."
     
-    # Подбираем оптимальный портфель
-    portfolio = generate_portfolio(user_risk_profile)
-    expected_return = calculate_expected_return(portfolio)
+    user_horizon: Optional[str] = profile.horizon
+
+    # Таблица портфелей строится при запуске и обновляется фоновой задачей refresh_market_data
+    table = current_table()
+
+    # Берем готовый портфель из таблицы, нестандартные сочетания считаем на месте
+    allocation = table.lookup(user_horizon, user_goal, user_risk_profile)
+    if allocation is not None:
+        portfolio = dict(allocation.portfolio)
+        expected_return = allocation.expected_return
+    else:
+        portfolio = generate_portfolio(user_risk_profile, user_horizon, user_goal)
+        expected_return = calculate_expected_return(portfolio)
     
-    # Сохраняем портфель в базе данных
-    db.save_portfolio(
+    # Сохраняем портфель в базе данных вместе с версией снимка данных
+    await db.save_portfolio(
         user_id=user_id,
         portfolio=portfolio,
-        expected_return=expected_return
-    )
-    
-    # Отправляем пользователю структуру портфеля и рекомендации
-    context.bot.send_message(
-        chat_id=user_id,
-        text=f"✅ Твой инвестиционный портфель сформирован:\n\n{format_portfolio(portfolio)}\n\n"
-             f"📈 Ожидаемая доходность (на основе реальных рыночных данных): {expected_return:.2f}% в год\n\n"
-             "🔄 Авто-ребалансировка: если соотношение активов изменится, мы подскажем, как его восстановить.\n"
-             "📅 Обновление раз в квартал: мы адаптируем портфель к текущей рыночной ситуации."
+        expected_return=expected_return,
+        snapshot_version=table.version
     )
+    VALUATOR.invalidate(user_id)
+    # Сохраненный ответ /report построен по прежнему портфелю
+    COALESCER.invalidate(user_id)
 
-def generate_portfolio(risk_profile: str) -> Dict[str, float]:
-    """ Генерирует оптимальный портфель на основе риск-профиля. """
-    portfolios = {
-        "Консервативный": {"Облигации": 70, "Акции": 20, "Золото": 10},
-        "Умеренный": {"Облигации": 50, "Акции": 40, "Золото": 10},
-        "Агрессивный": {"Облигации": 30, "Акции": 50, "Золото": 20},
-    }
-    return portfolios.get(risk_profile, {"Облигации": 50, "Акции": 40, "Золото": 10})
-
-def calculate_expected_return(portfolio: Dict[str, float]) -> float:
-    """ Рассчитывает ожидаемую доходность портфеля на основе актуальных индексов. """
+    # Оцениваем вероятность достичь цели за горизонт (результат кэшируется по портфелю и горизонту)
+    simulation = await asyncio.to_thread(goal_probability, portfolio, user_horizon)
+    goal_text = ""
+    if simulation is not None:
+        goal_text = (
+            f"🎯 Вероятность за {format_years(simulation.years)} получить доходность не ниже "
+            f"{GOAL_TARGET_RETURN * 100:.0f}% годовых: {simulation.probability:.0%}\n\n"
+        )
     
-    # Получаем значения индексов с MOEX API
-    imoex_return = get_index_value("IMOEX")  # Среднегодовая доходность акций
-    rgbi_return = get_index_value("RGBI")    # Среднегодовая доходность облигаций
-    rugold_return = get_index_value("RUGOLD") # Среднегодовая доходность золота
-
-    # Подставляем полученные данные в расчет
-    asset_returns = {
-        "Акции": imoex_return if imoex_return else 10.0,
-        "Облигации": rgbi_return if rgbi_return else 5.0,
-        "Золото": rugold_return if rugold_return else 7.0
-    }
-
-    # Рассчитываем ожидаемую доходность портфеля
-    expected_return = sum(
-        (weight / 100) * asset_returns.get(asset, 0)
-        for asset, weight in portfolio.items()
+    # Структура портфеля и рекомендации для пользователя
+    return (
+        f"✅ Твой инвестиционный портфель сформирован:\n\n{format_portfolio(portfolio)}\n\n"
+        f"📈 Ожидаемая доходность (на основе реальных рыночных данных): {expected_return:.2f}% в год\n\n"
+        f"{goal_text}"
+        "🔄 Авто-ребалансировка: если соотношение активов изменится, мы подскажем, как его восстановить.\n"
+        "📅 Обновление раз в квартал: мы адаптируем портфель к текущей рыночной ситуации."
     )
-
-    return expected_return
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""Module for handling the /report command with the current state of the user's portfolio."""
+
+from telegram import Update
+from telegram.ext import CallbackContext
+from utils.coalescing import COALESCER
+from utils.metrics import METRICS
+
+@METRICS.instrument("handler.report")
+async def handle_report(update: Update, context: CallbackContext) -> None:
+    """ Обрабатывает команду /report: доходность портфеля и текущие доли активов. """
+    user_id: int = update.message.chat_id
+
+    text = await COALESCER.run(user_id, "report", lambda: build_report_message(user_id))
+    await context.bot.send_message(chat_id=user_id, text=text)
+
+async def build_report_message(user_id: int) -> str:
+    """ Формирует текст отчета по портфелю пользователя. """
+    # Расчетные модули (NumPy) загружаются при первой команде, чтобы импорт бота оставался быстрым
+    from services.portfolio_logic import ASSETS
+    from services.valuation import VALUATOR
+
+    valuation = await VALUATOR.get(user_id)
+    if valuation is None:
+        return "Отчет появится после того, как ты сформируешь портфель командой /portfolio."
+
+    weights = "\n".join(
+        f"{asset}: {weight * 100:.0f}%" for asset, weight in zip(ASSETS, valuation.weights)
+    )
+    return (
+        f"📊 Отчет по портфелю на {valuation.as_of}:\n\n"
+        f"📈 Доходность с момента формирования: {valuation.total_return:+.2f}%\n"
+        f"📅 За последний торговый день: {valuation.day_return:+.2f}%\n\n"
+        f"⚖️ Текущие доли активов:\n{weights}"
+    )
@@ -1,6 +1,5 @@
 """Module for handling risk profile assessment and user risk tolerance evaluation."""
 
-from typing import Dict
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     CallbackContext,
@@ -9,13 +8,12 @@ from telegram.ext import (
     CallbackQueryHandler
 )
 from database.db_handler import DB as db
+from database.quiz_state import QUIZ_STATES, QuizState
+from utils.metrics import METRICS
 
 # Состояния диалога
 ANSWERING_QUESTIONS = 1
 
-# Словарь для хранения ответов пользователей
-user_responses: Dict[int, Dict[str, int]] = {}
-
 # Вопросы и варианты ответов
 risk_questions = [
     {
@@ -62,10 +60,11 @@ def get_keyboard(question_index: int) -> InlineKeyboardMarkup:
     ]
     return InlineKeyboardMarkup(keyboard)
 
+@METRICS.instrument("handler.risk_profile")
 async def handle_risk_profile(update: Update, context: CallbackContext) -> int:
     """Запускает процесс оценки риск-профиля."""
     user_id = update.message.chat_id
-    user_responses[user_id] = {"score": 0, "question_index": 0}
+    await QUIZ_STATES.save(user_id, QuizState())
 
     await update.message.reply_text(
         "📝 Давай определим твой риск-профиль. Я задам тебе 4 вопроса. Выбирай вариант ответа."
@@ -75,33 +74,35 @@ async def handle_risk_profile(update: Update, context: CallbackContext) -> int:
 
 async def ask_next_question(user_id: int, context: CallbackContext) -> None:
     """Отправляет пользователю следующий вопрос из списка."""
-    user_data = user_responses.get(user_id)
+    user_data = await QUIZ_STATES.get(user_id)
 
-    if user_data and user_data["question_index"] < len(risk_questions):
-        question_index = user_data["question_index"]
+    if user_data and user_data.question_index < len(risk_questions):
+        question_index = user_data.question_index
         await context.bot.send_message(
             chat_id=user_id,
             text=risk_questions[question_index]["question"],
             reply_markup=get_keyboard(question_index)
         )
 
+@METRICS.instrument("handler.risk_answer")
 async def handle_risk_response(update: Update, context: CallbackContext) -> int:
     """Обрабатывает ответ пользователя и переходит к следующему вопросу."""
     query = update.callback_query
     user_id = query.message.chat_id
-    user_data = user_responses.get(user_id)
+    user_data = await QUIZ_STATES.get(user_id)
 
-    if user_data is None or user_data["question_index"] >= len(risk_questions):
-        await query.answer()
+    if user_data is None or user_data.question_index >= len(risk_questions):
+        await query.answer("Тест устарел, начни заново: /risk_profile")
         return ConversationHandler.END
 
     answer = query.data
     if answer in ["1", "2", "3"]:
-        user_data["score"] += int(answer)
-        user_data["question_index"] += 1
+        user_data.score += int(answer)
+        user_data.question_index += 1
+        await QUIZ_STATES.save(user_id, user_data)
         await query.answer()
 
-        if user_data["question_index"] < len(risk_questions):
+        if user_data.question_index < len(risk_questions):
             await ask_next_question(user_id, context)
             return ANSWERING_QUESTIONS
         else:
@@ -113,11 +114,11 @@ async def handle_risk_response(update: Update, context: CallbackContext) -> int:
 
 async def calculate_risk_profile(user_id: int, context: CallbackContext) -> None:
     """Рассчитывает риск-профиль на основе набранных баллов и отправляет результат."""
-    user_data = user_responses.get(user_id)
+    user_data = await QUIZ_STATES.get(user_id)
     if user_data is None:
         return
 
-    score = user_data["score"]
+    score = user_data.score
 
     if score <= 7:
         profile = "🔵 Консервативный инвестор\n💼 Низкий риск, стабильный доход"
@@ -126,16 +127,22 @@ async def calculate_risk_profile(user_id: int, context: CallbackContext) -> None
     else:
         profile = "🔴 Агрессивный инвестор\n💼 Высокий риск, максимальный рост"
 
-    db.save_risk_profile(user_id, profile)
+    await db.save_risk_profile(user_id, profile)
+    await QUIZ_STATES.delete(user_id)
 
     await context.bot.send_message(
         chat_id=user_id,
         text=f"🎯 Анализ завершен!\n\nТвой риск-профиль:\n{profile}\n\n✨ Теперь можешь перейти к формированию портфеля!"
     )
 
-# Create conversation handler
+# Create conversation handler.
+# Ответ на вопрос тоже является точкой входа: после перезапуска бота диалог
+# продолжается с сохраненного в БД вопроса
 risk_profile_conversation = ConversationHandler(
-    entry_points=[CommandHandler('risk_profile', handle_risk_profile)],
+    entry_points=[
+        CommandHandler('risk_profile', handle_risk_profile),
+        CallbackQueryHandler(handle_risk_response, pattern='^[123]$')
+    ],
     states={
         ANSWERING_QUESTIONS: [CallbackQueryHandler(handle_risk_response)]
     },
@@ -14,25 +14,27 @@ from telegram.ext import (
 from telegram.constants import ParseMode
 
 from database.db_handler import DB as db
+from utils.metrics import METRICS
 
 # Define states
 HORIZON, GOAL = range(2)
 
-def is_user_registered(user_id: int) -> bool:
+async def is_user_registered(user_id: int) -> bool:
     """ Проверяет, зарегистрирован ли пользователь в базе данных. """
-    return db.check_user_exists(user_id)
+    return await db.check_user_exists(user_id)
 
-def register_user(user_id: int, user_name: str) -> None:
+async def register_user(user_id: int, user_name: str) -> None:
     """ Регистрирует нового пользователя в базе данных. """
-    db.add_user(user_id, user_name)
+    await db.add_user(user_id, user_name)
 
+@METRICS.instrument("handler.start")
 async def start(update: Update, _: CallbackContext) -> int:
     """Обработчик команды /start, приветствует пользователя и запускает процесс регистрации."""
     user_id: int = update.message.chat_id
     user_name: str = update.message.from_user.first_name
 
-    if not is_user_registered(user_id):
-        register_user(user_id, user_name)
+    if not await is_user_registered(user_id):
+        await register_user(user_id, user_name)
 
     keyboard = [
         [InlineKeyboardButton("Краткосрочный (1-3 года)", callback_data='horizon_1')],
@@ -50,6 +52,7 @@ async def start(update: Update, _: CallbackContext) -> int:
     )
     return HORIZON
 
+@METRICS.instrument("handler.horizon")
 async def handle_horizon_selection(update: Update, _: CallbackContext) -> int:
     """Обрабатывает выбор временного горизонта инвестирования пользователем."""
     query = update.callback_query
@@ -58,7 +61,7 @@ async def handle_horizon_selection(update: Update, _: CallbackContext) -> int:
     user_id: int = query.message.chat_id
     horizon: str = query.data.split('_')[1]  # Extract number from 'horizon_X'
 
-    save_user_horizon(user_id, horizon)
+    await save_user_horizon(user_id, horizon)
 
     goals_keyboard = []
     if horizon == '1':
@@ -87,6 +90,7 @@ async def handle_horizon_selection(update: Update, _: CallbackContext) -> int:
     )
     return GOAL
 
+@METRICS.instrument("handler.goal")
 async def handle_goal_selection(update: Update, _: CallbackContext) -> int:
     """Обрабатывает выбор инвестиционной цели пользователем."""
     query = update.callback_query
@@ -95,24 +99,30 @@ async def handle_goal_selection(update: Update, _: CallbackContext) -> int:
     user_id: int = query.message.chat_id
     goal: str = query.data.split('_')[1]  # Extract number from 'goal_X'
 
-    save_user_goal(user_id, goal)
+    await save_user_goal(user_id, goal)
 
     await query.edit_message_text(
         text="🎯 Отлично! Теперь ты можешь пройти оценку риск-профиля. Просто введи команду /risk_profile"
     )
     return ConversationHandler.END
 
-def save_user_horizon(user_id: int, horizon: str) -> None:
+async def save_user_horizon(user_id: int, horizon: str) -> None:
     """ Сохраняет выбранный временной горизонт инвестирования пользователя в базе данных. """
-    db.save_horizon(user_id, horizon)
+    await db.save_horizon(user_id, horizon)
 
-def save_user_goal(user_id: int, goal: str) -> None:
+async def save_user_goal(user_id: int, goal: str) -> None:
     """ Сохраняет выбранную цель инвестирования пользователя в базе данных. """
-    db.save_goal(user_id, goal)
+    await db.save_goal(user_id, goal)
 
-# Create conversation handler
+# Create conversation handler.
+# Выбор горизонта и цели тоже является точкой входа: ответы сохраняются в БД, поэтому
+# диалог продолжается после перезапуска бота или процесса-обработчика
 start_conversation = ConversationHandler(
-    entry_points=[CommandHandler('start', start)],
+    entry_points=[
+        CommandHandler('start', start),
+        CallbackQueryHandler(handle_horizon_selection, pattern='^horizon_'),
+        CallbackQueryHandler(handle_goal_selection, pattern='^goal_')
+    ],
     states={
         HORIZON: [CallbackQueryHandler(handle_horizon_selection, pattern='^horizon_')],
         GOAL: [CallbackQueryHandler(handle_goal_selection, pattern='^goal_')]
@@ -12,23 +12,155 @@ BOT_TOKEN = os.getenv("BOT_TOKEN")
 # API-ключ для MOEX
 MOEX_API_KEY = os.getenv("MOEX_API_KEY")
 
+# Режим получения обновлений: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
+# Настройки webhook: локальный HTTP-сервер и публичный адрес, который сообщаем Telegram
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # например, https://bot.example.com
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Параллельная обработка обновлений (обновления одного чата обрабатываются по порядку)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+
+# Многопроцессный режим: при BOT_WORKERS > 1 основной процесс принимает обновления и распределяет
+# их по процессам-обработчикам по chat_id; зависшие и упавшие обработчики перезапускаются
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "2"))  # секунд между сигналами обработчика
+WORKER_HEALTH_INTERVAL = float(os.getenv("WORKER_HEALTH_INTERVAL", "5"))  # секунд между проверками обработчиков
+WORKER_HEALTH_TIMEOUT = float(os.getenv("WORKER_HEALTH_TIMEOUT", "30"))  # секунд без сигнала до перезапуска
+
+# HTTP-клиент бота: адрес Bot API (можно указать локальный тестовый сервер) и размеры пулов
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+BOT_CONNECTION_POOL_SIZE = int(os.getenv("BOT_CONNECTION_POOL_SIZE", "64"))
+BOT_POOL_TIMEOUT = float(os.getenv("BOT_POOL_TIMEOUT", "5"))
+
 # Путь к базе данных
 DB_PATH = os.getenv("DB_PATH", "database/finch.db")
 
+# Число потоков-читателей БД (запись всегда идет через один поток)
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+
+# Групповая запись: сбрасываем накопленные изменения одной транзакцией
+# при WRITE_BATCH_SIZE пользователях в очереди или раз в WRITE_FLUSH_INTERVAL секунд
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "0.2"))
+
+# Повторные запросы: повтор последнего запроса чата в течение COALESCE_WINDOW секунд отбрасывается,
+# результат /portfolio и /report отдается из кэша COALESCE_RESULT_TTL секунд (до другого запроса чата)
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "2"))
+COALESCE_RESULT_TTL = float(os.getenv("COALESCE_RESULT_TTL", "60"))
+COALESCE_MAX_CHATS = int(os.getenv("COALESCE_MAX_CHATS", "100000"))
+
+# Сколько профилей пользователей держать в кэше процесса (LRU)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "50000"))
+
+# Прогресс теста на риск-профиль: сколько хранить незавершенный тест и сколько держать в памяти
+QUIZ_STATE_TTL = float(os.getenv("QUIZ_STATE_TTL", "172800"))  # секунд
+QUIZ_STATE_MAX_SIZE = int(os.getenv("QUIZ_STATE_MAX_SIZE", "10000"))
+
+# Выгрузка пользователей и портфелей (python -m database.export): папка, строк в порции и запас
+# по времени изменения при инкрементальной выгрузке (на случай записей, зафиксированных позже чтения)
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "10000"))
+EXPORT_OVERLAP = float(os.getenv("EXPORT_OVERLAP", "60"))  # секунд
+
+# Путь к локальной истории индексов (рядом с основной БД)
+HISTORY_DB_PATH = os.getenv(
+    "HISTORY_DB_PATH",
+    os.path.join(os.path.dirname(DB_PATH), "history.db")
+)
+
 # Настройки логирования
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FILE = os.getenv("LOG_FILE", "bot.log")
 
+# Метрики: гистограммы задержек, счетчики и датчики; сводка периодически пишется в файл
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True").lower() == "true"
+METRICS_FILE = os.getenv("METRICS_FILE", "metrics.json")
+METRICS_INTERVAL = float(os.getenv("METRICS_INTERVAL", "60"))  # секунд между сохранениями сводки
+
 # Настройки обновления портфеля
 AUTO_REBALANCE = os.getenv("AUTO_REBALANCE", "True").lower() == "true"
 UPDATE_FREQUENCY = os.getenv(
     "UPDATE_FREQUENCY", 
     "quarterly"
 )  # monthly, quarterly, yearly
+REBALANCE_THRESHOLD = float(os.getenv("REBALANCE_THRESHOLD", "5"))  # отклонение доли от целевой, п.п.
+REBALANCE_PAGE_SIZE = int(os.getenv("REBALANCE_PAGE_SIZE", "5000"))  # портфелей за один запрос к БД
+REBALANCE_TICK_INTERVAL = float(os.getenv("REBALANCE_TICK_INTERVAL", "600"))  # секунд между порциями
+
+# Оценка всех портфелей для /report: размер порции и как часто проверять новый торговый день
+VALUATION_CHUNK_SIZE = int(os.getenv("VALUATION_CHUNK_SIZE", "50000"))
+VALUATION_INTERVAL = float(os.getenv("VALUATION_INTERVAL", "3600"))  # секунд
+
+# Оповещения о ценах: как часто сверять значения индексов, сколько оповещений на пользователя
+# и сколько новых оповещений догружать из БД за один запрос
+ALERT_CHECK_INTERVAL = float(os.getenv("ALERT_CHECK_INTERVAL", "60"))  # секунд
+ALERT_MAX_PER_USER = int(os.getenv("ALERT_MAX_PER_USER", "20"))
+ALERT_PAGE_SIZE = int(os.getenv("ALERT_PAGE_SIZE", "10000"))
+# Как часто перечитывать уровни всех оповещений из БД (убирает удаленные командой /alert remove)
+ALERT_RELOAD_INTERVAL = float(os.getenv("ALERT_RELOAD_INTERVAL", "3600"))  # секунд
+
+# Настройки оптимизации портфеля
+RISK_FREE_RATE = float(os.getenv("RISK_FREE_RATE", "0.10"))  # годовая безрисковая ставка
+MIN_ASSET_WEIGHT = int(os.getenv("MIN_ASSET_WEIGHT", "10"))  # минимальная доля класса активов, %
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", "0"))  # процессов для бэктеста по сетке окон, 0 — по числу ядер
+
+# Монте-Карло: вероятность вырасти за горизонт не меньше, чем при GOAL_TARGET_RETURN годовых
+GOAL_TARGET_RETURN = float(os.getenv("GOAL_TARGET_RETURN", "0.07"))
+MC_PATHS = int(os.getenv("MC_PATHS", "20000"))  # число траекторий
+MC_SEED = int(os.getenv("MC_SEED", "42"))  # зерно генератора для воспроизводимости
+MC_SHARD_SIZE = int(os.getenv("MC_SHARD_SIZE", "50000"))  # траекторий в одной порции для пула процессов
+MC_WORKERS = int(os.getenv("MC_WORKERS", "0"))  # процессов для больших симуляций, 0 — по числу ядер
+
+# Лимиты отправки сообщений Telegram
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # сообщений в секунду на бота
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # сообщений в секунду в личный чат
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))  # допустимый всплеск в личном чате
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", str(20 / 60)))  # сообщений в секунду в группу
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))  # повторов после ошибки 429
+BROADCAST_MAX_PENDING = int(os.getenv("BROADCAST_MAX_PENDING", "1000"))  # рассылок в очереди одновременно
+
+# Настройки API MOEX (адрес ISS можно заменить на локальную заглушку)
+MOEX_ISS_URL = os.getenv("MOEX_ISS_URL", "https://iss.moex.com/iss")
+MOEX_INDEX_API = MOEX_ISS_URL + "/engines/stock/markets/index/indices/{}/values.json"
+MOEX_TIMEOUT = float(os.getenv("MOEX_TIMEOUT", "10"))
+MOEX_MAX_CONNECTIONS = int(os.getenv("MOEX_MAX_CONNECTIONS", "10"))
+MOEX_CACHE_TTL = float(os.getenv("MOEX_CACHE_TTL", "60"))  # секунд, значение считается свежим
+MOEX_STALE_TTL = float(os.getenv("MOEX_STALE_TTL", "3600"))  # секунд, отдаем устаревшее и обновляем в фоне
+MOEX_HISTORY_API = MOEX_ISS_URL + "/history/engines/stock/markets/index/securities/{}.json"
+
+# Индексы MOEX, соответствующие классам активов портфеля
+MOEX_INDICES = {
+    "Акции": "IMOEX",
+    "Облигации": "RGBI",
+    "Золото": "RUGOLD"
+}
 
-# Настройки API MOEX
-MOEX_INDEX_API = "https://iss.moex.com/iss/engines/stock/markets/index/indices/{}/values.json"
+# Настройки истории индексов
+HISTORY_TICKERS = os.getenv("HISTORY_TICKERS", "IMOEX,RGBI,RUGOLD").split(",")
+HISTORY_START_DATE = os.getenv("HISTORY_START_DATE", "2015-01-01")
+HISTORY_LOOKBACK_YEARS = int(os.getenv("HISTORY_LOOKBACK_YEARS", "5"))
+HISTORY_REFRESH_INTERVAL = float(os.getenv("HISTORY_REFRESH_INTERVAL", "21600"))  # секунд
+# Как часто фоновая задача проверяет, не пора ли догрузить историю (сама загрузка — не чаще HISTORY_REFRESH_INTERVAL)
+MARKET_DATA_CHECK_INTERVAL = float(os.getenv("MARKET_DATA_CHECK_INTERVAL", "600"))  # секунд
 
-# Проверяем, загружены ли основные переменные
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не найден в .env файле!")
+def validate_config() -> None:
+    """Проверяет настройки, без которых бот не запустится (вызывается при запуске, а не при импорте)"""
+    errors = []
+    if not BOT_TOKEN:
+        errors.append("BOT_TOKEN не найден в .env файле!")
+    if BOT_MODE not in ("polling", "webhook"):
+        errors.append(f"Неизвестный BOT_MODE: {BOT_MODE} (ожидается polling или webhook)")
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        errors.append("Для BOT_MODE=webhook нужно задать WEBHOOK_URL")
+    if BOT_WORKERS < 1:
+        errors.append(f"BOT_WORKERS должно быть не меньше 1, получено {BOT_WORKERS}")
+    if UPDATE_FREQUENCY not in ("monthly", "quarterly", "yearly"):
+        errors.append(f"Неизвестный UPDATE_FREQUENCY: {UPDATE_FREQUENCY}")
+    if errors:
+        raise ValueError("\n".join(errors))
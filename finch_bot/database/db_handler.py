@@ -1,54 +1,266 @@
 """Database handler module for SQLite operations and user data management."""
 
+import asyncio
+import functools
+import json
+import logging
 import sqlite3
-from typing import Optional
-from config import DB_PATH
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from config import DB_PATH, DB_READERS, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL, USER_CACHE_SIZE
+from utils.metrics import METRICS
+
+if TYPE_CHECKING:
+    # NumPy нужен только массовым выборкам и импортируется при первом обращении к ним
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Колонки users, которые можно обновлять групповой записью
+USER_COLUMNS = ("horizon", "goal", "risk_profile")
+
+class UserProfile(NamedTuple):
+    """Строка пользователя из таблицы users"""
+    name: Optional[str]
+    horizon: Optional[str] = None
+    goal: Optional[str] = None
+    risk_profile: Optional[str] = None
+
+# Настройки SQLite: WAL позволяет читать параллельно с записью,
+# synchronous=NORMAL в WAL-режиме делает fsync только на чекпоинтах
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+def _create_base_tables(cursor: sqlite3.Cursor) -> None:
+    """Миграция 1: исходные таблицы пользователей, портфелей и прогресса теста"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT,
+            horizon TEXT,
+            goal TEXT,
+            risk_profile TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS portfolios (
+            user_id INTEGER PRIMARY KEY,
+            portfolio TEXT,
+            expected_return REAL,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS quiz_state (
+            user_id INTEGER PRIMARY KEY,
+            score INTEGER NOT NULL,
+            question_index INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+def _add_portfolio_snapshot_columns(cursor: sqlite3.Cursor) -> None:
+    """Миграция 2: версия снимка рыночных данных и время создания портфеля"""
+    # Базы, созданные до появления версий схемы, могут уже содержать эти колонки
+    cursor.execute("PRAGMA table_info(portfolios)")
+    columns = {row[1] for row in cursor.fetchall()}
+    if "snapshot_version" not in columns:
+        cursor.execute("ALTER TABLE portfolios ADD COLUMN snapshot_version INTEGER")
+    if "created_at" not in columns:
+        cursor.execute("ALTER TABLE portfolios ADD COLUMN created_at REAL")
+
+def _normalize_holdings(cursor: sqlite3.Cursor) -> None:
+    """Миграция 3: доли активов переезжают из JSON-колонки portfolio в таблицу holdings"""
+    cursor.execute('''
+        CREATE TABLE holdings (
+            user_id INTEGER NOT NULL,
+            asset TEXT NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (user_id, asset)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        INSERT INTO holdings (user_id, asset, weight)
+        SELECT portfolios.user_id, item.key, item.value
+        FROM portfolios, json_each(portfolios.portfolio) AS item
+        WHERE json_valid(portfolios.portfolio) AND item.type IN ('integer', 'real')
+    ''')
+    cursor.execute('''
+        CREATE TABLE portfolios_new (
+            user_id INTEGER PRIMARY KEY,
+            expected_return REAL,
+            snapshot_version INTEGER,
+            created_at REAL,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO portfolios_new (user_id, expected_return, snapshot_version, created_at)
+        SELECT user_id, expected_return, snapshot_version, created_at FROM portfolios
+    ''')
+    cursor.execute("DROP TABLE portfolios")
+    cursor.execute("ALTER TABLE portfolios_new RENAME TO portfolios")
+
+def _create_indexes(cursor: sqlite3.Cursor) -> None:
+    """Миграция 4: индексы для запросов по всем пользователям"""
+    # «Все, у кого золота больше 15%» — поиск по диапазону индекса, а не полный перебор
+    cursor.execute("CREATE INDEX IF NOT EXISTS holdings_asset_weight ON holdings (asset, weight)")
+    # «Все портфели, построенные по снимку N»
+    cursor.execute("CREATE INDEX IF NOT EXISTS portfolios_snapshot_version ON portfolios (snapshot_version)")
+    # Удаление устаревших тестов
+    cursor.execute("CREATE INDEX IF NOT EXISTS quiz_state_updated_at ON quiz_state (updated_at)")
+
+def _create_alerts(cursor: sqlite3.Cursor) -> None:
+    """Миграция 5: оповещения о ценах индексов"""
+    # Оповещение срабатывает, когда значение индекса не ниже above или не выше below;
+    # у оповещения о движении на percent % оба уровня отсчитаны от значения base при создании
+    cursor.execute('''
+        CREATE TABLE alerts (
+            alert_id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            above REAL,
+            below REAL,
+            base REAL,
+            percent REAL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX alerts_user ON alerts (user_id)")
+    # Уровни тикера читаются уже отсортированными прямо из индекса
+    cursor.execute("CREATE INDEX alerts_ticker_above ON alerts (ticker, above) WHERE above IS NOT NULL")
+    cursor.execute("CREATE INDEX alerts_ticker_below ON alerts (ticker, below) WHERE below IS NOT NULL")
+
+def _add_change_timestamps(cursor: sqlite3.Cursor) -> None:
+    """Миграция 6: время изменения пользователя для инкрементальной выгрузки"""
+    cursor.execute("ALTER TABLE users ADD COLUMN updated_at REAL")
+    # Выгрузка изменений — поиск по диапазону времени, а не полный перебор таблиц
+    cursor.execute("CREATE INDEX users_updated_at ON users (updated_at)")
+    cursor.execute("CREATE INDEX portfolios_created_at ON portfolios (created_at)")
+
+def _autoincrement_alert_ids(cursor: sqlite3.Cursor) -> None:
+    """Миграция 7: номера оповещений не используются повторно"""
+    # Без AUTOINCREMENT после удаления последнего оповещения его номер получает новое,
+    # а проверка оповещений догружает только номера больше уже прочитанных
+    cursor.execute('''
+        CREATE TABLE alerts_new (
+            alert_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ticker TEXT NOT NULL,
+            above REAL,
+            below REAL,
+            base REAL,
+            percent REAL,
+            created_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO alerts_new (alert_id, user_id, ticker, above, below, base, percent, created_at)
+        SELECT alert_id, user_id, ticker, above, below, base, percent, created_at FROM alerts
+    ''')
+    cursor.execute("DROP TABLE alerts")
+    cursor.execute("ALTER TABLE alerts_new RENAME TO alerts")
+    cursor.execute("CREATE INDEX alerts_user ON alerts (user_id)")
+    cursor.execute("CREATE INDEX alerts_ticker_above ON alerts (ticker, above) WHERE above IS NOT NULL")
+    cursor.execute("CREATE INDEX alerts_ticker_below ON alerts (ticker, below) WHERE below IS NOT NULL")
+
+def _create_job_progress(cursor: sqlite3.Cursor) -> None:
+    """Миграция 8: позиция фоновых проходов по портфелям переживает перезапуск бота"""
+    cursor.execute('''
+        CREATE TABLE job_progress (
+            job TEXT PRIMARY KEY,
+            cursor INTEGER NOT NULL,
+            started_at REAL NOT NULL
+        )
+    ''')
+
+# Миграции схемы по порядку: номер версии схемы (PRAGMA user_version) — номер миграции.
+# Новые миграции добавляются только в конец списка, уже выпущенные не меняются
+MIGRATIONS: Tuple[Callable[[sqlite3.Cursor], None], ...] = (
+    _create_base_tables,
+    _add_portfolio_snapshot_columns,
+    _normalize_holdings,
+    _create_indexes,
+    _create_alerts,
+    _add_change_timestamps,
+    _autoincrement_alert_ids,
+    _create_job_progress,
+)
+
+# Колонки alerts с уровнями срабатывания
+ALERT_SIDES = ("above", "below")
+
+# Строка оповещения: (alert_id, user_id, ticker, above, below, base, percent)
+AlertRow = Tuple[int, int, str, Optional[float], Optional[float], Optional[float], Optional[float]]
+
+# Сработавший уровень: (alert_id, ticker, уровень above или below)
+FiredLevel = Tuple[int, str, float]
 
 class DatabaseHandler:
     """Класс для управления базой данных SQLite"""
-    def __init__(self, db_path: str = DB_PATH):
+    def __init__(self, db_path: str = DB_PATH, readonly: bool = False):
         self.connection = sqlite3.connect(db_path, check_same_thread=False)
         self.cursor = self.connection.cursor()
-        self._create_tables()
+        for pragma in PRAGMAS:
+            self.cursor.execute(pragma)
+        if readonly:
+            self.cursor.execute("PRAGMA query_only = ON")
+        else:
+            self._migrate()
 
-    def _create_tables(self) -> None:
-        """Создает таблицы в базе данных, если они не существуют"""
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                name TEXT,
-                horizon TEXT,
-                goal TEXT,
-                risk_profile TEXT
-            )
-        ''')
+    @property
+    def schema_version(self) -> int:
+        """Текущая версия схемы базы данных"""
+        return self.cursor.execute("PRAGMA user_version").fetchone()[0]
 
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS portfolios (
-                user_id INTEGER PRIMARY KEY,
-                portfolio TEXT,
-                expected_return REAL,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        ''')
-        self.connection.commit()
+    def _migrate(self) -> None:
+        """Применяет недостающие миграции; каждая выполняется в своей транзакции"""
+        version = self.schema_version
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            self.cursor.execute("BEGIN IMMEDIATE")
+            if self.schema_version >= number:
+                # Миграцию уже применил другой процесс, пока мы ждали блокировку записи
+                self.connection.rollback()
+                continue
+            logger.info("Миграция схемы БД до версии %s: %s", number, migration.__doc__)
+            try:
+                migration(self.cursor)
+                self.cursor.execute(f"PRAGMA user_version = {number}")
+            except sqlite3.Error:
+                self.connection.rollback()
+                raise
+            self.connection.commit()
 
     def add_user(self, user_id: int, user_name: str) -> None:
         """Добавляет нового пользователя в базу данных"""
         self.cursor.execute('''
-            INSERT OR IGNORE INTO users (user_id, name) 
-            VALUES (?, ?)
-        ''', (user_id, user_name))
+            INSERT OR IGNORE INTO users (user_id, name, updated_at) 
+            VALUES (?, ?, ?)
+        ''', (user_id, user_name, time.time()))
         self.connection.commit()
 
     def save_goal(self, user_id: int, goal: str) -> None:
         """Сохраняет цель пользователя"""
-        self.cursor.execute("UPDATE users SET goal = ? WHERE user_id = ?", (goal, user_id))
+        self.cursor.execute(
+            "UPDATE users SET goal = ?, updated_at = ? WHERE user_id = ?", (goal, time.time(), user_id)
+        )
         self.connection.commit()
 
     def save_risk_profile(self, user_id: int, risk_profile: str) -> None:
         """Сохраняет риск-профиль пользователя"""
-        self.cursor.execute("UPDATE users SET risk_profile = ? WHERE user_id = ?", (risk_profile, user_id))
+        self.cursor.execute(
+            "UPDATE users SET risk_profile = ?, updated_at = ? WHERE user_id = ?", (risk_profile, time.time(), user_id)
+        )
         self.connection.commit()
 
     def get_user_goal(self, user_id: int) -> Optional[str]:
@@ -63,19 +275,42 @@ class DatabaseHandler:
         result = self.cursor.fetchone()
         return result[0] if result else None
 
-    def save_portfolio(self, user_id: int, portfolio: str, expected_return: float) -> None:
-        """Сохраняет портфель пользователя"""
-        self.cursor.execute(
-            "INSERT OR REPLACE INTO portfolios (user_id, portfolio, expected_return) VALUES (?, ?, ?)",
-            (user_id, portfolio, expected_return)
+    def get_user_horizon(self, user_id: int) -> Optional[str]:
+        """Возвращает временной горизонт инвестирования пользователя"""
+        self.cursor.execute("SELECT horizon FROM users WHERE user_id = ?", (user_id,))
+        result = self.cursor.fetchone()
+        return result[0] if result else None
+
+    def save_portfolio(
+        self,
+        user_id: int,
+        portfolio: Dict[str, float],
+        expected_return: float,
+        snapshot_version: Optional[int] = None,
+        created_at: Optional[float] = None
+    ) -> None:
+        """Сохраняет портфель пользователя и версию снимка рыночных данных, по которому он построен"""
+        batch = WriteBatch()
+        batch.portfolios[user_id] = (
+            portfolio,
+            expected_return,
+            snapshot_version,
+            created_at if created_at is not None else time.time()
         )
-        self.connection.commit()
+        self.apply_batch(batch)
 
-    def get_portfolio(self, user_id: int) -> Optional[str]:
+    def get_portfolio(self, user_id: int) -> Optional[Dict[str, float]]:
         """Возвращает портфель пользователя"""
-        self.cursor.execute("SELECT portfolio FROM portfolios WHERE user_id = ?", (user_id,))
-        result = self.cursor.fetchone()
-        return result[0] if result else None
+        self.cursor.execute("SELECT asset, weight FROM holdings WHERE user_id = ?", (user_id,))
+        return dict(self.cursor.fetchall()) or None
+
+    def get_user_profile(self, user_id: int) -> Optional[UserProfile]:
+        """Возвращает все данные пользователя одним запросом (None, если пользователя нет)"""
+        self.cursor.execute(
+            "SELECT name, horizon, goal, risk_profile FROM users WHERE user_id = ?", (user_id,)
+        )
+        row = self.cursor.fetchone()
+        return UserProfile(*row) if row else None
 
     def close(self) -> None:
         """Закрывает соединение с базой данных"""
@@ -88,8 +323,641 @@ class DatabaseHandler:
 
     def save_horizon(self, user_id: int, horizon: str) -> None:
         """Сохраняет временной горизонт инвестирования пользователя"""
-        self.cursor.execute("UPDATE users SET horizon = ? WHERE user_id = ?", (horizon, user_id))
+        self.cursor.execute(
+            "UPDATE users SET horizon = ?, updated_at = ? WHERE user_id = ?", (horizon, time.time(), user_id)
+        )
+        self.connection.commit()
+
+    def count_portfolios(self, after_user_id: Optional[int] = None) -> int:
+        """Возвращает число сохраненных портфелей (с user_id больше заданного, если он указан)"""
+        if after_user_id is None:
+            self.cursor.execute("SELECT COUNT(*) FROM portfolios")
+        else:
+            self.cursor.execute("SELECT COUNT(*) FROM portfolios WHERE user_id > ?", (after_user_id,))
+        return self.cursor.fetchone()[0]
+
+    def get_job_progress(self, job: str) -> Optional[Tuple[int, float]]:
+        """Возвращает позицию прохода задачи: (последний user_id, время начала прохода)"""
+        self.cursor.execute("SELECT cursor, started_at FROM job_progress WHERE job = ?", (job,))
+        return self.cursor.fetchone()
+
+    def save_job_progress(self, job: str, cursor: int, started_at: float) -> None:
+        """Сохраняет позицию прохода задачи"""
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO job_progress (job, cursor, started_at) VALUES (?, ?, ?)",
+            (job, cursor, started_at)
+        )
+        self.connection.commit()
+
+    def get_holdings_page(
+        self,
+        after_user_id: int,
+        limit: int,
+        assets: Sequence[str],
+        shard: int = 0,
+        shards: int = 1
+    ) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        """Возвращает страницу портфелей с user_id больше заданного в виде массивов:
+        user_id, доли активов в % (портфели × assets, в порядке assets) и время создания (NaN, если неизвестно).
+        При ``shards`` > 1 — только пользователи с user_id mod shards = shard"""
+        import numpy as np
+
+        if shards > 1:
+            # Остаток как в Python (shard_of в sharding.py): в SQLite знак остатка — как у делимого
+            self.cursor.execute(
+                "SELECT user_id, created_at FROM portfolios "
+                "WHERE user_id > ? AND (user_id % ? + ?) % ? = ? ORDER BY user_id LIMIT ?",
+                (after_user_id, shards, shards, shards, shard, limit)
+            )
+        else:
+            self.cursor.execute(
+                "SELECT user_id, created_at FROM portfolios WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (after_user_id, limit)
+            )
+        rows = self.cursor.fetchall()
+        user_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        created_at = np.array([row[1] for row in rows], dtype=np.float64)
+        weights = np.zeros((len(rows), len(assets)))
+        if not rows:
+            return user_ids, weights, created_at
+
+        # Доли всей страницы — один проход по первичному ключу holdings в диапазоне user_id
+        columns = {asset: i for i, asset in enumerate(assets)}
+        self.cursor.execute(
+            "SELECT user_id, asset, weight FROM holdings WHERE user_id > ? AND user_id <= ?",
+            (after_user_id, rows[-1][0])
+        )
+        holdings = [row for row in self.cursor.fetchall() if row[1] in columns]
+        if holdings:
+            holders = np.fromiter((row[0] for row in holdings), dtype=np.int64, count=len(holdings))
+            positions = np.searchsorted(user_ids, holders)
+            found = user_ids[np.minimum(positions, user_ids.size - 1)] == holders
+            asset_columns = np.fromiter((columns[row[1]] for row in holdings), dtype=np.intp, count=len(holdings))
+            values = np.fromiter((row[2] for row in holdings), dtype=np.float64, count=len(holdings))
+            weights[positions[found], asset_columns[found]] = values[found]
+        return user_ids, weights, created_at
+
+    def get_holders(self, asset: str, min_weight: float) -> "np.ndarray":
+        """Возвращает user_id всех пользователей, у которых доля актива больше min_weight (в %)"""
+        import numpy as np
+
+        self.cursor.execute(
+            "SELECT user_id FROM holdings WHERE asset = ? AND weight > ? ORDER BY user_id",
+            (asset, min_weight)
+        )
+        return np.array([row[0] for row in self.cursor.fetchall()], dtype=np.int64)
+
+    def get_snapshot_users(self, snapshot_version: int) -> "np.ndarray":
+        """Возвращает user_id всех пользователей, чей портфель построен по указанной версии рыночных данных"""
+        import numpy as np
+
+        self.cursor.execute(
+            "SELECT user_id FROM portfolios WHERE snapshot_version = ? ORDER BY user_id", (snapshot_version,)
+        )
+        return np.array([row[0] for row in self.cursor.fetchall()], dtype=np.int64)
+
+    def get_quiz_state(self, user_id: int) -> Optional[Tuple[int, int, float]]:
+        """Возвращает прогресс теста на риск-профиль: (баллы, номер вопроса, время обновления)"""
+        self.cursor.execute(
+            "SELECT score, question_index, updated_at FROM quiz_state WHERE user_id = ?", (user_id,)
+        )
+        return self.cursor.fetchone()
+
+    def save_quiz_state(self, user_id: int, score: int, question_index: int, updated_at: float) -> None:
+        """Сохраняет прогресс теста на риск-профиль"""
+        self.cursor.execute(
+            "INSERT OR REPLACE INTO quiz_state (user_id, score, question_index, updated_at) VALUES (?, ?, ?, ?)",
+            (user_id, score, question_index, updated_at)
+        )
+        self.connection.commit()
+
+    def delete_quiz_state(self, user_id: int) -> None:
+        """Удаляет прогресс теста на риск-профиль"""
+        self.cursor.execute("DELETE FROM quiz_state WHERE user_id = ?", (user_id,))
+        self.connection.commit()
+
+    def delete_expired_quiz_states(self, updated_before: float) -> int:
+        """Удаляет незавершенные тесты, которые не обновлялись с указанного момента"""
+        self.cursor.execute("DELETE FROM quiz_state WHERE updated_at < ?", (updated_before,))
+        self.connection.commit()
+        return self.cursor.rowcount
+
+    def add_alert(
+        self,
+        user_id: int,
+        ticker: str,
+        above: Optional[float],
+        below: Optional[float],
+        base: Optional[float] = None,
+        percent: Optional[float] = None
+    ) -> int:
+        """Сохраняет оповещение и возвращает его номер"""
+        self.cursor.execute(
+            "INSERT INTO alerts (user_id, ticker, above, below, base, percent, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (user_id, ticker, above, below, base, percent, time.time())
+        )
+        self.connection.commit()
+        return self.cursor.lastrowid
+
+    def get_user_alerts(self, user_id: int) -> List[AlertRow]:
+        """Возвращает оповещения пользователя"""
+        self.cursor.execute(
+            "SELECT alert_id, user_id, ticker, above, below, base, percent FROM alerts WHERE user_id = ? ORDER BY alert_id",
+            (user_id,)
+        )
+        return self.cursor.fetchall()
+
+    def delete_user_alert(self, user_id: int, alert_id: int) -> bool:
+        """Удаляет оповещение пользователя, возвращает False, если такого нет"""
+        self.cursor.execute("DELETE FROM alerts WHERE alert_id = ? AND user_id = ?", (alert_id, user_id))
         self.connection.commit()
+        return self.cursor.rowcount > 0
+
+    def pop_alerts(self, fired: Sequence[FiredLevel]) -> List[AlertRow]:
+        """Удаляет сработавшие оповещения одним запросом и возвращает те, что еще существовали.
+
+        Оповещение удаляется, только если у него по-прежнему тот же тикер и сработавший уровень.
+        """
+        self.cursor.execute(
+            "DELETE FROM alerts WHERE alert_id IN ("
+            "SELECT alerts.alert_id FROM json_each(?) AS fired "
+            "JOIN alerts ON alerts.alert_id = json_extract(fired.value, '$[0]') "
+            "AND alerts.ticker = json_extract(fired.value, '$[1]') "
+            "AND json_extract(fired.value, '$[2]') IN (alerts.above, alerts.below)"
+            ") RETURNING alert_id, user_id, ticker, above, below, base, percent",
+            (json.dumps(list(fired)),)
+        )
+        rows = self.cursor.fetchall()
+        self.connection.commit()
+        return rows
+
+    def get_max_alert_id(self) -> int:
+        """Возвращает номер последнего оповещения (0, если их нет)"""
+        self.cursor.execute("SELECT MAX(alert_id) FROM alerts")
+        return self.cursor.fetchone()[0] or 0
+
+    def get_alert_tickers(self) -> List[str]:
+        """Возвращает тикеры, по которым есть оповещения"""
+        self.cursor.execute("SELECT DISTINCT ticker FROM alerts")
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def get_alert_levels(self, ticker: str, side: str, max_alert_id: int) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Возвращает уровни срабатывания тикера (side — above или below) по возрастанию и номера их оповещений"""
+        import numpy as np
+
+        if side not in ALERT_SIDES:
+            raise ValueError(f"Неизвестная сторона уровня: {side}")
+        self.cursor.execute(
+            f"SELECT alert_id, {side} FROM alerts INDEXED BY alerts_ticker_{side} "
+            f"WHERE ticker = ? AND {side} IS NOT NULL AND alert_id <= ? ORDER BY {side}",
+            (ticker, max_alert_id)
+        )
+        rows = self.cursor.fetchall()
+        alert_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        levels = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+        return alert_ids, levels
+
+    def get_alerts_after(self, after_alert_id: int, limit: int) -> List[AlertRow]:
+        """Возвращает оповещения с номером больше заданного (по возрастанию номера)"""
+        self.cursor.execute(
+            "SELECT alert_id, user_id, ticker, above, below, base, percent FROM alerts "
+            "WHERE alert_id > ? ORDER BY alert_id LIMIT ?",
+            (after_alert_id, limit)
+        )
+        return self.cursor.fetchall()
+
+    def apply_batch(self, batch: "WriteBatch") -> None:
+        """Применяет накопленные изменения одной транзакцией (один commit на весь пакет)"""
+        now = time.time()
+        with self.connection:
+            self.cursor.executemany(
+                "INSERT OR IGNORE INTO users (user_id, name, updated_at) VALUES (?, ?, ?)",
+                [(user_id, name, now) for user_id, name in batch.new_users.items()]
+            )
+            # Группируем обновления по набору колонок, чтобы выполнить их через executemany
+            by_columns: Dict[Tuple[str, ...], List[Tuple[Any, ...]]] = {}
+            for user_id, values in batch.updates.items():
+                columns = tuple(column for column in USER_COLUMNS if column in values)
+                by_columns.setdefault(columns, []).append(
+                    tuple(values[column] for column in columns) + (now, user_id)
+                )
+            for columns, rows in by_columns.items():
+                assignments = ", ".join(f"{column} = ?" for column in columns)
+                self.cursor.executemany(f"UPDATE users SET {assignments}, updated_at = ? WHERE user_id = ?", rows)
+            self.cursor.executemany(
+                "INSERT OR REPLACE INTO portfolios (user_id, expected_return, snapshot_version, created_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (user_id, expected_return, snapshot_version, created_at)
+                    for user_id, (_, expected_return, snapshot_version, created_at) in batch.portfolios.items()
+                ]
+            )
+            # Новый портфель полностью заменяет доли прежнего
+            self.cursor.executemany(
+                "DELETE FROM holdings WHERE user_id = ?", [(user_id,) for user_id in batch.portfolios]
+            )
+            self.cursor.executemany(
+                "INSERT INTO holdings (user_id, asset, weight) VALUES (?, ?, ?)",
+                [
+                    (user_id, asset, weight)
+                    for user_id, (portfolio, _, _, _) in batch.portfolios.items()
+                    for asset, weight in portfolio.items()
+                ]
+            )
+            self.cursor.executemany(
+                "INSERT OR REPLACE INTO quiz_state (user_id, score, question_index, updated_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(user_id,) + state for user_id, state in batch.quiz_states.items() if state is not None]
+            )
+            self.cursor.executemany(
+                "DELETE FROM quiz_state WHERE user_id = ?",
+                [(user_id,) for user_id, state in batch.quiz_states.items() if state is None]
+            )
+
+class WriteBatch:
+    """Накопленные, еще не записанные изменения, объединенные по user_id"""
+    __slots__ = ("new_users", "updates", "portfolios", "quiz_states")
+
+    def __init__(self):
+        self.new_users: Dict[int, str] = {}
+        self.updates: Dict[int, Dict[str, Any]] = {}
+        self.portfolios: Dict[int, Tuple[Dict[str, float], float, Optional[int], float]] = {}
+        self.quiz_states: Dict[int, Optional[Tuple[int, int, float]]] = {}  # None — удалить
+
+    def __len__(self) -> int:
+        return len(
+            self.new_users.keys() | self.updates.keys() | self.portfolios.keys() | self.quiz_states.keys()
+        )
+
+    def merge(self, older: "WriteBatch") -> None:
+        """Подмешивает более старый пакет, не перетирая более новые значения"""
+        for user_id, name in older.new_users.items():
+            self.new_users.setdefault(user_id, name)
+        for user_id, values in older.updates.items():
+            self.updates[user_id] = {**values, **self.updates.get(user_id, {})}
+        for user_id, portfolio in older.portfolios.items():
+            self.portfolios.setdefault(user_id, portfolio)
+        for user_id, state in older.quiz_states.items():
+            self.quiz_states.setdefault(user_id, state)
+
+class AsyncDatabaseHandler:
+    """Асинхронный доступ к базе данных с теми же методами, что и у DatabaseHandler.
+
+    Запросы никогда не выполняются в потоке цикла событий: запись идет через единственный
+    поток-писатель, чтение — через небольшой пул потоков. У каждого потока свое соединение.
+
+    Изменения пользователей и портфелей копятся в очереди (write-behind), объединяются по
+    user_id и записываются одной транзакцией при WRITE_BATCH_SIZE пользователях или раз в
+    WRITE_FLUSH_INTERVAL секунд. Чтение учитывает еще не записанные изменения,
+    ``close()`` сбрасывает очередь перед остановкой.
+
+    Профили пользователей (строки users) кэшируются в LRU на ``profile_cache_size`` записей:
+    чтение профиля из кэша не обращается к SQLite, а сохранение меняет запись в кэше сразу.
+    Все изменения пользователя проходят через этот процесс (в многопроцессном режиме чат
+    закреплен за одним обработчиком), поэтому кэш не расходится с БД.
+    """
+    def __init__(self, db_path: str = DB_PATH, readers: int = DB_READERS, profile_cache_size: int = USER_CACHE_SIZE):
+        self._db_path = db_path
+        self._local = threading.local()
+        self._handlers: List[DatabaseHandler] = []
+        self._handlers_lock = threading.Lock()
+        self._schema_ready = False
+        self._pending = WriteBatch()
+        self._flushing: Optional[WriteBatch] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        # После ошибки записи следующая попытка ждет таймера, даже если очередь переполнена
+        self._flush_failed = False
+        self.commits = 0
+        # None в кэше — пользователя точно нет в БД
+        self._profiles: "OrderedDict[int, Optional[UserProfile]]" = OrderedDict()
+        self._profile_cache_size = profile_cache_size
+        self._profile_writes = 0
+        # Число записанных пакетов: профиль, прочитанный во время записи пакета, не кэшируется
+        self._flushes = 0
+        METRICS.gauge("db.pending_users", lambda: len(self._pending))
+        METRICS.gauge("db.profiles_cached", lambda: len(self._profiles))
+        self._writer = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="db-writer",
+            initializer=self._open,
+            initargs=(False,)
+        )
+        self._readers = ThreadPoolExecutor(
+            max_workers=readers,
+            thread_name_prefix="db-reader",
+            initializer=self._open,
+            initargs=(True,)
+        )
+
+    def _open(self, readonly: bool) -> None:
+        """Открывает соединение для текущего потока пула"""
+        handler = DatabaseHandler(self._db_path, readonly=readonly)
+        self._local.handler = handler
+        with self._handlers_lock:
+            self._handlers.append(handler)
+
+    def _invoke(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        """Вызывает метод DatabaseHandler на соединении текущего потока и замеряет его длительность"""
+        start = time.perf_counter()
+        try:
+            return getattr(self._local.handler, method)(*args, **kwargs)
+        finally:
+            METRICS.observe(f"db.{method}", time.perf_counter() - start)
+
+    async def _write(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        """Выполняет метод в потоке-писателе"""
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            self._writer, functools.partial(self._invoke, method, *args, **kwargs)
+        )
+        self._schema_ready = True
+        return result
+
+    async def open(self) -> None:
+        """Открывает соединение потока-писателя и применяет миграции схемы.
+
+        Вызывается при запуске бота; без него соединение откроется при первом запросе.
+        """
+        if not self._schema_ready:
+            # Таблицы создает поток-писатель при открытии своего соединения
+            await asyncio.get_running_loop().run_in_executor(self._writer, lambda: None)
+            self._schema_ready = True
+
+    async def _read(self, method: str, *args: Any, **kwargs: Any) -> Any:
+        """Выполняет метод в пуле читателей"""
+        loop = asyncio.get_running_loop()
+        await self.open()
+        return await loop.run_in_executor(
+            self._readers, functools.partial(self._invoke, method, *args, **kwargs)
+        )
+
+    def _enqueued(self) -> None:
+        """Планирует сброс очереди по размеру или по таймеру"""
+        loop = asyncio.get_running_loop()
+        if len(self._pending) >= WRITE_BATCH_SIZE and not self._flush_failed:
+            loop.create_task(self.flush())
+        elif self._flush_timer is None:
+            self._flush_timer = loop.call_later(
+                WRITE_FLUSH_INTERVAL, lambda: loop.create_task(self.flush())
+            )
+
+    async def flush(self) -> None:
+        """Записывает все накопленные изменения одной транзакцией"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not len(self._pending):
+                return
+            batch, self._pending = self._pending, WriteBatch()
+            self._flushing = batch
+            try:
+                await self._write("apply_batch", batch)
+                self._flushes += 1
+                self._flush_failed = False
+                self.commits += 1
+                METRICS.increment("db.commits")
+                METRICS.increment("db.batched_users", len(batch))
+            except Exception:
+                # Сброс обычно запускается задачей, которую никто не ждет: пакет нельзя потерять
+                logger.exception("Не удалось записать пакет из %s пользователей, повторим позже", len(batch))
+                METRICS.increment("db.flush_errors")
+                self._pending.merge(batch)
+                self._flush_failed = True
+                self._enqueued()
+            finally:
+                self._flushing = None
+
+    def _cache_profile(self, user_id: int, profile: Optional[UserProfile]) -> None:
+        """Кладет профиль в LRU-кэш и вытесняет самые давние записи сверх лимита"""
+        self._profiles[user_id] = profile
+        self._profiles.move_to_end(user_id)
+        while len(self._profiles) > self._profile_cache_size:
+            self._profiles.popitem(last=False)
+
+    def _with_pending(
+        self,
+        user_id: int,
+        profile: Optional[UserProfile],
+        batches: Sequence[Optional[WriteBatch]]
+    ) -> Optional[UserProfile]:
+        """Дополняет прочитанный из БД профиль изменениями из пакетов ``batches`` (от старых к новым)"""
+        for batch in batches:
+            if batch is None:
+                continue
+            if profile is None and user_id in batch.new_users:
+                profile = UserProfile(batch.new_users[user_id])
+            if profile is not None and user_id in batch.updates:
+                profile = profile._replace(**batch.updates[user_id])
+        return profile
+
+    async def get_user_profile(self, user_id: int) -> Optional[UserProfile]:
+        """Возвращает профиль пользователя (None, если пользователя нет), по возможности из кэша"""
+        if user_id in self._profiles:
+            self._profiles.move_to_end(user_id)
+            METRICS.increment("db.profiles.hit")
+            return self._profiles[user_id]
+
+        METRICS.increment("db.profiles.miss")
+        writes, flushes = self._profile_writes, self._flushes
+        # Пакеты берем до чтения: записанный во время чтения пакет может не попасть в снимок читателя
+        batches = (self._flushing, self._pending)
+        profile = await self._read("get_user_profile", user_id)
+        profile = self._with_pending(user_id, profile, batches + (self._flushing, self._pending))
+        # Профиль, измененный или записанный во время чтения, не кэшируем: прочитанное могло устареть
+        if writes == self._profile_writes and flushes == self._flushes:
+            self._cache_profile(user_id, profile)
+        return profile
+
+    async def add_user(self, user_id: int, user_name: str) -> None:
+        """Добавляет нового пользователя в базу данных"""
+        self._pending.new_users.setdefault(user_id, user_name)
+        self._profile_writes += 1
+        if user_id in self._profiles and self._profiles[user_id] is None:
+            self._cache_profile(user_id, UserProfile(user_name))
+        self._enqueued()
+
+    async def _save_user_column(self, user_id: int, column: str, value: Any) -> None:
+        """Ставит в очередь обновление колонки пользователя и обновляет его профиль в кэше"""
+        self._pending.updates.setdefault(user_id, {})[column] = value
+        self._profile_writes += 1
+        profile = self._profiles.get(user_id)
+        if profile is not None:
+            self._profiles[user_id] = profile._replace(**{column: value})
+        self._enqueued()
+
+    async def save_goal(self, user_id: int, goal: str) -> None:
+        """Сохраняет цель пользователя"""
+        await self._save_user_column(user_id, "goal", goal)
+
+    async def save_risk_profile(self, user_id: int, risk_profile: str) -> None:
+        """Сохраняет риск-профиль пользователя"""
+        await self._save_user_column(user_id, "risk_profile", risk_profile)
+
+    async def save_horizon(self, user_id: int, horizon: str) -> None:
+        """Сохраняет временной горизонт инвестирования пользователя"""
+        await self._save_user_column(user_id, "horizon", horizon)
+
+    async def save_portfolio(
+        self,
+        user_id: int,
+        portfolio: Dict[str, float],
+        expected_return: float,
+        snapshot_version: Optional[int] = None
+    ) -> None:
+        """Сохраняет портфель пользователя и версию снимка рыночных данных"""
+        self._pending.portfolios[user_id] = (dict(portfolio), expected_return, snapshot_version, time.time())
+        self._enqueued()
+
+    async def get_user_goal(self, user_id: int) -> Optional[str]:
+        """Возвращает цель пользователя"""
+        profile = await self.get_user_profile(user_id)
+        return profile.goal if profile else None
+
+    async def get_user_horizon(self, user_id: int) -> Optional[str]:
+        """Возвращает временной горизонт инвестирования пользователя"""
+        profile = await self.get_user_profile(user_id)
+        return profile.horizon if profile else None
+
+    async def get_risk_profile(self, user_id: int) -> Optional[str]:
+        """Возвращает риск-профиль пользователя"""
+        profile = await self.get_user_profile(user_id)
+        return profile.risk_profile if profile else None
+
+    async def get_portfolio(self, user_id: int) -> Optional[Dict[str, float]]:
+        """Возвращает портфель пользователя"""
+        for batch in (self._pending, self._flushing):
+            if batch is not None and user_id in batch.portfolios:
+                return dict(batch.portfolios[user_id][0])
+        return await self._read("get_portfolio", user_id)
+
+    async def check_user_exists(self, user_id: int) -> bool:
+        """Проверяет существование пользователя в базе данных."""
+        return await self.get_user_profile(user_id) is not None
+
+    async def count_portfolios(self, after_user_id: Optional[int] = None) -> int:
+        """Возвращает число сохраненных портфелей (с user_id больше заданного, если он указан)"""
+        return await self._read("count_portfolios", after_user_id)
+
+    async def get_job_progress(self, job: str) -> Optional[Tuple[int, float]]:
+        """Возвращает позицию прохода задачи: (последний user_id, время начала прохода)"""
+        return await self._read("get_job_progress", job)
+
+    async def save_job_progress(self, job: str, cursor: int, started_at: float) -> None:
+        """Сохраняет позицию прохода задачи"""
+        await self._write("save_job_progress", job, cursor, started_at)
+
+    async def get_holdings_page(
+        self,
+        after_user_id: int,
+        limit: int,
+        assets: Sequence[str],
+        shard: int = 0,
+        shards: int = 1
+    ) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        """Возвращает страницу портфелей в виде массивов (user_id, доли активов в %, время создания)"""
+        return await self._read("get_holdings_page", after_user_id, limit, tuple(assets), shard, shards)
+
+    async def get_user_holdings(
+        self,
+        user_id: int,
+        assets: Sequence[str]
+    ) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+        """Возвращает портфель пользователя в виде массивов, как get_holdings_page, с учетом еще не записанного"""
+        for batch in (self._pending, self._flushing):
+            if batch is not None and user_id in batch.portfolios:
+                import numpy as np
+
+                portfolio, _, _, created_at = batch.portfolios[user_id]
+                return (
+                    np.array([user_id], dtype=np.int64),
+                    np.array([[portfolio.get(asset, 0.0) for asset in assets]], dtype=np.float64),
+                    np.array([created_at], dtype=np.float64)
+                )
+        return await self._read("get_holdings_page", user_id - 1, 1, tuple(assets))
+
+    async def get_holders(self, asset: str, min_weight: float) -> "np.ndarray":
+        """Возвращает user_id всех пользователей, у которых доля актива больше min_weight (в %)"""
+        return await self._read("get_holders", asset, min_weight)
+
+    async def get_snapshot_users(self, snapshot_version: int) -> "np.ndarray":
+        """Возвращает user_id всех пользователей, чей портфель построен по указанной версии рыночных данных"""
+        return await self._read("get_snapshot_users", snapshot_version)
+
+    async def get_quiz_state(self, user_id: int) -> Optional[Tuple[int, int, float]]:
+        """Возвращает прогресс теста на риск-профиль: (баллы, номер вопроса, время обновления)"""
+        for batch in (self._pending, self._flushing):
+            if batch is not None and user_id in batch.quiz_states:
+                return batch.quiz_states[user_id]
+        return await self._read("get_quiz_state", user_id)
+
+    async def save_quiz_state(self, user_id: int, score: int, question_index: int, updated_at: float) -> None:
+        """Сохраняет прогресс теста на риск-профиль"""
+        self._pending.quiz_states[user_id] = (score, question_index, updated_at)
+        self._enqueued()
+
+    async def delete_quiz_state(self, user_id: int) -> None:
+        """Удаляет прогресс теста на риск-профиль"""
+        self._pending.quiz_states[user_id] = None
+        self._enqueued()
+
+    async def delete_expired_quiz_states(self, updated_before: float) -> int:
+        """Удаляет незавершенные тесты, которые не обновлялись с указанного момента"""
+        await self.flush()
+        return await self._write("delete_expired_quiz_states", updated_before)
+
+    async def add_alert(
+        self,
+        user_id: int,
+        ticker: str,
+        above: Optional[float],
+        below: Optional[float],
+        base: Optional[float] = None,
+        percent: Optional[float] = None
+    ) -> int:
+        """Сохраняет оповещение и возвращает его номер"""
+        return await self._write("add_alert", user_id, ticker, above, below, base, percent)
+
+    async def get_user_alerts(self, user_id: int) -> List[AlertRow]:
+        """Возвращает оповещения пользователя"""
+        return await self._read("get_user_alerts", user_id)
+
+    async def delete_user_alert(self, user_id: int, alert_id: int) -> bool:
+        """Удаляет оповещение пользователя, возвращает False, если такого нет"""
+        return await self._write("delete_user_alert", user_id, alert_id)
+
+    async def pop_alerts(self, fired: Sequence[FiredLevel]) -> List[AlertRow]:
+        """Удаляет сработавшие оповещения и возвращает те, что еще существовали"""
+        return await self._write("pop_alerts", list(fired))
+
+    async def get_max_alert_id(self) -> int:
+        """Возвращает номер последнего оповещения (0, если их нет)"""
+        return await self._read("get_max_alert_id")
+
+    async def get_alert_tickers(self) -> List[str]:
+        """Возвращает тикеры, по которым есть оповещения"""
+        return await self._read("get_alert_tickers")
+
+    async def get_alert_levels(self, ticker: str, side: str, max_alert_id: int) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Возвращает уровни срабатывания тикера по возрастанию и номера их оповещений"""
+        return await self._read("get_alert_levels", ticker, side, max_alert_id)
+
+    async def get_alerts_after(self, after_alert_id: int, limit: int) -> List[AlertRow]:
+        """Возвращает оповещения с номером больше заданного"""
+        return await self._read("get_alerts_after", after_alert_id, limit)
+
+    async def close(self) -> None:
+        """Сбрасывает очередь записи, дожидается завершения запросов и закрывает все соединения"""
+        await self.flush()
+        await asyncio.to_thread(self._writer.shutdown, wait=True)
+        await asyncio.to_thread(self._readers.shutdown, wait=True)
+        with self._handlers_lock:
+            for handler in self._handlers:
+                handler.close()
+            self._handlers.clear()
 
 # Создаем экземпляр базы данных
-DB = DatabaseHandler()
+DB = AsyncDatabaseHandler()
@@ -0,0 +1,229 @@
+"""Streaming export of users and portfolios to CSV or Parquet files.
+
+Запуск из папки finch_bot::
+
+    python -m database.export --format csv --output exports
+    python -m database.export --format parquet --incremental
+
+Все таблицы читаются в одной транзакции чтения: в режиме WAL она видит согласованный
+снимок БД и не мешает боту записывать изменения. Строки читаются и записываются порциями
+по ``--chunk-size``, поэтому память не растет с числом пользователей. В инкрементальном
+режиме выгружаются только пользователи и портфели, измененные после прошлой выгрузки
+(с запасом ``EXPORT_OVERLAP`` секунд), — строки могут повторяться и применяются как
+upsert по user_id. Для Parquet нужен пакет pyarrow.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from config import DB_PATH, EXPORT_DIR, EXPORT_CHUNK_SIZE, EXPORT_OVERLAP
+from database.db_handler import MIGRATIONS, DatabaseHandler
+
+# Файл в папке выгрузки с временем последних изменений, попавших в прошлую выгрузку
+STATE_FILE = "export_state.json"
+
+FORMATS = ("csv", "parquet")
+
+class ExportTable(NamedTuple):
+    """Выгружаемая таблица: колонки с типами Arrow, запросы и метка изменений"""
+    name: str
+    columns: Tuple[Tuple[str, str], ...]
+    query: str
+    changed_query: str
+    watermark: str
+
+EXPORT_TABLES = (
+    ExportTable(
+        "users",
+        (
+            ("user_id", "int64"), ("name", "string"), ("horizon", "string"),
+            ("goal", "string"), ("risk_profile", "string"), ("updated_at", "float64")
+        ),
+        "SELECT user_id, name, horizon, goal, risk_profile, updated_at FROM users ORDER BY user_id",
+        "SELECT user_id, name, horizon, goal, risk_profile, updated_at FROM users "
+        "WHERE updated_at > ? ORDER BY updated_at",
+        "users"
+    ),
+    ExportTable(
+        "portfolios",
+        (("user_id", "int64"), ("expected_return", "float64"), ("snapshot_version", "int64"), ("created_at", "float64")),
+        "SELECT user_id, expected_return, snapshot_version, created_at FROM portfolios ORDER BY user_id",
+        "SELECT user_id, expected_return, snapshot_version, created_at FROM portfolios "
+        "WHERE created_at > ? ORDER BY created_at",
+        "portfolios"
+    ),
+    # Доли перезаписываются вместе с портфелем, поэтому изменения определяются по портфелю
+    ExportTable(
+        "holdings",
+        (("user_id", "int64"), ("asset", "string"), ("weight", "float64")),
+        "SELECT user_id, asset, weight FROM holdings ORDER BY user_id, asset",
+        "SELECT holdings.user_id, holdings.asset, holdings.weight FROM portfolios "
+        "JOIN holdings ON holdings.user_id = portfolios.user_id "
+        "WHERE portfolios.created_at > ? ORDER BY portfolios.created_at",
+        "portfolios"
+    ),
+)
+
+# Время последнего изменения каждой таблицы в снимке — отметка для следующей выгрузки
+WATERMARK_QUERIES = {
+    "users": "SELECT max(updated_at) FROM users",
+    "portfolios": "SELECT max(created_at) FROM portfolios",
+}
+
+class CsvTableWriter:
+    """Пишет строки в CSV-файл с заголовком"""
+    def __init__(self, path: str, columns: Sequence[Tuple[str, str]]):
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow([name for name, _ in columns])
+
+    def write(self, rows: List[Tuple[Any, ...]]) -> None:
+        """Дописывает порцию строк"""
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        """Закрывает файл"""
+        self._file.close()
+
+class ParquetTableWriter:
+    """Пишет строки в Parquet-файл: каждая порция — отдельная группа строк"""
+    def __init__(self, path: str, columns: Sequence[Tuple[str, str]]):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as error:
+            raise RuntimeError("Для выгрузки в Parquet установите pyarrow: pip install pyarrow") from error
+        self._pa = pa
+        self._schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in columns])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def write(self, rows: List[Tuple[Any, ...]]) -> None:
+        """Дописывает порцию строк"""
+        arrays = [
+            self._pa.array(values, type=field.type)
+            for values, field in zip(zip(*rows), self._schema)
+        ]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self) -> None:
+        """Дописывает метаданные и закрывает файл"""
+        self._writer.close()
+
+WRITERS = {"csv": CsvTableWriter, "parquet": ParquetTableWriter}
+
+def load_state(path: str) -> Optional[Dict[str, Optional[float]]]:
+    """Отметки прошлой выгрузки (None, если выгрузок еще не было)"""
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as file:
+        return json.load(file)
+
+def save_state(path: str, state: Dict[str, Optional[float]]) -> None:
+    """Сохраняет отметки выгрузки атомарно: файл заменяется только целиком"""
+    with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(state, file, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def export_table(
+    handler: DatabaseHandler,
+    table: ExportTable,
+    path: str,
+    file_format: str,
+    chunk_size: int,
+    since: Optional[float] = None
+) -> int:
+    """Выгружает таблицу (или ее изменения после ``since``) в файл порциями и возвращает число строк"""
+    if since is None:
+        cursor = handler.connection.execute(table.query)
+    else:
+        cursor = handler.connection.execute(table.changed_query, (since,))
+    writer = WRITERS[file_format](f"{path}.tmp", table.columns)
+    count = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            writer.write(rows)
+            count += len(rows)
+    finally:
+        writer.close()
+    # Неполный файл остается с суффиксом .tmp и не попадает под шаблон выгрузки
+    os.replace(f"{path}.tmp", path)
+    return count
+
+def export(
+    output: str = EXPORT_DIR,
+    file_format: str = "csv",
+    incremental: bool = False,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+    overlap: float = EXPORT_OVERLAP,
+    db_path: str = DB_PATH
+) -> Dict[str, int]:
+    """Выгружает пользователей, портфели и доли в папку ``output`` и возвращает число строк по таблицам"""
+    os.makedirs(output, exist_ok=True)
+    state_path = os.path.join(output, STATE_FILE)
+    previous = load_state(state_path) if incremental else None
+    # Микросекунды в имени: выгрузки, запущенные в одну секунду, не перезаписывают друг друга
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+    handler = DatabaseHandler(db_path, readonly=True)
+    try:
+        if handler.schema_version < len(MIGRATIONS):
+            raise RuntimeError("Схема БД устарела: запустите бота, чтобы применить миграции")
+        # Снимок фиксируется первым чтением и держится до конца транзакции
+        handler.cursor.execute("BEGIN")
+        watermarks = {
+            name: handler.cursor.execute(query).fetchone()[0]
+            for name, query in WATERMARK_QUERIES.items()
+        }
+        counts = {}
+        for table in EXPORT_TABLES:
+            since = None
+            if previous is not None and previous.get(table.watermark) is not None:
+                since = previous[table.watermark] - overlap
+            path = os.path.join(output, f"{table.name}-{stamp}.{file_format}")
+            counts[table.name] = export_table(handler, table, path, file_format, chunk_size, since)
+        handler.connection.rollback()
+    finally:
+        handler.close()
+
+    if previous is not None:
+        # Пустая таблица не сдвигает отметку прошлой выгрузки
+        watermarks = {name: value if value is not None else previous.get(name) for name, value in watermarks.items()}
+    save_state(state_path, watermarks)
+    return counts
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Разбирает аргументы командной строки"""
+    parser = argparse.ArgumentParser(description="Выгрузка пользователей и портфелей в CSV или Parquet")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="формат файлов")
+    parser.add_argument("--output", default=EXPORT_DIR, help="папка для файлов выгрузки")
+    parser.add_argument("--incremental", action="store_true", help="только изменения после прошлой выгрузки")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="строк в одной порции")
+    parser.add_argument("--db", default=DB_PATH, help="путь к базе данных")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Запускает выгрузку и печатает число строк по таблицам"""
+    args = parse_args(argv)
+    started = time.perf_counter()
+    try:
+        counts = export(args.output, args.format, args.incremental, args.chunk_size, db_path=args.db)
+    except RuntimeError as error:
+        print(error)
+        return 1
+    mode = "изменения" if args.incremental else "полная"
+    print(f"Выгрузка ({mode}, {args.format}) в {args.output} за {time.perf_counter() - started:.1f} с:")
+    for name, count in counts.items():
+        print(f"  {name}: {count} строк")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
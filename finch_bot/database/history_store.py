@@ -0,0 +1,170 @@
+"""Local SQLite storage of daily index closes used for return and volatility statistics."""
+
+import sqlite3
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from config import HISTORY_DB_PATH
+
+# Даты храним как int32 (дни от 1970-01-01), цены закрытия как float64
+DATE_DTYPE = np.int32
+CLOSE_DTYPE = np.float64
+
+class HistoryStore:
+    """Хранилище дневных цен закрытия индексов.
+
+    Одна строка таблицы содержит упакованные массивы дат и цен за один год по одному тикеру,
+    поэтому чтение истории — это несколько ``np.frombuffer`` без Python-объекта на каждый день.
+    """
+    def __init__(self, db_path: str = HISTORY_DB_PATH):
+        self._db_path = db_path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._version = 0
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def open(self) -> sqlite3.Connection:
+        """Открывает соединение с базой истории при первом обращении и создает таблицы"""
+        if self._connection is None:
+            with self._open_lock:
+                if self._connection is None:
+                    connection = sqlite3.connect(self._db_path, check_same_thread=False)
+                    self._create_tables(connection)
+                    self._version = self._read_version(connection)
+                    self._connection = connection
+        return self._connection
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Соединение с базой истории"""
+        return self.open()
+
+    @property
+    def version(self) -> int:
+        """Версия данных: увеличивается при каждом добавлении новых точек"""
+        self.open()
+        return self._version
+
+    @staticmethod
+    def _create_tables(connection: sqlite3.Connection) -> None:
+        """Создает таблицы истории, если они не существуют"""
+        with connection:
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS index_history (
+                    ticker TEXT NOT NULL,
+                    year INTEGER NOT NULL,
+                    dates BLOB NOT NULL,
+                    closes BLOB NOT NULL,
+                    PRIMARY KEY (ticker, year)
+                ) WITHOUT ROWID
+            ''')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS history_meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            ''')
+
+    @staticmethod
+    def _read_version(connection: sqlite3.Connection) -> int:
+        """Возвращает сохраненную версию данных"""
+        row = connection.execute("SELECT value FROM history_meta WHERE key = 'version'").fetchone()
+        return row[0] if row else 0
+
+    def append(self, ticker: str, dates: np.ndarray, closes: np.ndarray) -> int:
+        """Добавляет (или перезаписывает) дневные цены закрытия и возвращает число новых точек."""
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        closes = np.asarray(closes, dtype=CLOSE_DTYPE)
+        if dates.size == 0:
+            return 0
+
+        days = dates.astype(np.int64).astype(DATE_DTYPE)
+        years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+        added = 0
+
+        with self._lock, self.connection:
+            for year in np.unique(years):
+                mask = years == year
+                new_days, new_closes = days[mask], closes[mask]
+                row = self.connection.execute(
+                    "SELECT dates, closes FROM index_history WHERE ticker = ? AND year = ?",
+                    (ticker, int(year))
+                ).fetchone()
+                old_size = 0
+                if row:
+                    old_days = np.frombuffer(row[0], dtype=DATE_DTYPE)
+                    old_size = old_days.size
+                    new_days = np.concatenate((old_days, new_days))
+                    new_closes = np.concatenate((np.frombuffer(row[1], dtype=CLOSE_DTYPE), new_closes))
+
+                # Сортируем и оставляем последнее значение для повторяющихся дат
+                order = np.argsort(new_days, kind='stable')
+                new_days, new_closes = new_days[order], new_closes[order]
+                keep = np.append(new_days[1:] != new_days[:-1], True)
+                new_days, new_closes = new_days[keep], new_closes[keep]
+                added += new_days.size - old_size
+
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO index_history (ticker, year, dates, closes) VALUES (?, ?, ?, ?)",
+                    (ticker, int(year), new_days.tobytes(), new_closes.tobytes())
+                )
+
+            if added:
+                # Версию увеличиваем в самой БД: историю могут дописывать несколько процессов
+                self._version = self.connection.execute(
+                    "INSERT INTO history_meta (key, value) VALUES ('version', 1) "
+                    "ON CONFLICT (key) DO UPDATE SET value = value + 1 RETURNING value"
+                ).fetchone()[0]
+            self._arrays.pop(ticker, None)
+        return added
+
+    def refresh(self) -> bool:
+        """Подхватывает данные, добавленные другими процессами; возвращает True, если версия изменилась"""
+        with self._lock:
+            version = self._read_version(self.connection)
+            if version == self._version:
+                return False
+            self._version = version
+            self._arrays.clear()
+        return True
+
+    def load(self, ticker: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Возвращает непрерывные массивы дат (datetime64[D]) и цен закрытия тикера."""
+        arrays = self._arrays.get(ticker)
+        if arrays is not None:
+            return arrays
+
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT dates, closes FROM index_history WHERE ticker = ? ORDER BY year",
+                (ticker,)
+            ).fetchall()
+            days = np.concatenate(
+                [np.frombuffer(row[0], dtype=DATE_DTYPE) for row in rows] or [np.empty(0, DATE_DTYPE)]
+            )
+            closes = np.concatenate(
+                [np.frombuffer(row[1], dtype=CLOSE_DTYPE) for row in rows] or [np.empty(0, CLOSE_DTYPE)]
+            )
+            arrays = (days.astype('datetime64[D]'), closes)
+            for array in arrays:
+                array.flags.writeable = False
+            self._arrays[ticker] = arrays
+        return arrays
+
+    def last_date(self, ticker: str) -> Optional[np.datetime64]:
+        """Возвращает последнюю сохраненную дату по тикеру"""
+        dates, _ = self.load(ticker)
+        return dates[-1] if dates.size else None
+
+    def close(self) -> None:
+        """Закрывает соединение с базой истории, если оно было открыто"""
+        with self._open_lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+# Создаем экземпляр хранилища истории
+HISTORY = HistoryStore()
@@ -0,0 +1,83 @@
+"""Bounded, persistent storage of risk profile quiz progress."""
+
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from config import QUIZ_STATE_TTL, QUIZ_STATE_MAX_SIZE
+from database.db_handler import DB, AsyncDatabaseHandler
+from utils.metrics import METRICS
+
+class QuizState:
+    """Прогресс пользователя в тесте на риск-профиль"""
+    __slots__ = ("score", "question_index", "updated_at")
+
+    def __init__(self, score: int = 0, question_index: int = 0, updated_at: float = 0.0):
+        self.score = score
+        self.question_index = question_index
+        self.updated_at = updated_at
+
+class QuizStateStore:
+    """Хранилище прогресса теста с вытеснением по TTL и ограниченным LRU-кэшем в памяти.
+
+    Все изменения сохраняются в БД, поэтому вытеснение из памяти и перезапуск бота
+    не сбрасывают незавершенный тест. Тесты старше ``ttl`` секунд удаляются.
+    """
+    def __init__(
+        self,
+        db: AsyncDatabaseHandler = DB,
+        ttl: float = QUIZ_STATE_TTL,
+        max_size: int = QUIZ_STATE_MAX_SIZE
+    ):
+        self._db = db
+        self._ttl = ttl
+        self._max_size = max_size
+        self._states: "OrderedDict[int, QuizState]" = OrderedDict()
+        METRICS.gauge("quiz_states.cached", lambda: len(self._states))
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def _remember(self, user_id: int, state: QuizState) -> None:
+        """Кладет состояние в LRU-кэш и вытесняет самые старые записи сверх лимита"""
+        self._states[user_id] = state
+        self._states.move_to_end(user_id)
+        while len(self._states) > self._max_size:
+            self._states.popitem(last=False)
+
+    async def get(self, user_id: int) -> Optional[QuizState]:
+        """Возвращает прогресс пользователя или None, если теста нет или он устарел"""
+        state = self._states.get(user_id)
+        METRICS.increment("quiz_states.hit" if state is not None else "quiz_states.miss")
+        if state is None:
+            row = await self._db.get_quiz_state(user_id)
+            if row is None:
+                return None
+            state = QuizState(*row)
+
+        if time.time() - state.updated_at > self._ttl:
+            await self.delete(user_id)
+            return None
+        self._remember(user_id, state)
+        return state
+
+    async def save(self, user_id: int, state: QuizState) -> None:
+        """Сохраняет прогресс пользователя"""
+        state.updated_at = time.time()
+        self._remember(user_id, state)
+        await self._db.save_quiz_state(user_id, state.score, state.question_index, state.updated_at)
+
+    async def delete(self, user_id: int) -> None:
+        """Удаляет прогресс пользователя (тест завершен или устарел)"""
+        self._states.pop(user_id, None)
+        await self._db.delete_quiz_state(user_id)
+
+    async def purge_expired(self) -> int:
+        """Удаляет устаревшие тесты из памяти и из БД, возвращает число удаленных записей в БД"""
+        cutoff = time.time() - self._ttl
+        for user_id in [user_id for user_id, state in self._states.items() if state.updated_at < cutoff]:
+            del self._states[user_id]
+        return await self._db.delete_expired_quiz_states(cutoff)
+
+# Создаем хранилище прогресса теста
+QUIZ_STATES = QuizStateStore()
@@ -0,0 +1,200 @@
+"""Price alerts on MOEX indices matched against sorted per-ticker threshold arrays."""
+
+import logging
+import time
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import numpy as np
+from telegram.ext import CallbackContext
+
+from config import ALERT_PAGE_SIZE, ALERT_RELOAD_INTERVAL
+from database.db_handler import DB, ALERT_SIDES, AlertRow, AsyncDatabaseHandler, FiredLevel
+from services.data_fetcher import MOEX, MoexClient
+from services.dispatcher import broadcast
+from utils.helpers import format_value
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+class ThresholdBook:
+    """Уровни оповещений одного тикера, отсортированные по возрастанию.
+
+    Уровни ``above`` срабатывают, когда значение не ниже уровня, — это всегда начало массива;
+    уровни ``below`` — когда значение не выше уровня, это всегда его конец. Поэтому поиск
+    сработавших — два двоичных поиска, а удаление — срез массива без копирования.
+    """
+    __slots__ = ("above_levels", "above_ids", "below_levels", "below_ids")
+
+    def __init__(self):
+        self.above_levels = self.below_levels = np.empty(0, dtype=np.float64)
+        self.above_ids = self.below_ids = np.empty(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self.above_ids.size + self.below_ids.size
+
+    def add(self, side: str, levels: np.ndarray, alert_ids: np.ndarray) -> None:
+        """Вставляет уровни в отсортированный массив стороны ``side`` (above или below)"""
+        if not levels.size:
+            return
+        order = np.argsort(levels, kind="stable")
+        levels, alert_ids = levels[order], alert_ids[order]
+        current_levels = getattr(self, f"{side}_levels")
+        positions = np.searchsorted(current_levels, levels)
+        setattr(self, f"{side}_levels", np.insert(current_levels, positions, levels))
+        setattr(self, f"{side}_ids", np.insert(getattr(self, f"{side}_ids"), positions, alert_ids))
+
+    def match(self, value: float) -> List[Tuple[str, np.ndarray, np.ndarray]]:
+        """Убирает уровни, сработавшие при значении ``value``, и возвращает их: (сторона, уровни, номера)"""
+        above = int(np.searchsorted(self.above_levels, value, side="right"))
+        below = int(np.searchsorted(self.below_levels, value, side="left"))
+        fired = [
+            ("above", self.above_levels[:above], self.above_ids[:above]),
+            ("below", self.below_levels[below:], self.below_ids[below:]),
+        ]
+        self.above_levels, self.above_ids = self.above_levels[above:], self.above_ids[above:]
+        self.below_levels, self.below_ids = self.below_levels[:below], self.below_ids[:below]
+        return [(side, levels, alert_ids) for side, levels, alert_ids in fired if alert_ids.size]
+
+    def discard(self, alert_ids: np.ndarray) -> None:
+        """Убирает уровни оповещений ``alert_ids`` с обеих сторон"""
+        for side in ALERT_SIDES:
+            ids = getattr(self, f"{side}_ids")
+            keep = ~np.isin(ids, alert_ids)
+            if not keep.all():
+                setattr(self, f"{side}_levels", getattr(self, f"{side}_levels")[keep])
+                setattr(self, f"{side}_ids", ids[keep])
+
+def format_alert(row: AlertRow, value: float) -> str:
+    """Текст уведомления о сработавшем оповещении"""
+    _, _, ticker, above, below, base, percent = row
+    if percent is not None:
+        change = (value / base - 1) * 100
+        return (
+            f"🚨 {ticker} изменился на {change:+.2f}% (порог ±{percent:g}%)\n"
+            f"📊 {format_value(base)} → {format_value(value)}"
+        )
+    if above is not None and value >= above:
+        return f"🚨 {ticker} поднялся до {format_value(value)} (уровень {format_value(above)})"
+    return f"🚨 {ticker} опустился до {format_value(value)} (уровень {format_value(below)})"
+
+class AlertEngine:
+    """Проверяет оповещения пользователей при каждом обновлении значений индексов.
+
+    Уровни всех оповещений хранятся в памяти в ``ThresholdBook`` по тикерам; при запуске
+    они читаются из индексов БД уже отсортированными, новые оповещения догружаются по номеру.
+    Сработавшие оповещения удаляются из БД одним запросом, и уведомление уходит только по тем,
+    что еще существовали, — так отмененные пользователем или уже отправленные не повторяются.
+    Уровни удаленных командой /alert remove (в любом процессе) пропадают из памяти при
+    перечитывании всех уровней раз в ``reload_interval`` секунд.
+    """
+    def __init__(
+        self,
+        db: AsyncDatabaseHandler = DB,
+        moex: MoexClient = MOEX,
+        page_size: int = ALERT_PAGE_SIZE,
+        reload_interval: float = ALERT_RELOAD_INTERVAL
+    ):
+        self._db = db
+        self._moex = moex
+        self._page_size = page_size
+        self._reload_interval = reload_interval
+        self._books: Dict[str, ThresholdBook] = {}
+        self._last_alert_id: Optional[int] = None
+        self._loaded_at = 0.0
+        METRICS.gauge("alerts.levels", lambda: sum(len(book) for book in self._books.values()))
+
+    def _book(self, ticker: str) -> ThresholdBook:
+        """Уровни тикера (создаются при первом оповещении)"""
+        book = self._books.get(ticker)
+        if book is None:
+            book = self._books[ticker] = ThresholdBook()
+        return book
+
+    def add_rows(self, rows: Iterable[AlertRow]) -> None:
+        """Добавляет уровни оповещений, сгруппировав их по тикерам и сторонам"""
+        grouped: Dict[Tuple[str, str], Tuple[List[float], List[int]]] = {}
+        for alert_id, _, ticker, above, below, _, _ in rows:
+            for side, level in zip(ALERT_SIDES, (above, below)):
+                if level is not None:
+                    levels, alert_ids = grouped.setdefault((ticker, side), ([], []))
+                    levels.append(level)
+                    alert_ids.append(alert_id)
+        for (ticker, side), (levels, alert_ids) in grouped.items():
+            self._book(ticker).add(side, np.array(levels, dtype=np.float64), np.array(alert_ids, dtype=np.int64))
+
+    async def _load(self) -> None:
+        """Загружает уровни всех оповещений из БД заново"""
+        last_alert_id = await self._db.get_max_alert_id()
+        books: Dict[str, ThresholdBook] = {}
+        for ticker in await self._db.get_alert_tickers():
+            book = books[ticker] = ThresholdBook()
+            for side in ALERT_SIDES:
+                alert_ids, levels = await self._db.get_alert_levels(ticker, side, last_alert_id)
+                setattr(book, f"{side}_levels", levels)
+                setattr(book, f"{side}_ids", alert_ids)
+        self._books = books
+        self._last_alert_id = last_alert_id
+        self._loaded_at = time.monotonic()
+
+    async def sync(self) -> None:
+        """Догружает оповещения, созданные после прошлой проверки (в том числе другими процессами)"""
+        if self._last_alert_id is None or time.monotonic() - self._loaded_at >= self._reload_interval:
+            await self._load()
+        while True:
+            rows = await self._db.get_alerts_after(self._last_alert_id, self._page_size)
+            if not rows:
+                break
+            self.add_rows(rows)
+            self._last_alert_id = rows[-1][0]
+
+    def match(self, values: Mapping[str, Optional[float]]) -> List[Tuple[str, str, np.ndarray, np.ndarray]]:
+        """Убирает уровни, сработавшие при значениях индексов ``values``: (тикер, сторона, уровни, номера)"""
+        return [
+            (ticker, side, levels, alert_ids)
+            for ticker, value in values.items()
+            if value is not None and ticker in self._books
+            for side, levels, alert_ids in self._books[ticker].match(value)
+        ]
+
+    def restore(self, fired: Iterable[Tuple[str, str, np.ndarray, np.ndarray]]) -> None:
+        """Возвращает в книги уровни, которые не удалось отметить сработавшими в БД"""
+        for ticker, side, levels, alert_ids in fired:
+            self._book(ticker).add(side, levels, alert_ids)
+
+    async def check(self) -> List[Tuple[int, str]]:
+        """Проверяет оповещения по текущим значениям индексов и возвращает уведомления (user_id, текст)"""
+        await self.sync()
+        tickers = [ticker for ticker, book in self._books.items() if len(book)]
+        if not tickers:
+            return []
+        values = await self._moex.get_index_values(tickers)
+        with METRICS.timer("alerts.match"):
+            fired = self.match(values)
+        if not fired:
+            return []
+        levels: List[FiredLevel] = [
+            (alert_id, ticker, level)
+            for ticker, _, ticker_levels, alert_ids in fired
+            for alert_id, level in zip(alert_ids.tolist(), ticker_levels.tolist())
+        ]
+        try:
+            rows = await self._db.pop_alerts(levels)
+        except Exception:
+            # Уровни убраны из памяти до удаления из БД: без возврата оповещения не сработают до перезапуска
+            self.restore(fired)
+            raise
+        METRICS.increment("alerts.fired", len(rows))
+        # У сработавшего оповещения о движении в памяти остался уровень с другой стороны
+        for ticker in {row[2] for row in rows if row[6] is not None}:
+            self._book(ticker).discard(np.array([row[0] for row in rows if row[2] == ticker], dtype=np.int64))
+        return [(row[1], format_alert(row, values[row[2]])) for row in rows]
+
+    async def run(self, context: CallbackContext) -> None:
+        """Задача JobQueue: проверяет оповещения и рассылает уведомления"""
+        notifications = await self.check()
+        if notifications:
+            sent, failed = await broadcast(context.bot, notifications)
+            logger.info("Оповещения о ценах: отправлено %s, ошибок %s", sent, failed)
+
+# Создаем общий обработчик оповещений
+ALERTS = AlertEngine()
@@ -0,0 +1,80 @@
+"""Precomputed allocations and expected returns for every (horizon, goal, risk profile) combination."""
+
+import asyncio
+from types import MappingProxyType
+from typing import Iterable, Mapping, NamedTuple, Optional, Tuple
+
+from config import MOEX_INDICES
+from database.history_store import HISTORY, HistoryStore
+from services.data_fetcher import MOEX
+from services.portfolio_logic import (
+    PROFILE_OBJECTIVES,
+    calculate_expected_return,
+    generate_portfolio,
+    profile_key
+)
+
+# Варианты ответов из commands/start.py (horizon_X, goal_X) и профили из commands/risk_profile.py
+HORIZONS = ("1", "2", "3")
+GOALS = ("1", "2", "3")
+PROFILES = tuple(PROFILE_OBJECTIVES)
+
+class Allocation(NamedTuple):
+    """Готовый портфель (доли в %) и его ожидаемая доходность (% годовых)"""
+    portfolio: Mapping[str, float]
+    expected_return: float
+
+class AllocationTable(NamedTuple):
+    """Неизменяемая таблица портфелей, построенная по одной версии рыночных данных"""
+    version: int
+    entries: Mapping[Tuple[str, str, str], Allocation]
+
+    def lookup(self, horizon: Optional[str], goal: Optional[str], risk_profile: Optional[str]) -> Optional[Allocation]:
+        """Возвращает портфель для параметров пользователя или None, если сочетания нет в таблице."""
+        return self.entries.get((horizon, goal, profile_key(risk_profile)))
+
+_table: Optional[AllocationTable] = None
+
+def build_allocation_table(store: HistoryStore = HISTORY) -> AllocationTable:
+    """Рассчитывает портфели и доходности для всех сочетаний горизонта, цели и риск-профиля."""
+    version = store.version
+    entries = {}
+    for horizon in HORIZONS:
+        for goal in GOALS:
+            for profile in PROFILES:
+                portfolio = generate_portfolio(profile, horizon, goal, store)
+                entries[(horizon, goal, profile)] = Allocation(
+                    portfolio=MappingProxyType(portfolio),
+                    expected_return=calculate_expected_return(portfolio, store)
+                )
+    return AllocationTable(version=version, entries=MappingProxyType(entries))
+
+def current_table(store: HistoryStore = HISTORY) -> AllocationTable:
+    """Возвращает опубликованную таблицу портфелей, строя ее при первом обращении."""
+    table = _table
+    if table is None:
+        table = publish_allocation_table(store)
+    return table
+
+def publish_allocation_table(store: HistoryStore = HISTORY) -> AllocationTable:
+    """Перестраивает таблицу и атомарно публикует ее заменой ссылки."""
+    global _table
+    table = build_allocation_table(store)
+    _table = table
+    return table
+
+async def refresh_market_data(
+    tickers: Iterable[str] = MOEX_INDICES.values(),
+    store: HistoryStore = HISTORY
+) -> AllocationTable:
+    """Догружает историю индексов и перестраивает таблицу в отдельном потоке, только если данные изменились."""
+    await MOEX.sync_history(store, tickers)
+    return await reload_market_data(store)
+
+async def reload_market_data(store: HistoryStore = HISTORY) -> AllocationTable:
+    """Перечитывает историю, догруженную другим процессом, и перестраивает таблицу, если данные изменились."""
+    await asyncio.to_thread(store.refresh)
+    table = _table
+    if table is None or table.version != store.version:
+        table = await asyncio.to_thread(publish_allocation_table, store)
+    return table
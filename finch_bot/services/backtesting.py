@@ -0,0 +1,179 @@
+"""Vectorized backtesting of portfolio allocations over local MOEX index history."""
+
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from config import UPDATE_FREQUENCY, RISK_FREE_RATE, BACKTEST_WORKERS
+from database.history_store import HISTORY, HistoryStore
+from services.portfolio_logic import ASSETS, TRADING_DAYS, aligned_prices
+
+# Период ребалансировки в месяцах для каждого значения UPDATE_FREQUENCY
+REBALANCE_MONTHS = {"monthly": 1, "quarterly": 3, "yearly": 12}
+
+# Сколько значений (дни × портфели) считать за один проход, чтобы ограничить память
+MAX_CELLS = 20_000_000
+
+Weights = Union[Mapping[str, float], Sequence[float], np.ndarray]
+
+class BacktestResult(NamedTuple):
+    """Показатели портфелей за период (по одному значению на портфель, в %; Шарп — безразмерный)"""
+    start: np.datetime64
+    end: np.datetime64
+    cagr: np.ndarray
+    volatility: np.ndarray
+    max_drawdown: np.ndarray
+    sharpe: np.ndarray
+
+def as_weight_matrix(weights: Weights) -> np.ndarray:
+    """Приводит портфель (словарь, вектор или матрицу долей в % или долях) к матрице портфели × ASSETS с суммой строк 1."""
+    if isinstance(weights, Mapping):
+        weights = [weights.get(asset, 0.0) for asset in ASSETS]
+    matrix = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    if matrix.shape[1] != len(ASSETS):
+        raise ValueError(f"Ожидается {len(ASSETS)} долей на портфель, получено {matrix.shape[1]}")
+    totals = matrix.sum(axis=1, keepdims=True)
+    if np.any(totals <= 0):
+        raise ValueError("Сумма долей портфеля должна быть положительной")
+    return matrix / totals
+
+def rebalance_starts(dates: np.ndarray, frequency: str = UPDATE_FREQUENCY) -> np.ndarray:
+    """Возвращает индексы дней ребалансировки: первый торговый день каждого периода."""
+    if dates.size == 0:
+        return np.empty(0, dtype=np.intp)
+    months = dates.astype('datetime64[M]').astype(np.int64)
+    periods = months // REBALANCE_MONTHS.get(frequency, REBALANCE_MONTHS["quarterly"])
+    return np.concatenate([[0], np.flatnonzero(np.diff(periods)) + 1])
+
+def simulate(prices: np.ndarray, weights: np.ndarray, starts: np.ndarray) -> np.ndarray:
+    """Возвращает стоимость портфелей (дни × портфели, начальная стоимость 1) с ребалансировкой в дни ``starts``.
+
+    Между ребалансировками количество бумаг не меняется, поэтому стоимость в день t —
+    стоимость на начало периода, умноженная на (цены_t / цены_начала) · доли. Все дни
+    и все портфели считаются двумя матричными умножениями, без цикла по дням.
+    """
+    days = np.arange(prices.shape[0])
+    segment = np.searchsorted(starts, days, side='right') - 1
+    growth = (prices / prices[starts[segment]]) @ weights.T
+    # Рост за каждый завершенный период и стоимость на начало каждого периода
+    period_growth = (prices[starts[1:]] / prices[starts[:-1]]) @ weights.T
+    levels = np.vstack([np.ones((1, weights.shape[0])), np.cumprod(period_growth, axis=0)])
+    return levels[segment] * growth
+
+def performance(values: np.ndarray, years: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Считает CAGR, волатильность, максимальную просадку (в %) и коэффициент Шарпа по стоимости портфелей."""
+    returns = values[1:] / values[:-1] - 1.0
+    cagr = (values[-1] ** (1.0 / years) - 1.0) if years > 0 else np.zeros(values.shape[1])
+    volatility = returns.std(axis=0, ddof=1) * math.sqrt(TRADING_DAYS)
+    drawdown = (1.0 - values / np.maximum.accumulate(values, axis=0)).max(axis=0)
+    annual_return = returns.mean(axis=0) * TRADING_DAYS
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(volatility > 0, (annual_return - RISK_FREE_RATE) / volatility, 0.0)
+    return cagr * 100, volatility * 100, drawdown * 100, sharpe
+
+def backtest_prices(
+    dates: np.ndarray,
+    prices: np.ndarray,
+    weights: Weights,
+    frequency: str = UPDATE_FREQUENCY
+) -> BacktestResult:
+    """Прогоняет портфели по готовой матрице цен (дни × ASSETS).
+
+    Функция не обращается к БД, поэтому ее можно выполнять в отдельном процессе.
+    """
+    matrix = as_weight_matrix(weights)
+    if dates.size < 2:
+        raise ValueError("Для бэктеста нужно хотя бы два торговых дня")
+    starts = rebalance_starts(dates, frequency)
+    years = (dates[-1] - dates[0]).astype(np.int64) / 365.25
+
+    # Большие наборы портфелей считаем кусками, чтобы матрица дни × портфели помещалась в память
+    chunk = max(1, MAX_CELLS // dates.size)
+    parts = [
+        performance(simulate(prices, matrix[i:i + chunk], starts), years)
+        for i in range(0, matrix.shape[0], chunk)
+    ]
+    cagr, volatility, drawdown, sharpe = (np.concatenate(values) for values in zip(*parts))
+    return BacktestResult(dates[0], dates[-1], cagr, volatility, drawdown, sharpe)
+
+def window_prices(
+    dates: np.ndarray,
+    prices: np.ndarray,
+    start: Optional[Union[str, np.datetime64]] = None,
+    end: Optional[Union[str, np.datetime64]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Вырезает из истории дни в интервале [start, end]."""
+    low = 0 if start is None else np.searchsorted(dates, np.datetime64(start, 'D'))
+    high = dates.size if end is None else np.searchsorted(dates, np.datetime64(end, 'D'), side='right')
+    return dates[low:high], prices[low:high]
+
+def backtest(
+    weights: Weights,
+    start: Optional[Union[str, np.datetime64]] = None,
+    end: Optional[Union[str, np.datetime64]] = None,
+    frequency: str = UPDATE_FREQUENCY,
+    store: HistoryStore = HISTORY
+) -> BacktestResult:
+    """Прогоняет один или несколько портфелей по истории индексов MOEX за период [start, end]."""
+    dates, prices = window_prices(*aligned_prices(store), start, end)
+    return backtest_prices(dates, prices, weights, frequency)
+
+def backtest_portfolio(
+    portfolio: Mapping[str, float],
+    start: Optional[Union[str, np.datetime64]] = None,
+    end: Optional[Union[str, np.datetime64]] = None,
+    frequency: str = UPDATE_FREQUENCY,
+    store: HistoryStore = HISTORY
+) -> Dict[str, float]:
+    """Возвращает показатели одного портфеля (доли в %) в виде словаря."""
+    result = backtest(portfolio, start, end, frequency, store)
+    return {
+        "cagr": float(result.cagr[0]),
+        "volatility": float(result.volatility[0]),
+        "max_drawdown": float(result.max_drawdown[0]),
+        "sharpe": float(result.sharpe[0]),
+    }
+
+def rolling_windows(dates: np.ndarray, years: int, step_months: int = 12) -> List[Tuple[np.datetime64, np.datetime64]]:
+    """Возвращает скользящие окна длиной ``years`` лет с шагом ``step_months`` месяцев в пределах истории."""
+    if dates.size == 0:
+        return []
+    first, last = dates[0].astype('datetime64[M]'), dates[-1]
+    windows = []
+    month = first
+    while True:
+        end = (month + np.timedelta64(12 * years, 'M')).astype('datetime64[D]') - np.timedelta64(1, 'D')
+        if end > last:
+            break
+        windows.append((month.astype('datetime64[D]'), end))
+        month = month + np.timedelta64(step_months, 'M')
+    return windows
+
+def backtest_grid(
+    weights: Weights,
+    windows: Sequence[Tuple[Union[str, np.datetime64], Union[str, np.datetime64]]],
+    frequency: str = UPDATE_FREQUENCY,
+    store: HistoryStore = HISTORY,
+    workers: int = BACKTEST_WORKERS
+) -> List[BacktestResult]:
+    """Прогоняет портфели по каждому окну истории, распределяя окна по пулу процессов.
+
+    История читается из БД один раз в текущем процессе; в процессы пула уходят только
+    нужные срезы цен. При ``workers`` = 1 или одном окне пул не создается.
+    """
+    dates, prices = aligned_prices(store)
+    matrix = as_weight_matrix(weights)
+    jobs = [window_prices(dates, prices, start, end) for start, end in windows]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) <= 1:
+        return [backtest_prices(job_dates, job_prices, matrix, frequency) for job_dates, job_prices in jobs]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        futures = [
+            pool.submit(backtest_prices, job_dates, job_prices, matrix, frequency)
+            for job_dates, job_prices in jobs
+        ]
+        return [future.result() for future in futures]
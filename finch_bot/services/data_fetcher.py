@@ -0,0 +1,198 @@
+"""Module for fetching market data from the MOEX ISS API."""
+
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import httpx
+
+from config import (
+    MOEX_INDEX_API,
+    MOEX_HISTORY_API,
+    MOEX_TIMEOUT,
+    MOEX_MAX_CONNECTIONS,
+    MOEX_CACHE_TTL,
+    MOEX_STALE_TTL,
+    HISTORY_START_DATE,
+    HISTORY_REFRESH_INTERVAL
+)
+from utils.metrics import METRICS
+
+if TYPE_CHECKING:
+    # История индексов (NumPy) нужна только для загрузки истории и импортируется при первом обращении
+    import numpy as np
+    from database.history_store import HistoryStore
+
+logger = logging.getLogger(__name__)
+
+def parse_index_value(payload: Dict[str, Any]) -> Optional[float]:
+    """Достает последнее значение индекса из ответа ISS (табличный или extended-формат)."""
+    try:
+        block = payload['values']
+        if isinstance(block, dict):
+            row = block['data'][0]
+            return float(row[block['columns'].index('value')])
+        return float(block[0]['value'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None  # Если данных нет, возвращаем None
+
+class MoexClient:
+    """Асинхронный клиент MOEX ISS с пулом соединений, TTL-кэшем и объединением запросов.
+
+    Значение считается свежим ``ttl`` секунд. До ``stale_ttl`` секунд клиент отдает
+    последнее известное значение и обновляет его в фоне (stale-while-revalidate).
+    Одновременные запросы одного тикера ждут один и тот же запрос к ISS.
+    """
+
+    def __init__(
+        self,
+        ttl: float = MOEX_CACHE_TTL,
+        stale_ttl: float = MOEX_STALE_TTL,
+        transport: Optional[httpx.AsyncBaseTransport] = None
+    ):
+        self._ttl = ttl
+        self._stale_ttl = max(stale_ttl, ttl)
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._cache: Dict[str, Tuple[float, Optional[float]]] = {}  # тикер -> (время, значение)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._history_synced: Dict[str, float] = {}  # тикер -> время последней синхронизации
+        self.upstream_requests = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Возвращает HTTP-клиент с keep-alive пулом, создавая его при первом обращении."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=MOEX_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=MOEX_MAX_CONNECTIONS,
+                    max_keepalive_connections=MOEX_MAX_CONNECTIONS
+                ),
+                transport=self._transport
+            )
+        return self._client
+
+    async def get_index_value(self, index: str) -> Optional[float]:
+        """Возвращает текущее значение индекса, по возможности из кэша."""
+        entry = self._cache.get(index)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self._ttl:
+                METRICS.increment("moex.cache.hit")
+                return entry[1]
+            if age < self._stale_ttl:
+                # Устаревшее значение отдаем сразу — для пользователя это тоже попадание
+                METRICS.increment("moex.cache.hit")
+                METRICS.increment("moex.cache.stale")
+                self._single_flight(index, lambda: self._fetch(index))
+                return entry[1]
+        METRICS.increment("moex.cache.miss")
+        return await asyncio.shield(self._single_flight(index, lambda: self._fetch(index)))
+
+    async def get_index_values(self, indices: Iterable[str]) -> Dict[str, Optional[float]]:
+        """Параллельно получает значения нескольких индексов."""
+        indices = list(indices)
+        values = await asyncio.gather(*(self.get_index_value(index) for index in indices))
+        return dict(zip(indices, values))
+
+    def _single_flight(self, key: str, factory: Callable[[], Awaitable[Any]]) -> asyncio.Task:
+        """Запускает запрос по ключу или возвращает уже идущий (single-flight)."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    async def _fetch(self, index: str) -> Optional[float]:
+        """Запрашивает значение индекса у ISS и кладет его в кэш."""
+        previous = self._cache.get(index)
+        value = None
+        self.upstream_requests += 1
+        try:
+            with METRICS.timer("moex.index"):
+                response = await self._get_client().get(MOEX_INDEX_API.format(index))
+            if response.status_code == 200:
+                value = parse_index_value(response.json())
+            else:
+                logger.warning("MOEX ISS вернул %s для %s", response.status_code, index)
+        except (httpx.HTTPError, ValueError) as error:
+            logger.warning("Не удалось получить %s с MOEX ISS: %s", index, error)
+
+        # При ошибке продлеваем последнее известное значение, чтобы не долбить ISS чаще раза в TTL
+        if value is None and previous is not None:
+            value = previous[1]
+        self._cache[index] = (time.monotonic(), value)
+        return value
+
+    async def fetch_history(self, ticker: str, start: str) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Загружает дневные цены закрытия индекса начиная с даты ``start`` (постранично)."""
+        import numpy as np
+
+        dates, closes = [], []
+        params = {
+            "from": start,
+            "start": 0,
+            "iss.meta": "off",
+            "history.columns": "TRADEDATE,CLOSE"
+        }
+        while True:
+            self.upstream_requests += 1
+            with METRICS.timer("moex.history"):
+                response = await self._get_client().get(MOEX_HISTORY_API.format(ticker), params=params)
+            response.raise_for_status()
+            payload = response.json()
+            rows = payload['history']['data']
+            if not rows:
+                break
+            for trade_date, close in rows:
+                if close is not None:
+                    dates.append(trade_date)
+                    closes.append(close)
+
+            params["start"] += len(rows)
+            cursor = payload.get('history.cursor', {}).get('data')
+            if cursor and params["start"] >= cursor[0][1]:
+                break
+        return np.array(dates, dtype='datetime64[D]'), np.array(closes, dtype=np.float64)
+
+    async def sync_history(self, store: "HistoryStore", tickers: Iterable[str]) -> int:
+        """Догружает в локальное хранилище историю индексов после последней сохраненной даты.
+
+        Каждый тикер синхронизируется не чаще раза в ``HISTORY_REFRESH_INTERVAL``;
+        при недоступности ISS остаются уже сохраненные данные. Возвращает число новых точек.
+        """
+        added = await asyncio.gather(*(self._sync_ticker(store, ticker) for ticker in tickers))
+        return sum(added)
+
+    async def _sync_ticker(self, store: "HistoryStore", ticker: str) -> int:
+        """Синхронизирует историю одного тикера, объединяя одновременные вызовы."""
+        synced_at = self._history_synced.get(ticker)
+        if synced_at is not None and time.monotonic() - synced_at < HISTORY_REFRESH_INTERVAL:
+            return 0
+        return await asyncio.shield(
+            self._single_flight(f"history:{ticker}", lambda: self._download_history(store, ticker))
+        )
+
+    async def _download_history(self, store: "HistoryStore", ticker: str) -> int:
+        """Скачивает недостающие даты и сохраняет их в хранилище."""
+        last_date = await asyncio.to_thread(store.last_date, ticker)
+        start = str(last_date + 1) if last_date is not None else HISTORY_START_DATE
+        try:
+            dates, closes = await self.fetch_history(ticker, start)
+        except (httpx.HTTPError, KeyError, TypeError, ValueError) as error:
+            logger.warning("Не удалось загрузить историю %s с MOEX ISS: %s", ticker, error)
+            return 0
+        finally:
+            self._history_synced[ticker] = time.monotonic()
+        return await asyncio.to_thread(store.append, ticker, dates, closes)
+
+    async def close(self) -> None:
+        """Закрывает пул HTTP-соединений"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+# Создаем общий клиент MOEX ISS
+MOEX = MoexClient()
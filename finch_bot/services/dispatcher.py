@@ -0,0 +1,229 @@
+"""Rate-limit-aware dispatch of outgoing Telegram messages with priorities and backpressure."""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Coroutine, Dict, Iterable, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import BaseRateLimiter, ExtBot
+
+from config import (
+    TELEGRAM_GLOBAL_RATE,
+    TELEGRAM_CHAT_RATE,
+    TELEGRAM_CHAT_BURST,
+    TELEGRAM_GROUP_RATE,
+    TELEGRAM_MAX_RETRIES,
+    BROADCAST_MAX_PENDING
+)
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты запросов: меньше — важнее. Ответы в диалоге идут раньше рассылок
+INTERACTIVE = 0
+BROADCAST = 1
+
+class TokenBucket:
+    """Корзина токенов: ``rate`` запросов в секунду со всплеском до ``capacity``"""
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait_time(self, now: float) -> float:
+        """Сколько секунд ждать до появления токена"""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float) -> None:
+        """Забирает один токен"""
+        self._refill(now)
+        self.tokens -= 1
+
+    def is_idle(self, now: float) -> bool:
+        """Корзина полна — запись можно удалить без потери информации"""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class ChatLimit:
+    """Ограничение одного чата: очередь по порядку отправки и своя корзина токенов"""
+    __slots__ = ("lock", "bucket")
+
+    def __init__(self, bucket: TokenBucket):
+        self.lock = asyncio.Lock()
+        self.bucket = bucket
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """Ограничитель запросов бота с глобальным и поканальным лимитами и приоритетами.
+
+    Подключается через ``Application.builder().rate_limiter(...)``, поэтому через него проходят
+    все отправки (``reply_text``, ``send_message``, ``edit_message_text`` ...). Приоритет
+    передается в ``rate_limit_args`` (по умолчанию INTERACTIVE). Сообщения одного чата
+    отправляются по порядку, глобальные токены выдаются по приоритету, а при 429 отправка
+    приостанавливается на ``retry_after`` и запрос повторяется.
+    """
+    def __init__(
+        self,
+        global_rate: float = TELEGRAM_GLOBAL_RATE,
+        chat_rate: float = TELEGRAM_CHAT_RATE,
+        chat_burst: float = TELEGRAM_CHAT_BURST,
+        group_rate: float = TELEGRAM_GROUP_RATE,
+        max_retries: int = TELEGRAM_MAX_RETRIES
+    ):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._group_rate = group_rate
+        self._max_retries = max_retries
+        self._chats: Dict[Union[int, str], ChatLimit] = {}
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._granter: Optional[asyncio.Task] = None
+        self._paused_until = 0.0
+        METRICS.gauge("telegram.queue_depth", lambda: self.queue_depth)
+
+    async def initialize(self) -> None:
+        """Инициализация не требуется"""
+
+    async def shutdown(self) -> None:
+        """Останавливает выдачу токенов и отменяет ожидающие запросы"""
+        if self._granter is not None:
+            self._granter.cancel()
+            self._granter = None
+        for _, _, waiter in self._waiters:
+            waiter.cancel()
+        self._waiters.clear()
+
+    @property
+    def queue_depth(self) -> int:
+        """Число запросов, ожидающих глобальный токен"""
+        return len(self._waiters)
+
+    def _chat_limit(self, chat_id: Union[int, str]) -> ChatLimit:
+        """Возвращает ограничение чата, периодически удаляя записи простаивающих чатов"""
+        limit = self._chats.get(chat_id)
+        if limit is None:
+            if len(self._chats) >= 10000:
+                now = time.monotonic()
+                for key in [key for key, value in self._chats.items()
+                            if not value.lock.locked() and value.bucket.is_idle(now)]:
+                    del self._chats[key]
+            # Отрицательные и строковые id — группы и каналы, у них свой лимит
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self._group_rate if is_group else self._chat_rate
+            limit = ChatLimit(TokenBucket(rate, 1 if is_group else self._chat_burst))
+            self._chats[chat_id] = limit
+        return limit
+
+    async def _acquire_global(self, priority: int) -> None:
+        """Ждет глобальный токен; при нехватке токены выдаются в порядке приоритета"""
+        now = time.monotonic()
+        if not self._waiters and now >= self._paused_until and self._global.wait_time(now) == 0:
+            self._global.take(now)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        if self._granter is None or self._granter.done():
+            self._granter = asyncio.get_running_loop().create_task(self._grant())
+        await waiter
+
+    async def _grant(self) -> None:
+        """Выдает глобальные токены ожидающим запросам по мере пополнения корзины"""
+        while self._waiters:
+            now = time.monotonic()
+            delay = max(self._paused_until - now, self._global.wait_time(now))
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                self._global.take(now)
+                waiter.set_result(None)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[int]
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        """Отправляет запрос с учетом лимитов, приоритета и повторов после 429"""
+        chat_id = data.get("chat_id")
+        if chat_id is None or endpoint == "answerCallbackQuery":
+            # Запросы без чата (и ответы на нажатия) лимитами на сообщения не ограничены
+            with METRICS.timer(f"telegram.{endpoint}"):
+                return await callback(*args, **kwargs)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+
+        priority = INTERACTIVE if rate_limit_args is None else rate_limit_args
+        limit = self._chat_limit(chat_id)
+        attempt = 0
+        async with limit.lock:
+            while True:
+                delay = limit.bucket.wait_time(time.monotonic())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                limit.bucket.take(time.monotonic())
+                await self._acquire_global(priority)
+                try:
+                    with METRICS.timer(f"telegram.{endpoint}"):
+                        return await callback(*args, **kwargs)
+                except RetryAfter as error:
+                    METRICS.increment("telegram.retry_after")
+                    if attempt >= self._max_retries:
+                        raise
+                    attempt += 1
+                    retry_after = error.retry_after
+                    if not isinstance(retry_after, (int, float)):
+                        retry_after = retry_after.total_seconds()
+                    logger.warning("Лимит Telegram превышен, пауза %s с", retry_after)
+                    self._paused_until = max(self._paused_until, time.monotonic() + retry_after + 0.1)
+
+async def broadcast(
+    bot: ExtBot,
+    messages: Iterable[Tuple[int, str]],
+    max_pending: int = BROADCAST_MAX_PENDING,
+    **kwargs: Any
+) -> Tuple[int, int]:
+    """Рассылает сообщения с низким приоритетом и возвращает (доставлено, не доставлено).
+
+    Одновременно в очереди ограничителя находится не больше ``max_pending`` сообщений:
+    перебор ``messages`` приостанавливается, пока очередь не освободится.
+    """
+    slots = asyncio.Semaphore(max_pending)
+    counts = [0, 0]
+
+    async def send(chat_id: int, text: str) -> None:
+        try:
+            await bot.send_message(chat_id=chat_id, text=text, rate_limit_args=BROADCAST, **kwargs)
+            counts[0] += 1
+        except TelegramError as error:
+            counts[1] += 1
+            logger.warning("Не удалось отправить сообщение пользователю %s: %s", chat_id, error)
+        finally:
+            slots.release()
+
+    tasks = set()
+    for chat_id, text in messages:
+        await slots.acquire()
+        task = asyncio.get_running_loop().create_task(send(chat_id, text))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    return counts[0], counts[1]
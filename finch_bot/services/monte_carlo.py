@@ -0,0 +1,129 @@
+"""Monte Carlo estimate of the probability to reach an investment goal over the user's horizon."""
+
+import math
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from config import MC_PATHS, MC_SEED, MC_SHARD_SIZE, MC_WORKERS, GOAL_TARGET_RETURN
+from database.history_store import HISTORY, HistoryStore
+from services.portfolio_logic import ASSETS, market_moments
+
+# Длительность горизонта в годах для вариантов из commands/start.py (horizon_X)
+HORIZON_YEARS = {"1": 3, "2": 7, "3": 10}
+
+# Сколько результатов симуляции держать в кэше
+CACHE_SIZE = 256
+
+class SimulationResult(NamedTuple):
+    """Итог симуляции: вероятность достичь цели и квантили итогового капитала (1 — вложенная сумма)"""
+    probability: float
+    target: float
+    p10: float
+    median: float
+    p90: float
+    years: int
+
+_cache: "OrderedDict[Tuple[Tuple[float, ...], int, float, int, int, int], SimulationResult]" = OrderedDict()
+_cache_lock = threading.Lock()  # симуляции запускаются из потоков через asyncio.to_thread
+
+def portfolio_moments(weights: np.ndarray, mean: np.ndarray, cov: np.ndarray) -> Tuple[float, float]:
+    """Возвращает месячные среднюю доходность и волатильность портфеля с ежемесячной ребалансировкой.
+
+    Доходность портфеля — w · r, поэтому ее волатильность равна sqrt(wᵀ Σ w)
+    и симулировать можно сразу доходность портфеля, а не каждого актива.
+    """
+    variance = float(weights @ (cov / 12) @ weights)
+    # Ошибки округления не должны давать отрицательную дисперсию
+    return float(weights @ mean / 12), math.sqrt(max(variance, 0.0))
+
+def simulate_shard(mean: float, volatility: float, months: int, paths: int, seed: int, shard: int) -> np.ndarray:
+    """Симулирует ``paths`` траекторий по ``months`` месяцев и возвращает логарифм итогового капитала.
+
+    Все траектории считаются одной операцией над массивом траектории × месяцы.
+    Функция не зависит от состояния модуля, поэтому выполняется и в процессах пула.
+    """
+    rng = np.random.default_rng([seed, shard])
+    # Месячные лог-доходности с поправкой на волатильность (среднее простой доходности сохраняется)
+    drift = math.log1p(mean) - 0.5 * volatility ** 2
+    steps = rng.standard_normal((paths, months))
+    steps *= volatility
+    steps += drift
+    return steps.sum(axis=1)
+
+def run_simulation(
+    mean: float,
+    volatility: float,
+    months: int,
+    paths: int,
+    seed: int = MC_SEED,
+    shard_size: int = MC_SHARD_SIZE,
+    workers: int = MC_WORKERS
+) -> np.ndarray:
+    """Симулирует траектории порциями по ``shard_size``; при нескольких порциях — в пуле процессов.
+
+    У каждой порции свое зерно, поэтому результат не зависит от числа процессов.
+    """
+    shards = [(index, min(shard_size, paths - start)) for index, start in enumerate(range(0, paths, shard_size))]
+    workers = workers or os.cpu_count() or 1
+    if len(shards) == 1 or workers == 1:
+        parts = [simulate_shard(mean, volatility, months, size, seed, index) for index, size in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+            futures = [
+                pool.submit(simulate_shard, mean, volatility, months, size, seed, index)
+                for index, size in shards
+            ]
+            parts = [future.result() for future in futures]
+    return np.concatenate(parts)
+
+def goal_probability(
+    portfolio: Mapping[str, float],
+    horizon: Optional[str],
+    store: HistoryStore = HISTORY,
+    target_return: float = GOAL_TARGET_RETURN,
+    paths: int = MC_PATHS,
+    seed: int = MC_SEED
+) -> Optional[SimulationResult]:
+    """Оценивает вероятность, что портфель (доли в %) за горизонт пользователя вырастет не меньше,
+    чем при ``target_return`` годовых. Возвращает None, если истории для оценки еще нет.
+
+    Результат кэшируется по портфелю, горизонту и версии рыночных данных.
+    """
+    moments = market_moments(store)
+    if moments is None:
+        return None
+    years = HORIZON_YEARS.get(horizon, HORIZON_YEARS["2"])
+    weights = np.array([portfolio.get(asset, 0.0) for asset in ASSETS], dtype=np.float64)
+    if weights.sum() <= 0:
+        return None
+    weights /= weights.sum()
+
+    key = (tuple(np.round(weights, 6)), years, target_return, paths, seed, moments.version)
+    with _cache_lock:
+        result = _cache.get(key)
+        if result is not None:
+            _cache.move_to_end(key)
+            return result
+
+    mean, volatility = portfolio_moments(weights, moments.mean, moments.cov)
+    log_wealth = run_simulation(mean, volatility, years * 12, paths, seed)
+    target = (1 + target_return) ** years
+    p10, median, p90 = np.exp(np.percentile(log_wealth, [10, 50, 90]))
+    result = SimulationResult(
+        probability=float(np.mean(log_wealth >= math.log(target))),
+        target=target,
+        p10=float(p10),
+        median=float(median),
+        p90=float(p90),
+        years=years
+    )
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
@@ -0,0 +1,234 @@
+"""Portfolio construction logic based on local MOEX index history."""
+
+import itertools
+import math
+from functools import lru_cache
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from config import HISTORY_LOOKBACK_YEARS, MOEX_INDICES, RISK_FREE_RATE, MIN_ASSET_WEIGHT
+from database.history_store import HISTORY, HistoryStore
+
+# Число торговых дней в году для годовой нормировки
+TRADING_DAYS = 252
+
+# Доходности по умолчанию (в % годовых), если локальной истории еще нет
+DEFAULT_RETURNS = {"Акции": 10.0, "Облигации": 5.0, "Золото": 7.0}
+
+# Шаблонные портфели на случай, если истории для оптимизации недостаточно
+FALLBACK_PORTFOLIOS = {
+    "Консервативный": {"Облигации": 70, "Акции": 20, "Золото": 10},
+    "Умеренный": {"Облигации": 50, "Акции": 40, "Золото": 10},
+    "Агрессивный": {"Облигации": 30, "Акции": 50, "Золото": 20},
+}
+DEFAULT_PORTFOLIO = {"Облигации": 50, "Акции": 40, "Золото": 10}
+
+# Целевая функция оптимизации для каждого риск-профиля: (метод, уровень риска 0..1)
+PROFILE_OBJECTIVES = {
+    "Консервативный": ("min_variance", 0.0),
+    "Умеренный": ("max_sharpe", 0.0),
+    "Агрессивный": ("target_risk", 0.75),
+}
+
+# Верхняя граница риска (0..1, как ``level`` в target_risk) в зависимости от горизонта:
+# на коротком горизонте просадку не успеть отыграть
+HORIZON_RISK_CAPS = {"1": 0.25, "2": 0.6, "3": 1.0}
+# Цели, для которых граница риска задана отдельно: (горизонт, цель) -> граница
+GOAL_RISK_CAPS = {("1", "1"): 0.0}  # Финансовая подушка — минимальный риск
+
+# Порядок классов активов в векторах весов и доходностей
+ASSETS: Tuple[str, ...] = ("Облигации", "Акции", "Золото")
+
+class MarketMoments(NamedTuple):
+    """Годовые ожидаемые доходности и ковариации классов активов для одной версии данных"""
+    version: int
+    mean: np.ndarray
+    cov: np.ndarray
+
+class Frontier(NamedTuple):
+    """Доходность и риск всех портфелей сетки весов для одной версии данных"""
+    version: int
+    weights: np.ndarray
+    mean: np.ndarray
+    volatility: np.ndarray
+
+# Кэши по хранилищу истории; записи устаревают при смене версии данных
+_moments_cache: Dict[int, MarketMoments] = {}
+_frontier_cache: Dict[int, Frontier] = {}
+_portfolio_cache: Dict[Tuple[int, int, str, float, float], Dict[str, float]] = {}
+
+_stats_cache: Dict[Tuple[int, str], Optional[Tuple[float, float]]] = {}
+_stats_version: Optional[Tuple[int, int]] = None
+
+def lookback_closes(ticker: str, store: HistoryStore = HISTORY) -> np.ndarray:
+    """Возвращает цены закрытия тикера за последние HISTORY_LOOKBACK_YEARS лет."""
+    dates, closes = store.load(ticker)
+    if dates.size == 0:
+        return closes
+    start = np.searchsorted(dates, dates[-1] - np.timedelta64(365 * HISTORY_LOOKBACK_YEARS, 'D'))
+    return closes[start:]
+
+def index_statistics(ticker: str, store: HistoryStore = HISTORY) -> Optional[Tuple[float, float]]:
+    """Возвращает ожидаемую годовую доходность и волатильность индекса (в %) по локальной истории."""
+    global _stats_version
+    if _stats_version != (id(store), store.version):
+        _stats_cache.clear()
+        _stats_version = (id(store), store.version)
+
+    key = (id(store), ticker)
+    if key not in _stats_cache:
+        closes = lookback_closes(ticker, store)
+        if closes.size < 2:
+            _stats_cache[key] = None
+        else:
+            log_returns = np.diff(np.log(closes))
+            mean = log_returns.mean() * TRADING_DAYS
+            volatility = log_returns.std(ddof=1) * math.sqrt(TRADING_DAYS)
+            _stats_cache[key] = (math.expm1(mean) * 100, volatility * 100)
+    return _stats_cache[key]
+
+def expected_asset_returns(store: HistoryStore = HISTORY) -> Dict[str, float]:
+    """Возвращает ожидаемую годовую доходность (в %) каждого класса активов."""
+    returns = {}
+    for asset, ticker in MOEX_INDICES.items():
+        stats = index_statistics(ticker, store)
+        returns[asset] = stats[0] if stats else DEFAULT_RETURNS[asset]
+    return returns
+
+def aligned_prices(store: HistoryStore = HISTORY) -> Tuple[np.ndarray, np.ndarray]:
+    """Возвращает общие торговые даты и матрицу цен закрытия (дни × ASSETS)."""
+    series = [store.load(MOEX_INDICES[asset]) for asset in ASSETS]
+    if any(dates.size == 0 for dates, _ in series):
+        return np.empty(0, dtype='datetime64[D]'), np.empty((0, len(ASSETS)))
+
+    common = series[0][0]
+    for dates, _ in series[1:]:
+        common = np.intersect1d(common, dates, assume_unique=True)
+    prices = np.column_stack([closes[np.searchsorted(dates, common)] for dates, closes in series])
+    return common, prices
+
+def aligned_returns(store: HistoryStore = HISTORY) -> np.ndarray:
+    """Возвращает матрицу дневных доходностей (дни × ASSETS) за последние HISTORY_LOOKBACK_YEARS лет."""
+    dates, prices = aligned_prices(store)
+    if dates.size:
+        prices = prices[dates >= dates[-1] - np.timedelta64(365 * HISTORY_LOOKBACK_YEARS, 'D')]
+    return prices[1:] / prices[:-1] - 1.0
+
+def market_moments(store: HistoryStore = HISTORY) -> Optional[MarketMoments]:
+    """Возвращает годовые доходности и ковариационную матрицу, пересчитывая их только при новых данных."""
+    moments = _moments_cache.get(id(store))
+    if moments is None or moments.version != store.version:
+        returns = aligned_returns(store)
+        if returns.shape[0] <= len(ASSETS):
+            return None
+        moments = MarketMoments(
+            version=store.version,
+            mean=returns.mean(axis=0) * TRADING_DAYS,
+            cov=np.cov(returns, rowvar=False) * TRADING_DAYS
+        )
+        _moments_cache[id(store)] = moments
+    return moments
+
+@lru_cache(maxsize=None)
+def weight_grid(assets: int = len(ASSETS), step: int = 1, min_weight: int = MIN_ASSET_WEIGHT) -> np.ndarray:
+    """Возвращает все long-only портфели с шагом ``step`` % и долей не меньше ``min_weight`` %."""
+    units = (100 - assets * min_weight) // step
+    # «Звезды и перегородки»: каждое сочетание позиций перегородок задает одно разбиение units
+    bars = np.array(list(itertools.combinations(range(units + assets - 1), assets - 1)), dtype=np.int64)
+    bars = bars.reshape(-1, assets - 1)
+    edges = np.hstack([np.full((bars.shape[0], 1), -1), bars, np.full((bars.shape[0], 1), units + assets - 1)])
+    grid = (np.diff(edges, axis=1) - 1) * step + min_weight
+    grid.flags.writeable = False
+    return grid
+
+def efficient_frontier(store: HistoryStore = HISTORY) -> Optional[Frontier]:
+    """Возвращает доходность и волатильность всех портфелей сетки для текущей версии данных."""
+    frontier = _frontier_cache.get(id(store))
+    if frontier is not None and frontier.version == store.version:
+        return frontier
+
+    moments = market_moments(store)
+    if moments is None:
+        return None
+
+    weights = weight_grid() / 100.0
+    frontier = Frontier(
+        version=moments.version,
+        weights=weight_grid(),
+        mean=weights @ moments.mean,
+        volatility=np.sqrt(np.einsum('ij,jk,ik->i', weights, moments.cov, weights))
+    )
+    _frontier_cache[id(store)] = frontier
+    return frontier
+
+def optimize(frontier: Frontier, method: str, level: float = 0.0) -> int:
+    """Возвращает индекс оптимального портфеля сетки для выбранной целевой функции.
+
+    ``min_variance`` — минимальная волатильность, ``max_sharpe`` — максимальный коэффициент Шарпа,
+    ``target_risk`` — максимальная доходность при волатильности не выше заданного уровня
+    (``level`` = 0 соответствует минимальному риску сетки, 1 — максимальному).
+    """
+    if method == "min_variance":
+        return int(np.argmin(frontier.volatility))
+    if method == "max_sharpe":
+        return int(np.argmax((frontier.mean - RISK_FREE_RATE) / frontier.volatility))
+    if method == "target_risk":
+        low, high = frontier.volatility.min(), frontier.volatility.max()
+        allowed = frontier.volatility <= low + level * (high - low)
+        return int(np.argmax(np.where(allowed, frontier.mean, -np.inf)))
+    raise ValueError(f"Неизвестный метод оптимизации: {method}")
+
+def profile_key(risk_profile: Optional[str]) -> Optional[str]:
+    """Выделяет название профиля («Умеренный» и т.п.) из сохраненного текста риск-профиля."""
+    if risk_profile:
+        for key in PROFILE_OBJECTIVES:
+            if key in risk_profile:
+                return key
+    return None
+
+def risk_cap(horizon: Optional[str], goal: Optional[str]) -> float:
+    """Возвращает допустимый уровень риска (0..1) для горизонта и цели пользователя."""
+    return GOAL_RISK_CAPS.get((horizon, goal), HORIZON_RISK_CAPS.get(horizon, 1.0))
+
+def generate_portfolio(
+    risk_profile: str,
+    horizon: Optional[str] = None,
+    goal: Optional[str] = None,
+    store: HistoryStore = HISTORY
+) -> Dict[str, float]:
+    """ Подбирает оптимальный портфель (доли в %) для риск-профиля, горизонта и цели по истории индексов. """
+    key = profile_key(risk_profile)
+    if key is None:
+        return dict(DEFAULT_PORTFOLIO)
+
+    frontier = efficient_frontier(store)
+    if frontier is None:
+        return dict(FALLBACK_PORTFOLIOS[key])
+
+    method, level = PROFILE_OBJECTIVES[key]
+    cap = risk_cap(horizon, goal)
+    cache_key = (id(store), frontier.version, method, level, cap)
+    portfolio = _portfolio_cache.get(cache_key)
+    if portfolio is None:
+        if len(_portfolio_cache) > 64:
+            _portfolio_cache.clear()
+        index = optimize(frontier, method, level)
+        low, high = frontier.volatility.min(), frontier.volatility.max()
+        if frontier.volatility[index] > low + cap * (high - low):
+            index = optimize(frontier, "target_risk", cap)
+        portfolio = dict(zip(ASSETS, frontier.weights[index].tolist()))
+        _portfolio_cache[cache_key] = portfolio
+    return dict(portfolio)
+
+def calculate_expected_return(portfolio: Dict[str, float], store: HistoryStore = HISTORY) -> float:
+    """ Рассчитывает ожидаемую доходность портфеля по локальной истории индексов MOEX. """
+    asset_returns = expected_asset_returns(store)
+
+    # Рассчитываем ожидаемую доходность портфеля
+    expected_return = sum(
+        (weight / 100) * asset_returns.get(asset, 0)
+        for asset, weight in portfolio.items()
+    )
+
+    return expected_return
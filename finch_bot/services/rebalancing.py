@@ -0,0 +1,152 @@
+"""Batch auto-rebalancing: drift of stored portfolios from their target weights."""
+
+import logging
+import math
+import time
+from typing import List, Tuple
+
+import numpy as np
+from telegram.ext import CallbackContext
+
+from config import (
+    UPDATE_FREQUENCY,
+    REBALANCE_THRESHOLD,
+    REBALANCE_PAGE_SIZE,
+    REBALANCE_TICK_INTERVAL
+)
+from database.db_handler import DB, AsyncDatabaseHandler
+from database.history_store import HISTORY, HistoryStore
+from services.dispatcher import broadcast
+from services.portfolio_logic import ASSETS, aligned_prices
+
+logger = logging.getLogger(__name__)
+
+# Длина окна, за которое проверяются все портфели, в зависимости от UPDATE_FREQUENCY
+REBALANCE_WINDOWS = {
+    "monthly": 30 * 86400,
+    "quarterly": 91 * 86400,
+    "yearly": 365 * 86400,
+}
+
+# Имя прохода ребалансировки в таблице job_progress
+REBALANCE_JOB = "rebalance"
+
+# Начальное значение курсора: меньше любого chat_id (у групп они отрицательные)
+FIRST_CURSOR = -(2 ** 63)
+
+def current_weights(
+    targets: np.ndarray,
+    created_at: np.ndarray,
+    store: HistoryStore = HISTORY
+) -> np.ndarray:
+    """Пересчитывает целевые доли (пользователи × ASSETS) с учетом движения цен с момента создания портфеля."""
+    dates, prices = aligned_prices(store)
+    if dates.size == 0:
+        return targets
+
+    # День создания портфеля -> индекс последней торговой даты не позже него
+    created_days = (created_at // 86400).astype('datetime64[D]')
+    start = np.clip(np.searchsorted(dates, created_days, side='right') - 1, 0, dates.size - 1)
+    values = targets * (prices[-1] / prices[start])
+    return values / values.sum(axis=1, keepdims=True)
+
+def compute_drift(
+    targets: np.ndarray,
+    created_at: np.ndarray,
+    store: HistoryStore = HISTORY
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Возвращает текущие доли и максимальное отклонение от целевых (в п.п.) для всех портфелей сразу."""
+    weights = current_weights(targets, created_at, store)
+    return weights, np.abs(weights - targets).max(axis=1) * 100
+
+def normalize_targets(
+    user_ids: np.ndarray,
+    weights: np.ndarray,
+    created_at: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Отбрасывает портфели без долей или даты создания и переводит доли из % в доли от 1."""
+    totals = weights.sum(axis=1)
+    keep = (totals > 0) & ~np.isnan(created_at)
+    return user_ids[keep], weights[keep] / totals[keep, None], created_at[keep]
+
+def format_rebalance_message(weights: np.ndarray, targets: np.ndarray) -> str:
+    """Формирует текст рекомендации по ребалансировке."""
+    lines = [
+        f"{asset}: {current * 100:.0f}% → {target * 100:.0f}%"
+        for asset, current, target in zip(ASSETS, weights, targets)
+    ]
+    return (
+        "🔄 Пора провести ребалансировку портфеля!\n\n"
+        "Доли активов сместились из-за движения рынка (сейчас → цель):\n"
+        + "\n".join(lines)
+    )
+
+class Rebalancer:
+    """Проверяет все портфели порциями, равномерно распределяя работу по окну UPDATE_FREQUENCY.
+
+    Каждый запуск задачи читает из БД страницы по ``page_size`` портфелей, считает отклонение
+    для всей страницы одной матричной операцией и отправляет рекомендации только тем,
+    у кого оно превышает ``threshold``. Курсор по user_id и время начала прохода хранятся
+    в БД, а размер порции считается по оставшимся портфелям и оставшемуся времени окна,
+    поэтому после перезапуска проход продолжается с того же места и укладывается в окно.
+    """
+    def __init__(
+        self,
+        db: AsyncDatabaseHandler = DB,
+        store: HistoryStore = HISTORY,
+        threshold: float = REBALANCE_THRESHOLD,
+        page_size: int = REBALANCE_PAGE_SIZE,
+        tick_interval: float = REBALANCE_TICK_INTERVAL,
+        frequency: str = UPDATE_FREQUENCY
+    ):
+        self._db = db
+        self._store = store
+        self._threshold = threshold
+        self._page_size = page_size
+        self._window = REBALANCE_WINDOWS.get(frequency, REBALANCE_WINDOWS["quarterly"])
+        self._tick_interval = tick_interval
+
+    async def _pass_budget(self, cursor: int, started_at: float, now: float) -> int:
+        """Число портфелей на этот запуск, чтобы оставшаяся часть прохода закончилась к концу окна"""
+        remaining = await self._db.count_portfolios(cursor)
+        ticks_left = max(1, math.ceil((started_at + self._window - now) / self._tick_interval))
+        return math.ceil(remaining / ticks_left)
+
+    async def check_next(self) -> List[Tuple[int, str]]:
+        """Проверяет очередную порцию портфелей и возвращает рекомендации (user_id, текст)."""
+        now = time.time()
+        cursor, started_at = await self._db.get_job_progress(REBALANCE_JOB) or (FIRST_CURSOR, now)
+        budget = await self._pass_budget(cursor, started_at, now)
+        if not budget:
+            if now < started_at + self._window:
+                # Проход уже завершен, следующий начнется с окончанием окна
+                return []
+            cursor, started_at = FIRST_CURSOR, now
+            budget = await self._pass_budget(cursor, started_at, now)
+
+        suggestions = []
+        while budget > 0:
+            user_ids, weights, created_at = await self._db.get_holdings_page(
+                cursor, min(self._page_size, budget), ASSETS
+            )
+            if not user_ids.size:
+                break
+            cursor = int(user_ids[-1])
+            budget -= user_ids.size
+
+            user_ids, targets, created_at = normalize_targets(user_ids, weights, created_at)
+            weights, drift = compute_drift(targets, created_at, self._store)
+            for i in np.flatnonzero(drift > self._threshold):
+                suggestions.append((int(user_ids[i]), format_rebalance_message(weights[i], targets[i])))
+        await self._db.save_job_progress(REBALANCE_JOB, cursor, started_at)
+        return suggestions
+
+    async def run(self, context: CallbackContext) -> None:
+        """Задача JobQueue: проверяет порцию портфелей и отправляет рекомендации"""
+        suggestions = await self.check_next()
+        if suggestions:
+            sent, failed = await broadcast(context.bot, suggestions)
+            logger.info("Рекомендации по ребалансировке: отправлено %s, ошибок %s", sent, failed)
+
+# Создаем общий планировщик ребалансировки
+REBALANCER = Rebalancer()
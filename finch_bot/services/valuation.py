@@ -0,0 +1,209 @@
+"""Fleet-wide valuation of stored portfolios, cached per trading day."""
+
+import asyncio
+import logging
+from typing import Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+from telegram.ext import CallbackContext
+
+from config import VALUATION_CHUNK_SIZE
+from database.db_handler import DB, AsyncDatabaseHandler
+from database.history_store import HISTORY, HistoryStore
+from services.portfolio_logic import ASSETS, aligned_prices
+from services.rebalancing import FIRST_CURSOR, normalize_targets
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+class Valuation(NamedTuple):
+    """Оценка портфеля пользователя на торговый день (доходности в %, доли от 1 в порядке ASSETS)"""
+    as_of: np.datetime64
+    total_return: float
+    day_return: float
+    weights: np.ndarray
+
+class ValuationTable(NamedTuple):
+    """Оценки всех портфелей на торговый день, упорядоченные по user_id"""
+    as_of: np.datetime64
+    user_ids: np.ndarray
+    total_return: np.ndarray
+    day_return: np.ndarray
+    weights: np.ndarray
+
+    def lookup(self, user_id: int) -> Optional[Valuation]:
+        """Ищет оценку пользователя двоичным поиском"""
+        index = int(np.searchsorted(self.user_ids, user_id))
+        if index == self.user_ids.size or self.user_ids[index] != user_id:
+            return None
+        return Valuation(
+            self.as_of,
+            float(self.total_return[index]),
+            float(self.day_return[index]),
+            self.weights[index]
+        )
+
+def value_portfolios(
+    targets: np.ndarray,
+    created_at: np.ndarray,
+    dates: np.ndarray,
+    prices: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Оценивает портфели (целевые доли от 1, портфели × ASSETS) на последний торговый день.
+
+    Доли в день создания портфеля переводятся в количество «единиц» индексов на 1 рубль,
+    после чего стоимость всех портфелей на любой день — одно умножение матрицы на вектор цен.
+    Возвращает доходность с момента создания и за последний день (в %) и текущие доли.
+    """
+    last = dates.size - 1
+    created_days = (created_at // 86400).astype('datetime64[D]')
+    start = np.clip(np.searchsorted(dates, created_days, side='right') - 1, 0, last)
+    units = targets / prices[start]
+    value = units @ prices[last]
+    previous = units @ prices[max(last - 1, 0)]
+    # Портфели, созданные после предпоследнего закрытия, за день еще не изменились
+    day_return = np.where(start < last, value / previous - 1.0, 0.0)
+    weights = units * prices[last] / value[:, None]
+    return (value - 1.0) * 100, day_return * 100, weights
+
+class PortfolioValuator:
+    """Оценивает все сохраненные портфели порциями и хранит результат до следующего торгового дня.
+
+    Полная переоценка читает портфели страницами по ``chunk_size`` и считает каждую страницу
+    одной матричной операцией; результат хранится компактными массивами. Портфели,
+    сохраненные после переоценки, пересчитываются по одному при запросе. Каждая отметка
+    об изменении портфеля получает номер, поэтому переоценка снимает только отметки,
+    сделанные до ее начала, а изменения во время чтения страниц не теряются.
+    В многопроцессном режиме каждый обработчик оценивает только портфели своих чатов.
+    """
+    def __init__(
+        self,
+        db: AsyncDatabaseHandler = DB,
+        store: HistoryStore = HISTORY,
+        chunk_size: int = VALUATION_CHUNK_SIZE
+    ):
+        self._db = db
+        self._store = store
+        self._chunk_size = chunk_size
+        self._table: Optional[ValuationTable] = None
+        self._overrides: Dict[int, Valuation] = {}
+        # Пользователь → номер последней отметки об изменении портфеля
+        self._stale: Dict[int, int] = {}
+        self._invalidations = 0
+        self._revaluation: Optional[asyncio.Task] = None
+        self._shard = 0
+        self._shards = 1
+        self._prices: Optional[Tuple[int, np.ndarray, np.ndarray]] = None
+
+    def _market(self) -> Tuple[np.ndarray, np.ndarray]:
+        """История цен (дни × ASSETS), пересобираемая только при новых данных"""
+        cached = self._prices
+        if cached is None or cached[0] != self._store.version:
+            cached = (self._store.version,) + aligned_prices(self._store)
+            self._prices = cached
+        return cached[1], cached[2]
+
+    def invalidate(self, user_id: int) -> None:
+        """Отмечает, что портфель пользователя изменился и его оценку нужно пересчитать"""
+        self._overrides.pop(user_id, None)
+        self._invalidations += 1
+        self._stale[user_id] = self._invalidations
+
+    async def _revalue_all(self) -> Optional[ValuationTable]:
+        """Оценивает все портфели и публикует новую таблицу"""
+        dates, prices = self._market()
+        if dates.size == 0:
+            return None
+        # Отметки и оценки, сделанные до этого момента, покрывает новая таблица:
+        # изменения из очереди записи попадают в БД до чтения страниц
+        started = self._invalidations
+        overrides = dict(self._overrides)
+        await self._db.flush()
+        cursor = FIRST_CURSOR
+        parts = []
+        with METRICS.timer("valuation.revalue_all"):
+            while True:
+                user_ids, weights, created_at = await self._db.get_holdings_page(
+                    cursor, self._chunk_size, ASSETS, self._shard, self._shards
+                )
+                if not user_ids.size:
+                    break
+                cursor = int(user_ids[-1])
+                user_ids, targets, created_at = normalize_targets(user_ids, weights, created_at)
+                parts.append((user_ids,) + value_portfolios(targets, created_at, dates, prices))
+
+        if not parts:
+            parts.append((np.empty(0, dtype=np.int64), np.empty(0), np.empty(0), np.empty((0, len(ASSETS)))))
+        table = ValuationTable(dates[-1], *(np.concatenate(column) for column in zip(*parts)))
+        self._table = table
+        for user_id, valuation in overrides.items():
+            if self._overrides.get(user_id) is valuation:
+                del self._overrides[user_id]
+        for user_id in [user_id for user_id, number in self._stale.items() if number <= started]:
+            del self._stale[user_id]
+        logger.info("Оценено портфелей: %s на %s", table.user_ids.size, table.as_of)
+        return table
+
+    async def revalue_all(self) -> Optional[ValuationTable]:
+        """Запускает полную переоценку или присоединяется к уже идущей"""
+        if self._revaluation is None or self._revaluation.done():
+            self._revaluation = asyncio.get_running_loop().create_task(self._revalue_all())
+        return await asyncio.shield(self._revaluation)
+
+    async def _value_one(self, user_id: int, dates: np.ndarray, prices: np.ndarray) -> Optional[Valuation]:
+        """Оценивает портфель одного пользователя"""
+        # Только что сохраненный портфель берется из очереди записи, без принудительного коммита
+        user_ids, weights, created_at = await self._db.get_user_holdings(user_id, ASSETS)
+        if not user_ids.size or user_ids[0] != user_id:
+            return None
+        user_ids, targets, created_at = normalize_targets(user_ids, weights, created_at)
+        if not user_ids.size:
+            return None
+        total_return, day_return, current = value_portfolios(targets, created_at, dates, prices)
+        return Valuation(dates[-1], float(total_return[0]), float(day_return[0]), current[0])
+
+    async def get(self, user_id: int) -> Optional[Valuation]:
+        """Возвращает оценку портфеля пользователя на последний торговый день"""
+        dates, prices = self._market()
+        if dates.size == 0:
+            return None
+        override = self._overrides.get(user_id)
+        if override is not None and override.as_of == dates[-1]:
+            METRICS.increment("valuation.hit")
+            return override
+
+        table = self._table
+        if table is not None and table.as_of == dates[-1] and user_id not in self._stale:
+            valuation = table.lookup(user_id)
+            if valuation is not None:
+                METRICS.increment("valuation.hit")
+                return valuation
+
+        METRICS.increment("valuation.miss")
+        marker = self._stale.get(user_id)
+        valuation = await self._value_one(user_id, dates, prices)
+        # Портфель изменился, пока шла оценка: результат не кэшируем
+        changed = self._stale.get(user_id) != marker
+        if table is not None and table.as_of != dates[-1] and self._table is table:
+            # Наступил новый торговый день, а переоценка еще не опубликовала таблицу
+            self._overrides.clear()
+            self._stale.clear()
+            self._table = None
+        if valuation is not None and not changed:
+            self._overrides[user_id] = valuation
+            self._stale.pop(user_id, None)
+        return valuation
+
+    async def run(self, context: CallbackContext) -> None:
+        """Задача JobQueue: переоценивает все портфели, когда появился новый торговый день.
+
+        ``context.job.data`` — (номер обработчика, число обработчиков) в многопроцессном режиме.
+        """
+        if context.job.data:
+            self._shard, self._shards = context.job.data
+        dates, _ = self._market()
+        if dates.size and (self._table is None or self._table.as_of != dates[-1]):
+            await self.revalue_all()
+
+# Создаем общий оценщик портфелей
+VALUATOR = PortfolioValuator()
@@ -0,0 +1,214 @@
+"""Multi-process mode: a front process receives updates and routes them to worker processes by chat_id."""
+
+import asyncio
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from typing import Any, Dict, List, Optional
+
+from telegram import Update
+from telegram.ext import Application, CallbackContext, TypeHandler
+
+from config import (
+    BOT_TOKEN,
+    TELEGRAM_API_URL,
+    METRICS_FILE,
+    WORKER_HEARTBEAT_INTERVAL,
+    WORKER_HEALTH_INTERVAL,
+    WORKER_HEALTH_TIMEOUT
+)
+from utils.helpers import setup_logging, shard_path
+from utils.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Обработчики запускаются в новом интерпретаторе: форк процесса с циклом событий и потоками небезопасен
+CONTEXT = multiprocessing.get_context("spawn")
+
+# Сколько обновлений обработчик забирает из очереди за одно обращение
+RECEIVE_BATCH_SIZE = 100
+
+# Сколько секунд ждать штатного завершения обработчика перед принудительной остановкой
+STOP_TIMEOUT = 10.0
+
+def shard_of(update: Update, shards: int) -> int:
+    """Возвращает номер обработчика для обновления: все обновления одного чата попадают в один процесс"""
+    if update.effective_chat is not None:
+        return update.effective_chat.id % shards
+    if update.effective_user is not None:
+        return update.effective_user.id % shards
+    return 0
+
+def receive(updates: "multiprocessing.Queue[Optional[Dict[str, Any]]]") -> List[Optional[Dict[str, Any]]]:
+    """Ждет хотя бы одно обновление и забирает из очереди уже пришедшие (до RECEIVE_BATCH_SIZE)"""
+    batch = [updates.get()]
+    while batch[-1] is not None and len(batch) < RECEIVE_BATCH_SIZE:
+        try:
+            batch.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+async def send_heartbeats(heartbeat: Any) -> None:
+    """Периодически отмечает, что цикл событий обработчика не завис"""
+    while True:
+        heartbeat.value = time.time()
+        await asyncio.sleep(WORKER_HEARTBEAT_INTERVAL)
+
+async def serve_worker(shard: int, shards: int, updates: "multiprocessing.Queue", heartbeat: Any) -> None:
+    """Запускает приложение бота и передает ему обновления из очереди, пока не придет None"""
+    import bot
+
+    application = bot.build_application(shard, shards)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    heartbeats = asyncio.create_task(send_heartbeats(heartbeat))
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            batch = await loop.run_in_executor(None, receive, updates)
+            for data in batch:
+                if data is None:
+                    return
+                await application.update_queue.put(Update.de_json(data, application.bot))
+    finally:
+        heartbeats.cancel()
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+        if METRICS_FILE:
+            METRICS.write_snapshot(shard_path(METRICS_FILE, shard))
+
+def run_worker(shard: int, shards: int, updates: "multiprocessing.Queue", heartbeat: Any) -> None:
+    """Точка входа процесса-обработчика"""
+    # Ctrl+C получает вся группа процессов; обработчики останавливает основной процесс
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    log_listener = setup_logging()
+    try:
+        asyncio.run(serve_worker(shard, shards, updates, heartbeat))
+    finally:
+        log_listener.stop()
+
+class WorkerProcess:
+    """Процесс-обработчик, его очередь обновлений и время последнего сигнала о работе"""
+    def __init__(self, shard: int, shards: int):
+        self.shard = shard
+        self.shards = shards
+        self.heartbeat = CONTEXT.Value("d", 0.0, lock=False)
+        self.updates: Optional["multiprocessing.Queue"] = None
+        self.process: Optional[multiprocessing.process.BaseProcess] = None
+        self.started_at = 0.0
+
+    def start(self) -> None:
+        """Запускает процесс с новой очередью обновлений"""
+        # Процесс, остановленный во время чтения, мог оставить старую очередь заблокированной,
+        # поэтому обновления, которые он не успел забрать, теряются
+        self.updates = CONTEXT.Queue()
+        self.heartbeat.value = 0.0
+        self.process = CONTEXT.Process(
+            target=run_worker,
+            args=(self.shard, self.shards, self.updates, self.heartbeat),
+            name=f"worker-{self.shard}"
+        )
+        self.process.start()
+        self.started_at = time.time()
+
+    @property
+    def alive(self) -> bool:
+        """Работает ли процесс"""
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def ready(self) -> bool:
+        """Запустил ли процесс приложение бота"""
+        return self.heartbeat.value > 0
+
+    def healthy(self, timeout: float) -> bool:
+        """Процесс работает и его цикл событий отзывался в последние ``timeout`` секунд"""
+        return self.alive and time.time() - max(self.heartbeat.value, self.started_at) <= timeout
+
+    def send(self, data: Dict[str, Any]) -> None:
+        """Ставит обновление в очередь процесса (без ожидания)"""
+        self.updates.put_nowait(data)
+
+    def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        """Просит процесс завершиться и ждет ``timeout`` секунд, после чего останавливает принудительно"""
+        if self.process is None:
+            return
+        if self.process.is_alive() and timeout > 0:
+            self.updates.put_nowait(None)
+            self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        # Не ждем передачи оставшихся в очереди обновлений: читать их уже некому
+        self.updates.cancel_join_thread()
+        self.updates.close()
+
+class ShardRouter:
+    """Распределяет обновления по процессам-обработчикам и перезапускает упавшие и зависшие.
+
+    Обновления одного чата всегда попадают в один процесс и читаются из его очереди по порядку,
+    а внутри процесса порядок сохраняет ChatOrderedUpdateProcessor. Состояние диалогов
+    хранится в общей БД, поэтому перезапущенный обработчик продолжает диалоги с того же шага.
+    """
+    def __init__(self, shards: int, health_timeout: float = WORKER_HEALTH_TIMEOUT):
+        self._timeout = health_timeout
+        self.workers = [WorkerProcess(shard, shards) for shard in range(shards)]
+        METRICS.gauge("workers.alive", lambda: sum(worker.alive for worker in self.workers))
+
+    async def start(self, _: Application) -> None:
+        """Запускает обработчики и ждет, пока они будут готовы принимать обновления"""
+        for worker in self.workers:
+            worker.start()
+        deadline = time.monotonic() + self._timeout
+        while not all(worker.ready for worker in self.workers):
+            if time.monotonic() > deadline:
+                logger.warning("Не все обработчики запустились за %s с", self._timeout)
+                return
+            await asyncio.sleep(0.05)
+        logger.info("Запущено обработчиков: %s", len(self.workers))
+
+    async def stop(self, _: Application) -> None:
+        """Останавливает все обработчики"""
+        await asyncio.gather(*(asyncio.to_thread(worker.stop) for worker in self.workers))
+
+    async def forward(self, update: Update, _: CallbackContext) -> None:
+        """Передает обновление обработчику его чата"""
+        self.workers[shard_of(update, len(self.workers))].send(update.to_dict())
+        METRICS.increment("workers.forwarded")
+
+    async def check_health(self, _: CallbackContext) -> None:
+        """Задача JobQueue: перезапускает обработчики, которые упали или перестали отзываться"""
+        for worker in self.workers:
+            if worker.healthy(self._timeout):
+                continue
+            if worker.alive:
+                logger.warning("Обработчик %s не отвечает, перезапускаем", worker.shard)
+            else:
+                logger.warning("Обработчик %s завершился с кодом %s, перезапускаем", worker.shard, worker.process.exitcode)
+            METRICS.increment("workers.restarts")
+            await asyncio.to_thread(worker.stop, 0)
+            worker.start()
+
+def build_front_application(shards: int) -> Application:
+    """Создает приложение основного процесса: оно только принимает обновления и раздает их обработчикам"""
+    router = ShardRouter(shards)
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(TELEGRAM_API_URL)
+        .post_init(router.start)
+        .post_shutdown(router.stop)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, router.forward))
+    application.job_queue.run_repeating(
+        router.check_health,
+        interval=WORKER_HEALTH_INTERVAL,
+        first=WORKER_HEALTH_INTERVAL
+    )
+    return application
@@ -0,0 +1,104 @@
+"""Per-chat deduplication of repeated updates and sharing of expensive command results."""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, CallbackContext
+
+from config import COALESCE_WINDOW, COALESCE_RESULT_TTL, COALESCE_MAX_CHATS
+from utils.metrics import METRICS
+
+def intent_of(update: Update) -> Optional[Tuple[str, str]]:
+    """Возвращает намерение пользователя: (команда или «callback», содержимое) либо None"""
+    if update.callback_query is not None and update.callback_query.message is not None:
+        query = update.callback_query
+        return "callback", f"{query.message.message_id}:{query.data}"
+    message = update.message
+    if message is not None and message.text and message.text.startswith("/"):
+        command, _, arguments = message.text.partition(" ")
+        return command[1:].split("@", 1)[0].lower(), arguments.strip()
+    return None
+
+class RequestCoalescer:
+    """Отсекает повторы одного и того же запроса и отдает готовые результаты дорогих команд.
+
+    Повтор последнего намерения чата (двойное нажатие кнопки, повторная команда) в течение
+    ``window`` секунд отбрасывается до обработчиков. Результат команд, вычисленных через
+    ``run``, хранится ``ttl`` секунд и повторно не считается; одновременные вызовы с одним
+    ключом ждут одно вычисление. Любой другой запрос чата сбрасывает его результаты,
+    поэтому после изменения профиля команда считается заново.
+    """
+    def __init__(
+        self,
+        window: float = COALESCE_WINDOW,
+        ttl: float = COALESCE_RESULT_TTL,
+        max_chats: int = COALESCE_MAX_CHATS
+    ):
+        self._window = window
+        self._ttl = ttl
+        self._max_chats = max_chats
+        self._last: "OrderedDict[int, Tuple[Tuple[str, str], float]]" = OrderedDict()
+        self._results: "OrderedDict[int, Dict[str, Tuple[float, Any]]]" = OrderedDict()
+        self._inflight: Dict[Tuple[int, str], asyncio.Task] = {}
+        self._cached_commands: Set[str] = set()
+        METRICS.gauge("coalescing.chats", lambda: len(self._last))
+
+    @staticmethod
+    def _remember(cache: "OrderedDict[int, Any]", chat_id: int, value: Any, max_size: int) -> None:
+        """Кладет значение в LRU-словарь по чатам и вытесняет самые давние чаты сверх лимита"""
+        cache[chat_id] = value
+        cache.move_to_end(chat_id)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+    def invalidate(self, chat_id: int) -> None:
+        """Сбрасывает сохраненные результаты команд чата"""
+        self._results.pop(chat_id, None)
+
+    async def deduplicate(self, update: Update, _: CallbackContext) -> None:
+        """Обработчик группы -1: отбрасывает повтор последнего запроса чата в пределах окна"""
+        intent = intent_of(update)
+        if intent is None or update.effective_chat is None:
+            return
+        chat_id = update.effective_chat.id
+        now = time.monotonic()
+        last = self._last.get(chat_id)
+        if last is not None and last[0] == intent and now - last[1] < self._window:
+            METRICS.increment("coalescing.dropped")
+            if update.callback_query is not None:
+                # Убираем «часики» на кнопке, не повторяя действие
+                await update.callback_query.answer()
+            raise ApplicationHandlerStop
+
+        self._remember(self._last, chat_id, (intent, now), self._max_chats)
+        if intent[0] not in self._cached_commands:
+            self.invalidate(chat_id)
+
+    async def run(self, chat_id: int, command: str, factory: Callable[[], Awaitable[Any]]) -> Any:
+        """Возвращает результат команды из кэша, из уже идущего вычисления или вычисляет его"""
+        self._cached_commands.add(command)
+        cached = self._results.get(chat_id, {}).get(command)
+        if cached is not None and time.monotonic() < cached[0]:
+            METRICS.increment("coalescing.result.hit")
+            return cached[1]
+
+        key = (chat_id, command)
+        task = self._inflight.get(key)
+        if task is None:
+            METRICS.increment("coalescing.result.miss")
+            task = asyncio.get_running_loop().create_task(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            METRICS.increment("coalescing.shared")
+        result = await asyncio.shield(task)
+        results = self._results.get(chat_id) or {}
+        results[command] = (time.monotonic() + self._ttl, result)
+        self._remember(self._results, chat_id, results, self._max_chats)
+        return result
+
+# Создаем общий фильтр повторных запросов
+COALESCER = RequestCoalescer()
@@ -1,11 +1,38 @@
 """Utility functions for formatting, validation, logging and other helper operations."""
 
-from typing import Dict
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from config import LOG_LEVEL, LOG_FILE
+
+LOG_FORMAT = '%(asctime)s - %(processName)s - %(name)s - %(levelname)s - %(message)s'
+
+action_logger = logging.getLogger("actions")
 
 def format_portfolio(portfolio: Dict[str, float]) -> str:
     """ Форматирует портфель в удобочитаемый текст. """
     return "\n".join([f"{asset}: {percentage}%" for asset, percentage in portfolio.items()])
 
+def format_years(years: int) -> str:
+    """ Форматирует число лет с правильным окончанием («3 года», «7 лет»). """
+    if years % 10 == 1 and years % 100 != 11:
+        return f"{years} год"
+    if years % 10 in (2, 3, 4) and years % 100 not in (12, 13, 14):
+        return f"{years} года"
+    return f"{years} лет"
+
+def format_value(value: float) -> str:
+    """ Форматирует значение индекса с разделителем разрядов («3 512.40»). """
+    return f"{value:,.2f}".replace(",", " ")
+
+def shard_path(path: str, shard: int) -> str:
+    """ Возвращает отдельный путь к файлу для процесса-обработчика (metrics.json -> metrics.worker-1.json). """
+    root, extension = os.path.splitext(path)
+    return f"{root}.worker-{shard}{extension}"
+
 def validate_risk_input(user_input: str) -> bool:
     """ Проверяет, является ли ввод пользователя допустимым ответом на вопросы риск-профиля. """
     return user_input in ["1", "2", "3"]
@@ -19,7 +46,23 @@ def parse_risk_score(score: int) -> str:
     else:
         return "Агрессивный"
 
+def setup_logging(level: str = LOG_LEVEL, log_file: Optional[str] = LOG_FILE) -> QueueListener:
+    """ Настраивает логирование через очередь: запись в консоль и файл идет в отдельном потоке. """
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers[:] = [QueueHandler(records)]
+    root.setLevel(level.upper())
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
 def log_action(action: str, user_id: int) -> None:
     """ Логирует действие пользователя. """
-    with open("bot.log", "a", encoding="utf-8") as log_file:
-        log_file.write(f"User {user_id}: {action}\n")
+    action_logger.info("User %s: %s", user_id, action)
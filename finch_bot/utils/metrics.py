@@ -0,0 +1,172 @@
+"""Low-overhead runtime metrics: latency histograms, counters, cache hit ratios and queue depths."""
+
+import asyncio
+import bisect
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, Iterator, TypeVar
+
+from telegram.ext import CallbackContext
+
+from config import METRICS_ENABLED, METRICS_FILE
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (секунды): от 0.1 мс до ~52 с с шагом ×2
+BUCKETS = tuple(0.0001 * 2 ** i for i in range(20))
+QUANTILES = (0.5, 0.95, 0.99)
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+class Histogram:
+    """Гистограмма длительностей с фиксированными корзинами; запись — O(log корзин) под блокировкой"""
+    __slots__ = ("counts", "count", "total", "max", "_lock")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        """Добавляет одно измерение"""
+        index = bisect.bisect_left(BUCKETS, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+            if value > self.max:
+                self.max = value
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля сверху: граница корзины, в которую он попал"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(BUCKETS[index], self.max) if index < len(BUCKETS) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        """Сводка в миллисекундах: число измерений, среднее, квантили и максимум"""
+        with self._lock:
+            summary = {
+                "count": self.count,
+                "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+                "max_ms": self.max * 1000,
+            }
+            for q in QUANTILES:
+                summary[f"p{round(q * 100)}_ms"] = self.quantile(q) * 1000
+        return summary
+
+class Metrics:
+    """Реестр метрик процесса.
+
+    Гистограммы можно пополнять из любых потоков (например, из пула соединений БД),
+    счетчики и датчики — из цикла событий. Для пар счетчиков ``<имя>.hit``/``<имя>.miss``
+    в сводке считается доля попаданий. При ``enabled=False`` запись метрик ничего не делает.
+    """
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._histograms: Dict[str, Histogram] = {}
+        self._histograms_lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._started = time.time()
+
+    def histogram(self, name: str) -> Histogram:
+        """Возвращает гистограмму по имени, создавая ее при первом обращении"""
+        histogram = self._histograms.get(name)
+        if histogram is None:
+            with self._histograms_lock:
+                histogram = self._histograms.setdefault(name, Histogram())
+        return histogram
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Записывает длительность в гистограмму"""
+        if self.enabled:
+            self.histogram(name).observe(seconds)
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        """Увеличивает счетчик"""
+        if self.enabled:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def gauge(self, name: str, callback: Callable[[], float]) -> None:
+        """Регистрирует датчик: функция вызывается только при снятии сводки"""
+        self._gauges[name] = callback
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """Замеряет длительность блока кода"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def instrument(self, name: str) -> Callable[[F], F]:
+        """Декоратор асинхронной функции, замеряющий длительность каждого вызова"""
+        def decorator(function: F) -> F:
+            @functools.wraps(function)
+            async def wrapper(*args: Any, **kwargs: Any) -> Any:
+                start = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Возвращает сводку всех метрик"""
+        counters = dict(self._counters)
+        ratios = {}
+        for name in counters:
+            if name.endswith(".hit"):
+                prefix = name[:-len(".hit")]
+                total = counters[name] + counters.get(f"{prefix}.miss", 0)
+                ratios[prefix] = counters[name] / total if total else 0.0
+        gauges = {}
+        for name, callback in list(self._gauges.items()):
+            try:
+                gauges[name] = callback()
+            except Exception:  # датчик не должен ломать сводку
+                logger.exception("Не удалось снять датчик %s", name)
+        with self._histograms_lock:
+            histograms = dict(self._histograms)
+        return {
+            "timestamp": time.time(),
+            "uptime": time.time() - self._started,
+            "latency": {name: histogram.snapshot() for name, histogram in sorted(histograms.items())},
+            "counters": counters,
+            "hit_ratios": ratios,
+            "gauges": gauges,
+        }
+
+    def write_snapshot(self, path: str = METRICS_FILE) -> None:
+        """Атомарно записывает сводку в JSON-файл (через временный файл и переименование)"""
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as snapshot_file:
+            json.dump(self.snapshot(), snapshot_file, ensure_ascii=False, indent=2)
+        os.replace(temporary, path)
+
+# Создаем общий реестр метрик
+METRICS = Metrics()
+
+async def write_metrics_snapshot(context: CallbackContext) -> None:
+    """Задача JobQueue: периодически сохраняет сводку метрик в файл из данных задачи (по умолчанию METRICS_FILE)"""
+    path = context.job.data or METRICS_FILE
+    try:
+        await asyncio.to_thread(METRICS.write_snapshot, path)
+    except OSError as error:
+        logger.warning("Не удалось сохранить метрики в %s: %s", path, error)
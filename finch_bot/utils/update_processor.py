@@ -0,0 +1,68 @@
+"""Concurrent update processing that keeps updates of one chat in order."""
+
+import asyncio
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from utils.metrics import METRICS
+
+class ChatLock:
+    """Блокировка чата и число обновлений, которые ее ждут или держат"""
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных чатов параллельно, а обновления одного чата — по очереди.
+
+    Слот общего лимита ``max_concurrent_updates`` занимается только после того, как чат
+    освободился, поэтому пачка обновлений одного чата не блокирует остальных пользователей.
+    """
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._chats: Dict[int, ChatLock] = {}
+        METRICS.gauge("updates.active_chats", lambda: len(self._chats))
+
+    @staticmethod
+    def _chat_id(update: object) -> Optional[int]:
+        """Возвращает id чата обновления (или пользователя, если чата нет)"""
+        if isinstance(update, Update):
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+            if update.effective_user is not None:
+                return update.effective_user.id
+        return None
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Дожидается предыдущих обновлений того же чата и обрабатывает обновление"""
+        chat_id = self._chat_id(update)
+        if chat_id is None:
+            await super().process_update(update, coroutine)
+            return
+
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = ChatLock()
+        chat.users += 1
+        try:
+            async with chat.lock:
+                await super().process_update(update, coroutine)
+        finally:
+            chat.users -= 1
+            if not chat.users:
+                del self._chats[chat_id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Выполняет обработку обновления"""
+        with METRICS.timer("update"):
+            await coroutine
+
+    async def initialize(self) -> None:
+        """Инициализация не требуется"""
+
+    async def shutdown(self) -> None:
+        """Освобождать нечего: блокировки чатов удаляются сами"""